@@ -0,0 +1,331 @@
+"""
+Admission control for reply generation.
+
+At most ADMISSION_MAX_ACTIVE replies are generated at once (0: no limit). A
+/transcribe that finds no free slot does not wait for one: its turn is queued
+and the webhook answers right away with a filler line and a <Redirect> to
+/pending-reply, which speaks the reply once the queued turn has been
+generated. At most ADMISSION_MAX_QUEUED turns wait; beyond that a turn is
+shed with the canned reply, so a burst of callers costs each of them a short
+delay instead of a webhook timeout for everyone. Streamed replies, which
+already answer through /continue-reply redirects, wait for a slot in their
+background thread.
+
+Queued jobs live in the process that deferred them, but the /pending-reply
+redirect may reach another webhook worker. When the conversation store is
+shared between processes (it offers acquire_lease, as for call_lock), each
+queued turn and its reply are also kept in the call-profiles database, and a
+worker without the job in memory speaks the reply from there.
+
+Queue depth, slot wait times and shed turns are exported on /metrics.
+"""
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+import config
+from storage import get_store
+from call_profiles import bind_queued_reply, finish_queued_reply, get_queued_reply, drop_queued_reply
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT_SECONDS, ADMISSION_SHED
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """One turn's reply: generated inline, queued (pending until done) or rejected."""
+
+    __slots__ = ("call_sid", "hangup", "rejected", "future", "created", "started")
+
+    def __init__(self, call_sid, hangup=False, rejected=False):
+        self.call_sid = call_sid
+        self.hangup = hangup
+        self.rejected = rejected
+        self.future = Future()
+        self.created = time.monotonic()
+        self.started = None  # when its generation got a slot
+
+    @property
+    def done(self):
+        return self.future.done()
+
+    def text(self):
+        """The reply (None when the generation failed); only call once done."""
+        return None if self.future.exception() else self.future.result()
+
+
+class GenerationQueue:
+    def __init__(self, max_active=None, max_queued=None, max_jobs=10000):
+        self.max_active = config.ADMISSION_MAX_ACTIVE if max_active is None else max_active
+        self.max_queued = config.ADMISSION_MAX_QUEUED if max_queued is None else max_queued
+        self.max_jobs = max_jobs
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        self._jobs = OrderedDict()  # call_sid -> queued Job, until /pending-reply takes it
+        self._executor = None
+        self._tasks = set()
+        self._shared = None  # whether queued replies are shared with other processes, decided on first use
+        self._stats = {"inline": 0, "deferred": 0, "rejected": 0, "waits": 0, "wait_seconds": 0.0,
+                       "max_wait_seconds": 0.0, "max_queued": 0}
+
+    def run(self, call_sid, generate, hangup=False):
+        """Generate the reply with `generate()` now if a slot is free, otherwise queue it."""
+        if self._enter():
+            job = Job(call_sid, hangup)
+            try:
+                job.future.set_result(generate())
+            finally:
+                self._leave()
+            return job
+        job = self._defer(call_sid, hangup)
+        if not job.rejected:
+            self._pool().submit(self._run_queued, job, generate)
+        return job
+
+    async def arun(self, call_sid, agenerate, hangup=False):
+        """Async variant of run(); `agenerate` returns a coroutine, and queued turns wait without a thread."""
+        if self._enter():
+            job = Job(call_sid, hangup)
+            try:
+                job.future.set_result(await agenerate())
+            finally:
+                self._leave()
+            return job
+        job = self._defer(call_sid, hangup)
+        if not job.rejected:
+            task = asyncio.ensure_future(self._arun_queued(job, agenerate))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return job
+
+    def take(self, call_sid, timeout=None):
+        """
+        The queued job of a call, after waiting up to `timeout` seconds for it
+        to finish; a finished job is handed out once. None if there is none.
+        """
+        timeout = config.ADMISSION_POLL_WAIT if timeout is None else timeout
+        job = self._job(call_sid)
+        if job is None:
+            return self._shared_job(call_sid, timeout)
+        try:
+            job.future.exception(timeout=timeout)
+        except TimeoutError:
+            pass
+        self._release_job(job)
+        return job
+
+    async def atake(self, call_sid, timeout=None):
+        """Async variant of take()."""
+        timeout = config.ADMISSION_POLL_WAIT if timeout is None else timeout
+        job = self._job(call_sid)
+        if job is None:
+            return await asyncio.to_thread(self._shared_job, call_sid, timeout)
+        await asyncio.wait([asyncio.wrap_future(job.future)], timeout=timeout)
+        await asyncio.to_thread(self._release_job, job)
+        return job
+
+    @contextmanager
+    def slot(self):
+        """Hold a generation slot for the block, waiting in the queue for one if needed."""
+        if not self._enter():
+            self._wait_for_slot(time.monotonic())
+        try:
+            yield
+        finally:
+            self._leave()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, active=self._active, queued=self._queued, pending_jobs=len(self._jobs))
+        stats["mean_wait_seconds"] = stats["wait_seconds"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+    # --- internals ------------------------------------------------------
+
+    def _enter(self):
+        with self._cond:
+            if self.max_active > 0 and (self._active >= self.max_active or self._queued):
+                return False
+            self._active += 1
+            self._stats["inline"] += 1
+            return True
+
+    def _leave(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def _defer(self, call_sid, hangup):
+        with self._cond:
+            if self._queued >= self.max_queued:
+                self._stats["rejected"] += 1
+                job = Job(call_sid, hangup, rejected=True)
+            else:
+                self._queued += 1
+                self._stats["deferred"] += 1
+                self._stats["max_queued"] = max(self._stats["max_queued"], self._queued)
+                job = Job(call_sid, hangup)
+                self._jobs[call_sid] = job
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+            queued = self._queued
+        if not job.rejected and self._is_shared():
+            try:
+                bind_queued_reply(call_sid, hangup)
+            except Exception as e:
+                logger.error(f"Error sharing the queued turn of call {call_sid}: {e}")
+        outcome = "rejected" if job.rejected else "deferred"
+        logger.warning(f"Generation budget exhausted; turn of call {call_sid} {outcome} ({queued} queued)")
+        if config.METRICS_ENABLED:
+            ADMISSION_SHED.inc(outcome=outcome)
+            ADMISSION_QUEUE_DEPTH.set(queued)
+        return job
+
+    def _wait_for_slot(self, since, counted=False):
+        """Block until a slot is free and take it; `counted` when the waiter is already in the queue."""
+        with self._cond:
+            if not counted:
+                self._queued += 1
+                self._stats["max_queued"] = max(self._stats["max_queued"], self._queued)
+            self._cond.wait_for(lambda: self._active < self.max_active)
+            self._active += 1
+            self._queued -= 1
+            queued = self._queued
+        self._record_wait(time.monotonic() - since, queued)
+
+    async def _await_slot(self, since):
+        delay = 0.005
+        while True:
+            with self._cond:
+                if self._active < self.max_active:
+                    self._active += 1
+                    self._queued -= 1
+                    queued = self._queued
+                    break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        self._record_wait(time.monotonic() - since, queued)
+
+    def _record_wait(self, waited, queued):
+        with self._cond:
+            self._stats["waits"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        if config.METRICS_ENABLED:
+            ADMISSION_WAIT_SECONDS.observe(waited)
+            ADMISSION_QUEUE_DEPTH.set(queued)
+
+    def _run_queued(self, job, generate):
+        self._wait_for_slot(job.created, counted=True)
+        job.started = time.monotonic()
+        reply, error = None, None
+        try:
+            reply = generate()
+        except Exception as e:
+            logger.error(f"Error generating the queued reply for call {job.call_sid}: {e}")
+            error = e
+        finally:
+            self._leave()
+        # Shared before the job is done, so the next turn of the call cannot be
+        # queued (and shared) before this reply is written over it
+        self._share_result(job.call_sid, reply)
+        self._resolve(job, reply, error)
+
+    async def _arun_queued(self, job, agenerate):
+        await self._await_slot(job.created)
+        job.started = time.monotonic()
+        reply, error = None, None
+        try:
+            reply = await agenerate()
+        except Exception as e:
+            logger.error(f"Error generating the queued reply for call {job.call_sid}: {e}")
+            error = e
+        finally:
+            self._leave()
+        await asyncio.to_thread(self._share_result, job.call_sid, reply)
+        self._resolve(job, reply, error)
+
+    @staticmethod
+    def _resolve(job, reply, error):
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(reply)
+
+    def _is_shared(self):
+        if self._shared is None:
+            self._shared = hasattr(get_store(), "acquire_lease")
+        return self._shared
+
+    def _share_result(self, call_sid, reply):
+        if self._is_shared():
+            try:
+                finish_queued_reply(call_sid, reply)
+            except Exception as e:
+                logger.error(f"Error sharing the queued reply of call {call_sid}: {e}")
+
+    def _shared_job(self, call_sid, timeout):
+        """The queued turn of a call deferred by another process, waiting up to `timeout` for its reply."""
+        if not self._is_shared():
+            return None
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while True:
+            try:
+                queued = get_queued_reply(call_sid)
+            except Exception as e:
+                logger.error(f"Error reading the queued reply of call {call_sid}: {e}")
+                return None
+            if queued is None:
+                return None
+            hangup, done, reply = queued
+            if done or time.monotonic() >= deadline:
+                break
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, 0.1)
+        job = Job(call_sid, hangup)
+        if done:
+            job.future.set_result(reply)
+            self._drop_shared(call_sid)
+        return job
+
+    def _drop_shared(self, call_sid):
+        try:
+            drop_queued_reply(call_sid)
+        except Exception as e:
+            logger.error(f"Error dropping the queued reply of call {call_sid}: {e}")
+
+    def _job(self, call_sid):
+        with self._cond:
+            return self._jobs.get(call_sid)
+
+    def _release_job(self, job):
+        if job.done:
+            with self._cond:
+                if self._jobs.get(job.call_sid) is job:
+                    del self._jobs[job.call_sid]
+            if self._is_shared():
+                self._drop_shared(job.call_sid)
+
+    def _pool(self):
+        with self._cond:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max(1, self.max_queued), thread_name_prefix="queued-reply")
+            return self._executor
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_generation_queue():
+    """Return the process-wide generation queue."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = GenerationQueue()
+    return _queue
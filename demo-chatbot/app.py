@@ -1,15 +1,28 @@
 import os
 import json
 import logging
+from functools import partial
 import argparse
-from flask import Flask, request
-from twilio.twiml.voice_response import VoiceResponse, Gather
+from flask import Flask, request, abort, send_from_directory
+from twilio.twiml.voice_response import VoiceResponse
 import config
 from ngrok_manager import start_ngrok
-from twilio_handler import initialize_twilio_client, make_outbound_call, call_sales_prospects
+from twilio_handler import make_outbound_call, call_sales_prospects
+from dialer import iter_prospects
 from sales_bot import get_user_info_from_call, generate_response, generate_introduction, generate_closing
+from sales_bot import stream_response, stream_introduction, stream_closing, end_call
+from sales_bot import pregenerated_introduction, record_introduction, speculate_response
+from streaming import start_reply_stream, get_reply_stream
+from twiml import speak, append_gather, append_reply, append_reply_chunk, render_twiml, prerender_static_phrases
+from tts_cache import get_tts_cache, FILENAME as TTS_FILENAME
+from metrics import timed, span, render as render_metrics
+from idempotency import idempotent
+from admission import get_generation_queue
 from conversation import detect_conversation_end, reset_conversation
 from conversation import load_conversation_history, upload_conversation_to_backend
+from call_lock import call_lock
+from outbox import get_outbox
+from call_profiles import mark_finished
 
 # Configure logging
 logging.basicConfig(
@@ -21,7 +34,15 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 
+def _say_streamed_reply(response, call_sid, timeout):
+    stream = get_reply_stream(call_sid)
+    with span("stream_wait"):
+        sentences, done = stream.take(timeout) if stream else ([], True)
+    append_reply_chunk(response, call_sid, stream, sentences, done)
+
 @app.route("/voice", methods=['POST'])
+@timed("voice")
+@idempotent("voice", lambda: request.values)
 def voice_webhook():
     response = VoiceResponse()
     call_sid = request.values.get('CallSid', '')
@@ -30,25 +51,32 @@ def voice_webhook():
     logger.info(f"Received call from {caller} with SID: {call_sid}")
     
     user_info = get_user_info_from_call(call_sid, caller)
-    introduction = generate_introduction(call_sid, user_info)
-    
-    response.say(introduction, voice="Polly.Joanna-Neural")
+
+    # Served from the cache when generated at dial time (or on an earlier /voice of this call)
+    with span("intro_cache"):
+        introduction = pregenerated_introduction(call_sid)
+    if introduction:
+        record_introduction(call_sid, user_info, introduction)
+        speak(response, introduction)
+        append_gather(response)
+        return render_twiml(response)
+
+    if config.STREAMING_REPLIES:
+        start_reply_stream(call_sid, stream_introduction(call_sid, user_info))
+        _say_streamed_reply(response, call_sid, config.STREAM_FIRST_SENTENCE_TIMEOUT)
+        return render_twiml(response)
+
+    with span("generation"):
+        introduction = generate_introduction(call_sid, user_info)
     
-    gather = Gather(
-        input='speech',
-        action='/transcribe',
-        speechTimeout='auto',
-        speechModel='experimental_conversations',
-        language='en-US',
-        hints=','.join(config.CLOSING_INDICATORS)
-    )
-    gather.say("Please speak after the tone.", voice="Polly.Joanna-Neural")
-    response.append(gather)
-    response.redirect('/voice')
+    speak(response, introduction)
+    append_gather(response)
     
-    return str(response)
+    return render_twiml(response)
 
 @app.route("/transcribe", methods=['POST'])
+@timed("transcribe")
+@idempotent("transcribe", lambda: request.values)
 def transcribe_webhook():
     transcription = request.values.get('SpeechResult', '')
     call_sid = request.values.get('CallSid', '')
@@ -56,33 +84,65 @@ def transcribe_webhook():
     logger.info(f"Transcription for call {call_sid}: {transcription}")
     
     response = VoiceResponse()
-    is_conversation_end = detect_conversation_end(transcription)
+    with span("intent_detection"):
+        is_conversation_end = detect_conversation_end(transcription)
 
     user_info = get_user_info_from_call(call_sid)
 
+    if config.STREAMING_REPLIES:
+        if is_conversation_end:
+            start_reply_stream(call_sid, stream_closing(call_sid, user_info), hangup=True)
+        else:
+            start_reply_stream(call_sid, stream_response(transcription, call_sid, user_info))
+        _say_streamed_reply(response, call_sid, config.STREAM_FIRST_SENTENCE_TIMEOUT)
+        return render_twiml(response)
+
     if is_conversation_end:
-        closing = generate_closing(call_sid, user_info)
-        response.say(closing, voice="Polly.Joanna-Neural")
-        response.hangup()
+        generate = partial(generate_closing, call_sid, user_info)
     else:
-        bot_response = generate_response(transcription, call_sid, user_info)
-        response.say(bot_response, voice="Polly.Joanna-Neural")
-        
-        gather = Gather(
-            input='speech',
-            action='/transcribe',
-            speechTimeout='auto',
-            speechModel='experimental_conversations',
-            language='en-US',
-            hints=','.join(config.CLOSING_INDICATORS)
-        )
-        gather.say("Please speak after the tone.", voice="Polly.Joanna-Neural")
-        response.append(gather)
-        response.redirect('/voice')
-    
-    return str(response)
+        generate = partial(generate_response, transcription, call_sid, user_info)
+    # Over the generation budget the turn is queued and answered through /pending-reply
+    with span("generation"):
+        job = get_generation_queue().run(call_sid, generate, hangup=is_conversation_end)
+    append_reply(response, job, filler=True)
+
+    return render_twiml(response)
+
+@app.route("/partial-transcript", methods=['POST'])
+@timed("partial_transcript")
+def partial_transcript_webhook():
+    """<Gather> partial results: start the reply to a stable partial transcript before the caller finishes."""
+    call_sid = request.values.get('CallSid', '')
+    partial = request.values.get('UnstableSpeechResult', '')
+    stability = float(request.values.get('Stability') or 0)
+    sequence = request.values.get('SequenceNumber')
+    speculate_response(partial, call_sid, stability, int(sequence) if sequence else None)
+    return "OK"
+
+@app.route("/pending-reply", methods=['POST'])
+@timed("pending_reply")
+@idempotent("pending_reply", lambda: request.values)
+def pending_reply_webhook():
+    """Redirect target that speaks a queued reply once it has been generated."""
+    call_sid = request.values.get('CallSid', '')
+    response = VoiceResponse()
+    with span("queue_wait"):
+        job = get_generation_queue().take(call_sid)
+    append_reply(response, job)
+    return render_twiml(response)
+
+@app.route("/continue-reply", methods=['POST'])
+@timed("continue_reply")
+@idempotent("continue_reply", lambda: request.values)
+def continue_reply_webhook():
+    """Redirect target that speaks the rest of a streamed reply."""
+    call_sid = request.values.get('CallSid', '')
+    response = VoiceResponse()
+    _say_streamed_reply(response, call_sid, config.STREAM_NEXT_SENTENCE_TIMEOUT)
+    return render_twiml(response)
 
 @app.route("/call-status", methods=['POST'])
+@timed("call_status")
 def call_status_webhook():
     call_sid = request.values.get('CallSid', '')
     call_status = request.values.get('CallStatus', '')
@@ -93,14 +153,34 @@ def call_status_webhook():
     if call_status == "completed":
         try:
             user_info = get_user_info_from_call(call_sid, caller)
-            conversation = load_conversation_history(call_sid, user_info)
+            # Waits for a turn still being generated, so the upload includes it
+            with call_lock(call_sid):
+                conversation = load_conversation_history(call_sid, user_info)
             logger.info("📤 Uploading conversation to backend...")
             upload_conversation_to_backend(call_sid, conversation, user_info)
         except Exception as e:
             logger.error(f"❌ Error uploading conversation: {e}")
+        # The history is final now: archive.py only archives finished calls
+        try:
+            mark_finished(call_sid)
+        except Exception as e:
+            logger.error(f"❌ Error marking call {call_sid} finished: {e}")
+        end_call(call_sid)
     
     return "OK"
 
+@app.route("/tts/<name>")
+def tts_audio(name):
+    """Pre-rendered phrase audio referenced by <Play>."""
+    cache = get_tts_cache()
+    if not cache or not TTS_FILENAME.match(name) or not cache.touch(name):
+        abort(404)
+    return send_from_directory(cache.directory, name, mimetype="audio/wav", max_age=86400)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
 @app.route("/trigger-call")
 def trigger_call():
     phone = request.args.get("phone", "")
@@ -120,9 +200,14 @@ def main():
     parser.add_argument("--reset", action="store_true", help="Reset conversation history")
     parser.add_argument("--mode", choices=["server", "outbound"], default="server", 
                         help="Run as webhook server or make outbound calls")
+    parser.add_argument("--server", choices=["flask", "asgi"], default=config.SERVER_BACKEND,
+                        help="Webhook server implementation for server mode")
     parser.add_argument("--port", type=int, default=config.FLASK_PORT, help="Port for webhook server")
     parser.add_argument("--call", type=str, help="Phone number to call in outbound mode")
-    parser.add_argument("--prospects-file", type=str, help="JSON file with prospects list for outbound calls")
+    parser.add_argument("--prospects-file", type=str, help="JSON-lines file (or JSON list) of prospects for outbound calls")
+    parser.add_argument("--checkpoint", type=str, help="Campaign checkpoint file, to resume an interrupted campaign")
+    parser.add_argument("--rate", type=float, help="Outbound calls per second")
+    parser.add_argument("--concurrency", type=int, help="Outbound call requests in flight")
     
     args = parser.parse_args()
     
@@ -131,6 +216,10 @@ def main():
     
     if args.port:
         config.FLASK_PORT = args.port
+    if args.rate:
+        config.DIALER_CALLS_PER_SECOND = args.rate
+    if args.concurrency:
+        config.DIALER_CONCURRENCY = args.concurrency
     
     public_url = start_ngrok()
     if not public_url:
@@ -140,8 +229,17 @@ def main():
     logger.info(f"Public URL: {public_url}")
     
     if args.mode == "server":
-        logger.info(f"Starting {config.BOT_NAME} webhook server on port {config.FLASK_PORT}...")
-        app.run(host='0.0.0.0', port=config.FLASK_PORT)
+        logger.info(f"Starting {config.BOT_NAME} {args.server} webhook server on port {config.FLASK_PORT}...")
+        # Resume uploads left in the outbox by a previous run
+        get_outbox()
+        prerender_static_phrases()
+        if args.server == "asgi":
+            import asgi_app
+            asgi_app.run(host='0.0.0.0', port=config.FLASK_PORT)
+        else:
+            if config.MEDIA_STREAM_URL:
+                logger.warning("MEDIA_STREAM_URL is ignored by the Flask server; run with --server asgi for media streams")
+            app.run(host='0.0.0.0', port=config.FLASK_PORT)
     
     elif args.mode == "outbound":
         if args.call:
@@ -149,13 +247,12 @@ def main():
             make_outbound_call(args.call, public_url)
         elif args.prospects_file:
             try:
-                with open(args.prospects_file, 'r') as f:
-                    prospects = json.load(f)
-                logger.info(f"Loaded {len(prospects)} prospects from {args.prospects_file}")
-                call_sales_prospects(prospects, public_url)
+                prospects = iter_prospects(args.prospects_file)
+                logger.info(f"Streaming prospects from {args.prospects_file}")
+                call_sales_prospects(prospects, public_url, checkpoint_path=args.checkpoint)
             except Exception as e:
                 logger.error(f"Error loading prospects file: {e}")
-                logger.error("Please provide a valid JSON file with a list of prospects")
+                logger.error("Please provide a JSON-lines file (or JSON list) of prospects")
         else:
             logger.error("Please provide either --call or --prospects-file for outbound mode")
 
@@ -0,0 +1,355 @@
+"""
+Columnar archive of finished calls, with bulk analytics and GC of the sources.
+
+Each `archive` run writes one segment directory of numpy arrays that are
+memory-mapped on read:
+
+    texts.bin           UTF-8 bytes of every distinct message text, back to back
+    text_offsets.npy    int64 [n_texts + 1], byte offsets into texts.bin
+    text_words.npy      int32 [n_texts], word count of each text
+    text_hesitation.npy bool  [n_texts], hesitation indicator found in the text
+    text_closing.npy    bool  [n_texts], closing indicator found in the text
+    text_template.npy   bool  [n_texts], text is a prompt template reference (JSON)
+    message_text.npy    int32 [n_messages], text id of each message
+    message_role.npy    uint8 [n_messages], ROLES index of each message
+    call_offsets.npy    int64 [n_calls + 1], first message of each call
+    calls.jsonl         per-call metadata (call SID, user info, message count)
+    meta.json           format version, counts, indicator lists used for the flags,
+                        and the text of every prompt template referenced
+
+Only finished calls are archived (see collect). Identical texts are stored
+once, and system prompts stay prompt template references (see prompts.py) with
+the templates kept once per segment. Analytics run on the role/text-id columns
+with numpy, so they scale to millions of messages without parsing JSON.
+
+    python archive.py archive [--json-dir DIR ...] [--store]
+    python archive.py stats [--json]
+    python archive.py gc [--store] [--dry-run]
+"""
+import os
+import json
+import time
+import glob
+import logging
+import argparse
+import numpy as np
+import config
+from conversation import closing_matcher, hesitation_matcher
+from storage import get_store, DEFAULT_KEY
+from prompts import referenced, export
+from call_profiles import finished_calls
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+ROLES = ("system", "user", "assistant", "other")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+USER = ROLE_CODES["user"]
+ASSISTANT = ROLE_CODES["assistant"]
+
+
+def _indicator_lists():
+    return {"closing": list(config.CLOSING_INDICATORS), "hesitation": list(config.HESITATION_INDICATORS)}
+
+
+def write_segment(directory, calls):
+    """Write `calls` ([(call_sid, messages, user_info), ...]) as one archive segment."""
+    text_ids = {}
+    texts = []
+    template_texts = []
+    message_text = []
+    message_role = []
+    call_offsets = [0]
+    metadata = []
+    templates = set()
+    for call_sid, messages, user_info in calls:
+        templates.update(referenced(messages))
+        for message in messages:
+            is_template = "template" in message
+            if is_template:
+                content = json.dumps({"template": message["template"], "params": message.get("params") or {}},
+                                     sort_keys=True)
+            else:
+                content = message.get("content") or ""
+            text_id = text_ids.get((is_template, content))
+            if text_id is None:
+                text_id = text_ids[is_template, content] = len(texts)
+                texts.append(content)
+                template_texts.append(is_template)
+            message_text.append(text_id)
+            message_role.append(ROLE_CODES.get(message.get("role"), ROLE_CODES["other"]))
+        call_offsets.append(len(message_text))
+        metadata.append({"call_sid": call_sid, "user_info": user_info, "messages": len(messages)})
+
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    # Template references are not spoken text: no words, no indicator hits
+    spoken = ["" if is_template else text for text, is_template in zip(texts, template_texts)]
+
+    tmp = directory + ".tmp"
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, "texts.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(tmp, "text_offsets.npy"), offsets)
+    np.save(os.path.join(tmp, "text_words.npy"), np.array([len(t.split()) for t in spoken], dtype=np.int32))
+    np.save(os.path.join(tmp, "text_hesitation.npy"),
+            np.array([m is not None for m in hesitation_matcher().search_batch(spoken)], dtype=bool))
+    np.save(os.path.join(tmp, "text_closing.npy"),
+            np.array([m is not None for m in closing_matcher().search_batch(spoken)], dtype=bool))
+    np.save(os.path.join(tmp, "text_template.npy"), np.array(template_texts, dtype=bool))
+    np.save(os.path.join(tmp, "message_text.npy"), np.array(message_text, dtype=np.int32))
+    np.save(os.path.join(tmp, "message_role.npy"), np.array(message_role, dtype=np.uint8))
+    np.save(os.path.join(tmp, "call_offsets.npy"), np.array(call_offsets, dtype=np.int64))
+    with open(os.path.join(tmp, "calls.jsonl"), "w") as f:
+        for entry in metadata:
+            f.write(json.dumps(entry) + "\n")
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "created": time.time(),
+            "calls": len(metadata),
+            "messages": len(message_text),
+            "texts": len(texts),
+            "text_bytes": int(offsets[-1]),
+            "indicators": _indicator_lists(),
+            "templates": export(sorted(templates)),
+        }, f)
+    os.replace(tmp, directory)
+
+
+class Segment:
+    """Read-only view of one archive segment; arrays are memory-mapped."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(directory, name), mmap_mode="r")
+        self.text_offsets = load("text_offsets.npy")
+        self.text_words = load("text_words.npy")
+        self.text_hesitation = load("text_hesitation.npy")
+        self.text_closing = load("text_closing.npy")
+        self.message_text = load("message_text.npy")
+        self.message_role = load("message_role.npy")
+        self.call_offsets = load("call_offsets.npy")
+        if os.path.exists(os.path.join(directory, "text_template.npy")):
+            self.text_template = load("text_template.npy")
+        else:
+            self.text_template = np.zeros(len(self.text_words), dtype=bool)
+        size = int(self.text_offsets[-1])
+        self.texts = np.memmap(os.path.join(directory, "texts.bin"), dtype=np.uint8, mode="r") if size else b""
+
+    def text(self, text_id):
+        start, end = self.text_offsets[text_id], self.text_offsets[text_id + 1]
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def calls(self):
+        with open(os.path.join(self.directory, "calls.jsonl")) as f:
+            return [json.loads(line) for line in f]
+
+    def conversation(self, index):
+        """Messages of the index-th call in this segment."""
+        start, end = self.call_offsets[index], self.call_offsets[index + 1]
+        messages = []
+        for i in range(start, end):
+            text_id = self.message_text[i]
+            if self.text_template[text_id]:
+                messages.append({"role": ROLES[self.message_role[i]], **json.loads(self.text(text_id))})
+            else:
+                messages.append({"role": ROLES[self.message_role[i]], "content": self.text(text_id)})
+        return messages
+
+    def flags(self):
+        """(hesitation, closing) per text, recomputed if the indicator lists changed since archiving."""
+        if self.meta.get("indicators") == _indicator_lists():
+            return self.text_hesitation, self.text_closing
+        texts = ["" if self.text_template[i] else self.text(i) for i in range(len(self.text_words))]
+        return (np.array([m is not None for m in hesitation_matcher().search_batch(texts)], dtype=bool),
+                np.array([m is not None for m in closing_matcher().search_batch(texts)], dtype=bool))
+
+
+class Archive:
+    def __init__(self, directory=None):
+        self.directory = directory or config.ARCHIVE_DIR
+        os.makedirs(self.directory, exist_ok=True)
+
+    def segments(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("segment-")
+                       and not name.endswith(".tmp"))
+        return [Segment(os.path.join(self.directory, name)) for name in names]
+
+    def archived(self):
+        """{call_sid: message count} of every archived call."""
+        return {call["call_sid"]: call["messages"] for segment in self.segments() for call in segment.calls()}
+
+    def add(self, calls):
+        """Archive calls not archived yet; returns how many were written."""
+        archived = self.archived()
+        calls = [call for call in calls if call[0] not in archived]
+        if not calls:
+            return 0
+        existing = len(os.listdir(self.directory))
+        name = f"segment-{int(time.time() * 1000):015d}-{existing:05d}"
+        write_segment(os.path.join(self.directory, name), calls)
+        logger.info(f"Archived {len(calls)} calls to {name}")
+        return len(calls)
+
+    def analyze(self):
+        """Campaign statistics over every archived message, computed column-wise."""
+        roles, words, hesitation, closing, user_turns, call_hesitated, call_closed = [], [], [], [], [], [], []
+        for segment in self.segments():
+            if not len(segment.message_role):
+                continue
+            text_hesitation, text_closing = segment.flags()
+            role = np.asarray(segment.message_role)
+            text = np.asarray(segment.message_text)
+            is_user = role == USER
+            msg_hesitation = text_hesitation[text] & is_user
+            msg_closing = text_closing[text] & is_user
+            starts = np.asarray(segment.call_offsets[:-1])
+            nonempty = starts < np.asarray(segment.call_offsets[1:])
+            starts = starts[nonempty]
+            roles.append(role)
+            words.append(segment.text_words[text])
+            hesitation.append(msg_hesitation)
+            closing.append(msg_closing)
+            user_turns.append(np.add.reduceat(is_user.astype(np.int32), starts))
+            call_hesitated.append(np.logical_or.reduceat(msg_hesitation, starts))
+            call_closed.append(np.logical_or.reduceat(msg_closing, starts))
+
+        if not roles:
+            return {"calls": 0, "messages": 0}
+        role = np.concatenate(roles)
+        words = np.concatenate(words)
+        hesitation = np.concatenate(hesitation)
+        closing = np.concatenate(closing)
+        turns = np.concatenate(user_turns)
+        is_user = role == USER
+        user_messages = int(is_user.sum())
+
+        def distribution(values):
+            if not len(values):
+                return {}
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            return {"mean": float(values.mean()), "p50": float(p50), "p90": float(p90), "p99": float(p99),
+                    "max": int(values.max())}
+
+        return {
+            "calls": int(len(turns)),
+            "messages": int(len(role)),
+            "messages_by_role": {ROLES[code]: int(count) for code, count in enumerate(np.bincount(role, minlength=4))},
+            "user_turns": distribution(turns),
+            "hesitation_rate": float(hesitation.sum() / user_messages) if user_messages else 0.0,
+            "closing_rate": float(closing.sum() / user_messages) if user_messages else 0.0,
+            "calls_with_hesitation": float(np.concatenate(call_hesitated).mean()),
+            "calls_closed_by_caller": float(np.concatenate(call_closed).mean()),
+            "user_words": distribution(words[is_user]),
+            "bot_words": distribution(words[role == ASSISTANT]),
+        }
+
+
+def _json_files(directories):
+    suffix = f"_{config.CONVERSATION_FILE}"
+    for directory in directories:
+        for path in sorted(glob.glob(os.path.join(directory, f"*{suffix}"))):
+            yield os.path.basename(path)[:-len(suffix)], path
+
+
+def collect(json_dirs, include_store, min_idle=None):
+    """
+    Finished calls from legacy JSON files and (optionally) the conversation store.
+
+    A call is finished once Twilio has reported it completed (see
+    call_profiles.mark_finished). Legacy JSON files written before calls were
+    marked also count as finished once unmodified for `min_idle` seconds. Calls
+    still in progress are left for a later run: the archive keeps one copy per
+    call SID, so archiving a partial history would lose the rest of the call.
+    """
+    min_idle = config.ARCHIVE_MIN_IDLE if min_idle is None else min_idle
+    finished = finished_calls()
+    calls, skipped = [], 0
+    for call_sid, path in _json_files(json_dirs):
+        try:
+            if call_sid not in finished and time.time() - os.path.getmtime(path) < min_idle:
+                skipped += 1
+                continue
+            with open(path) as f:
+                calls.append((call_sid, json.load(f), None))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable conversation file {path}: {e}")
+    if include_store:
+        store = get_store()
+        for call_sid in store.keys():
+            if call_sid == DEFAULT_KEY:
+                continue
+            if call_sid not in finished:
+                skipped += 1
+                continue
+            calls.append((call_sid, store.load(call_sid) or [], None))
+    if skipped:
+        logger.info(f"Left {skipped} calls that have not finished for a later run")
+    return calls
+
+
+def gc(archive, json_dirs, include_store, dry_run=False):
+    """Remove source conversations that are archived with the same number of messages."""
+    archived = archive.archived()
+    removed = 0
+    for call_sid, path in _json_files(json_dirs):
+        try:
+            with open(path) as f:
+                count = len(json.load(f))
+        except (OSError, ValueError):
+            continue
+        if archived.get(call_sid) == count:
+            if not dry_run:
+                os.remove(path)
+            removed += 1
+    if include_store:
+        store = get_store()
+        for call_sid in store.keys():
+            if call_sid != DEFAULT_KEY and archived.get(call_sid) == len(store.load(call_sid) or []):
+                if not dry_run:
+                    store.delete(call_sid)
+                removed += 1
+        if not dry_run and hasattr(store, "compact"):
+            store.flush()
+            store.compact()
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive finished calls and analyse the archive")
+    parser.add_argument("command", choices=["archive", "stats", "gc"])
+    parser.add_argument("--archive-dir", default=config.ARCHIVE_DIR)
+    parser.add_argument("--json-dir", action="append",
+                        help="Directory of {call_sid}_conversation.json files (default: . and CONVERSATION_DIR)")
+    parser.add_argument("--store", action="store_true", help="Include finished calls in the conversation store")
+    parser.add_argument("--dry-run", action="store_true", help="gc: only count what would be removed")
+    parser.add_argument("--json", action="store_true", help="stats: print JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    archive = Archive(args.archive_dir)
+    json_dirs = args.json_dir or sorted({".", config.CONVERSATION_DIR})
+
+    if args.command == "archive":
+        print(f"📦 Archived {archive.add(collect(json_dirs, args.store))} calls")
+    elif args.command == "gc":
+        removed = gc(archive, json_dirs, args.store, args.dry_run)
+        print(f"🧹 {'Would remove' if args.dry_run else 'Removed'} {removed} archived conversations")
+    else:
+        start = time.perf_counter()
+        stats = archive.analyze()
+        elapsed = time.perf_counter() - start
+        if args.json:
+            print(json.dumps(stats, indent=2))
+        else:
+            for key, value in stats.items():
+                print(f"{key:<24} {value}")
+            print(f"(analysed in {elapsed * 1000:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+ASGI webhook server with the same endpoints as the Flask app in app.py.
+
+Model calls go through the async OpenAI client and blocking work (history
+storage, CRM lookup, Twilio/ngrok calls, uploads) runs in worker threads, so a
+slow model no longer pins one server thread per call in progress.
+
+    python app.py --mode server --server asgi
+"""
+import json
+import asyncio
+import logging
+from functools import partial
+from urllib.parse import parse_qs
+from twilio.twiml.voice_response import VoiceResponse
+import config
+from ngrok_manager import start_ngrok
+from twilio_handler import make_outbound_call
+from sales_bot import get_user_info_from_call, agenerate_response, agenerate_introduction, agenerate_closing
+from sales_bot import stream_response, stream_introduction, stream_closing, end_call
+from sales_bot import pregenerated_introduction, record_introduction, speculate_response
+from streaming import start_reply_stream, get_reply_stream
+from twiml import speak, append_gather, append_reply, append_reply_chunk, render_twiml
+from twiml import start_media_stream, append_listen
+from media_stream import handle_media_stream
+from tts_cache import get_tts_cache, FILENAME as TTS_FILENAME
+from metrics import timed, span, render as render_metrics
+from idempotency import idempotent
+from admission import get_generation_queue
+from conversation import detect_conversation_end, load_conversation_history, upload_conversation_to_backend
+from call_lock import acall_lock
+from call_profiles import mark_finished
+
+logger = logging.getLogger(__name__)
+
+ROUTES = {}
+
+# Keep references to fire-and-forget tasks so they are not garbage collected
+_background_tasks = set()
+
+
+def route(path, methods=("POST",)):
+    def decorator(handler):
+        for method in methods:
+            ROUTES[(method, path)] = handler
+        return handler
+    return decorator
+
+
+def _run_in_background(coroutine):
+    task = asyncio.ensure_future(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _say_streamed_reply(response, call_sid, timeout):
+    stream = get_reply_stream(call_sid)
+    with span("stream_wait"):
+        sentences, done = await asyncio.to_thread(stream.take, timeout) if stream else ([], True)
+    append_reply_chunk(response, call_sid, stream, sentences, done)
+
+
+@route("/voice")
+@timed("voice")
+@idempotent("voice")
+async def voice_webhook(values):
+    response = VoiceResponse()
+    call_sid = values.get('CallSid', '')
+    caller = values.get('From', '')
+
+    logger.info(f"Received call from {caller} with SID: {call_sid}")
+
+    user_info = await asyncio.to_thread(get_user_info_from_call, call_sid, caller)
+
+    # Served from the cache when generated at dial time (or on an earlier /voice of this call)
+    with span("intro_cache"):
+        introduction = await asyncio.to_thread(pregenerated_introduction, call_sid)
+    if introduction:
+        await asyncio.to_thread(record_introduction, call_sid, user_info, introduction)
+    elif config.STREAMING_REPLIES and not config.MEDIA_STREAM_URL:
+        start_reply_stream(call_sid, stream_introduction(call_sid, user_info))
+        await _say_streamed_reply(response, call_sid, config.STREAM_FIRST_SENTENCE_TIMEOUT)
+        return render_twiml(response)
+    else:
+        with span("generation"):
+            introduction = await agenerate_introduction(call_sid, user_info)
+
+    if config.MEDIA_STREAM_URL:
+        # Listen over a media stream instead of <Gather>; replies are pushed as call updates
+        start_media_stream(response)
+        speak(response, introduction)
+        append_listen(response)
+    else:
+        speak(response, introduction)
+        append_gather(response)
+
+    return render_twiml(response)
+
+
+@route("/transcribe")
+@timed("transcribe")
+@idempotent("transcribe")
+async def transcribe_webhook(values):
+    transcription = values.get('SpeechResult', '')
+    call_sid = values.get('CallSid', '')
+
+    logger.info(f"Transcription for call {call_sid}: {transcription}")
+
+    response = VoiceResponse()
+    with span("intent_detection"):
+        is_conversation_end = detect_conversation_end(transcription)
+
+    user_info = await asyncio.to_thread(get_user_info_from_call, call_sid)
+
+    if config.STREAMING_REPLIES:
+        if is_conversation_end:
+            start_reply_stream(call_sid, stream_closing(call_sid, user_info), hangup=True)
+        else:
+            start_reply_stream(call_sid, stream_response(transcription, call_sid, user_info))
+        await _say_streamed_reply(response, call_sid, config.STREAM_FIRST_SENTENCE_TIMEOUT)
+        return render_twiml(response)
+
+    if is_conversation_end:
+        agenerate = partial(agenerate_closing, call_sid, user_info)
+    else:
+        agenerate = partial(agenerate_response, transcription, call_sid, user_info)
+    # Over the generation budget the turn is queued and answered through /pending-reply
+    with span("generation"):
+        job = await get_generation_queue().arun(call_sid, agenerate, hangup=is_conversation_end)
+    append_reply(response, job, filler=True)
+
+    return render_twiml(response)
+
+
+@route("/partial-transcript")
+@timed("partial_transcript")
+async def partial_transcript_webhook(values):
+    """<Gather> partial results: start the reply to a stable partial transcript before the caller finishes."""
+    call_sid = values.get('CallSid', '')
+    partial = values.get('UnstableSpeechResult', '')
+    stability = float(values.get('Stability') or 0)
+    sequence = values.get('SequenceNumber')
+    speculate_response(partial, call_sid, stability, int(sequence) if sequence else None)
+    return "OK"
+
+
+@route("/pending-reply")
+@timed("pending_reply")
+@idempotent("pending_reply")
+async def pending_reply_webhook(values):
+    """Redirect target that speaks a queued reply once it has been generated."""
+    call_sid = values.get('CallSid', '')
+    response = VoiceResponse()
+    with span("queue_wait"):
+        job = await get_generation_queue().atake(call_sid)
+    append_reply(response, job)
+    return render_twiml(response)
+
+
+@route("/continue-reply")
+@timed("continue_reply")
+@idempotent("continue_reply")
+async def continue_reply_webhook(values):
+    call_sid = values.get('CallSid', '')
+    response = VoiceResponse()
+    await _say_streamed_reply(response, call_sid, config.STREAM_NEXT_SENTENCE_TIMEOUT)
+    return render_twiml(response)
+
+
+async def _upload_finished_call(call_sid, caller):
+    try:
+        user_info = await asyncio.to_thread(get_user_info_from_call, call_sid, caller)
+        # Waits for a turn still being generated, so the upload includes it
+        async with acall_lock(call_sid):
+            conversation = await asyncio.to_thread(load_conversation_history, call_sid, user_info)
+        logger.info("📤 Uploading conversation to backend...")
+        await asyncio.to_thread(upload_conversation_to_backend, call_sid, conversation, user_info)
+    except Exception as e:
+        logger.error(f"❌ Error uploading conversation: {e}")
+    # The history is final now: archive.py only archives finished calls
+    try:
+        await asyncio.to_thread(mark_finished, call_sid)
+    except Exception as e:
+        logger.error(f"❌ Error marking call {call_sid} finished: {e}")
+    end_call(call_sid)
+
+
+@route("/call-status")
+@timed("call_status")
+async def call_status_webhook(values):
+    call_sid = values.get('CallSid', '')
+    call_status = values.get('CallStatus', '')
+    caller = values.get('From', '')
+
+    logger.info(f"📞 Call {call_sid} status: {call_status}")
+
+    # Answer Twilio right away; the upload finishes in the background
+    if call_status == "completed":
+        _run_in_background(_upload_finished_call(call_sid, caller))
+
+    return "OK"
+
+
+@route("/metrics", methods=("GET",))
+async def metrics_endpoint(values):
+    return render_metrics()
+
+
+@route("/trigger-call", methods=("GET",))
+async def trigger_call(values):
+    phone = values.get("phone", "")
+    if not phone:
+        return {"error": "Phone is required"}, 400
+
+    public_url = await asyncio.to_thread(start_ngrok)
+    if not public_url:
+        return {"error": "Failed to start ngrok"}, 500
+
+    call_sid = await asyncio.to_thread(make_outbound_call, phone, public_url)
+    return {"status": "initiated", "call_sid": call_sid}
+
+
+async def _read_values(scope, receive):
+    """Merge query string and urlencoded form fields, like Flask's request.values."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+
+    values = {}
+    for source in (scope.get("query_string", b""), body):
+        for key, items in parse_qs(source.decode("utf-8", "replace")).items():
+            values.setdefault(key, items[0])
+    return values
+
+
+async def _send(send, status, content_type, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _read_tts_file(name):
+    cache = get_tts_cache()
+    if not cache or not TTS_FILENAME.match(name) or not cache.touch(name):
+        return None
+    try:
+        with open(cache.path(name), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+async def _serve_tts(path, send):
+    """Pre-rendered phrase audio referenced by <Play>."""
+    body = await asyncio.to_thread(_read_tts_file, path[len("/tts/"):])
+    if body is None:
+        await _send(send, 404, b"text/plain", b"Not Found")
+    else:
+        await _send(send, 200, b"audio/wav", body)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _background_tasks:
+                await asyncio.gather(*_background_tasks, return_exceptions=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] == "websocket":
+        if scope["path"] == "/media-stream":
+            await handle_media_stream(receive, send)
+        else:
+            await send({"type": "websocket.close", "code": 1008})
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "GET" and scope["path"].startswith("/tts/"):
+        await _serve_tts(scope["path"], send)
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        await _send(send, 404, b"text/plain", b"Not Found")
+        return
+
+    try:
+        result = await handler(await _read_values(scope, receive))
+    except Exception as e:
+        logger.error(f"Error handling {scope['path']}: {e}")
+        await _send(send, 500, b"text/plain", b"Internal Server Error")
+        return
+
+    status = 200
+    if isinstance(result, tuple):
+        result, status = result
+    if isinstance(result, dict):
+        await _send(send, status, b"application/json", json.dumps(result).encode("utf-8"))
+    else:
+        content_type = b"text/xml" if result.startswith("<?xml") else b"text/plain"
+        await _send(send, status, content_type, result.encode("utf-8"))
+
+
+def run(host="0.0.0.0", port=None):
+    import uvicorn
+
+    uvicorn.run(app, host=host, port=port or config.FLASK_PORT, log_level="info")
@@ -0,0 +1,255 @@
+"""
+Local speech-to-text with faster-whisper, for utterances cut from media streams.
+
+Transcription is CPU-bound, so utterances from all calls go through one
+ASRPool: a fixed set of worker processes, each with its own loaded model.
+Pending utterances are coalesced into micro-batches of up to ASR_MAX_BATCH,
+dispatched as soon as a batch is full or the oldest utterance has waited
+ASR_MAX_WAIT_MS, so a lone utterance is never held back for long.
+
+faster-whisper has no batched decode across separate utterances, so
+WhisperTranscriber transcribes a batch one utterance after the other: with it,
+batching only saves the per-batch IPC round trip, and throughput comes from
+the number of workers. A transcriber with a real batched forward pass can be
+plugged in through ASR_TRANSCRIBER. A worker that does not answer a batch
+within ASR_WORKER_TIMEOUT seconds is killed and restarted, failing the batch.
+"""
+import time
+import logging
+import importlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+import config
+from metrics import ASR_QUEUE_DEPTH, ASR_BATCH_SIZE, ASR_REAL_TIME_FACTOR, ASR_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class WhisperTranscriber:
+    """Loads the model on first use; transcribe() takes 16 kHz float32 audio."""
+
+    def __init__(self, model_size=None, compute_type=None, cpu_threads=0):
+        self.model_size = model_size or config.WHISPER_MODEL
+        self.compute_type = compute_type or config.WHISPER_COMPUTE_TYPE
+        self.cpu_threads = cpu_threads
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from faster_whisper import WhisperModel
+
+                    logger.info(f"Loading faster-whisper model {self.model_size} ({self.compute_type})")
+                    self._model = WhisperModel(self.model_size, device="cpu", compute_type=self.compute_type,
+                                               cpu_threads=self.cpu_threads)
+        return self._model
+
+    def transcribe(self, audio):
+        segments, _ = self.model.transcribe(
+            audio, language="en", beam_size=1, vad_filter=False, condition_on_previous_text=False
+        )
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+    def load(self):
+        return self.model
+
+    def transcribe_batch(self, audios):
+        """One utterance after the other: faster-whisper only batches segments of a single file."""
+        return [self.transcribe(audio) for audio in audios]
+
+
+def create_transcriber(spec=None):
+    """Build the transcriber named by `spec`: "whisper" or a "module:ClassName" path."""
+    spec = spec or config.ASR_TRANSCRIBER
+    if spec == "whisper":
+        return WhisperTranscriber(cpu_threads=config.ASR_THREADS_PER_WORKER)
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _worker_main(conn, spec):
+    """Worker process: load one model, report ready, then transcribe batches sent over `conn`."""
+    transcriber = create_transcriber(spec)
+    load = getattr(transcriber, "load", None)
+    if load is not None:
+        load()
+    conn.send(("ready", None, 0.0))
+    while True:
+        audios = conn.recv()
+        if audios is None:
+            return
+        start = time.perf_counter()
+        try:
+            conn.send(("ok", transcriber.transcribe_batch(audios), time.perf_counter() - start))
+        except Exception as e:
+            conn.send(("error", str(e), time.perf_counter() - start))
+
+
+class _Request:
+    __slots__ = ("audio", "future", "queued")
+
+    def __init__(self, audio):
+        self.audio = audio
+        self.future = Future()
+        self.queued = time.monotonic()
+
+
+class ASRPool:
+    """
+    Transcribes 16 kHz float32 utterances on `workers` processes.
+
+    submit(audio) returns a Future with the transcript. Each worker process is
+    fed by a dispatcher thread that takes the next micro-batch from the shared
+    queue; a worker that dies, or hangs on a batch for longer than `timeout`
+    seconds, is restarted and its batch failed.
+    """
+
+    def __init__(self, workers=None, max_batch=None, max_wait=None, spec=None, sample_rate=16000, timeout=None):
+        self.workers = workers or config.ASR_WORKERS
+        self.max_batch = max_batch or config.ASR_MAX_BATCH
+        self.max_wait = config.ASR_MAX_WAIT_MS / 1000 if max_wait is None else max_wait
+        self.spec = spec or config.ASR_TRANSCRIBER
+        self.sample_rate = sample_rate
+        self.timeout = timeout or config.ASR_WORKER_TIMEOUT
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._context = multiprocessing.get_context("spawn")
+        self._stats = {"utterances": 0, "batches": 0, "failed": 0, "audio_seconds": 0.0, "busy_seconds": 0.0}
+        self._threads = [
+            threading.Thread(target=self._dispatch, name=f"asr-{i}", daemon=True) for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, audio):
+        request = _Request(audio)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("ASR pool is closed")
+            self._pending.append(request)
+            self._record_depth()
+            self._cond.notify()
+        return request.future
+
+    def transcribe(self, audio, timeout=None):
+        return self.submit(audio).result(timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, queue_depth=len(self._pending), workers=self.workers)
+        stats["avg_batch_size"] = stats["utterances"] / stats["batches"] if stats["batches"] else 0.0
+        stats["real_time_factor"] = stats["busy_seconds"] / stats["audio_seconds"] if stats["audio_seconds"] else 0.0
+        return stats
+
+    def _record_depth(self):
+        if config.METRICS_ENABLED:
+            ASR_QUEUE_DEPTH.set(len(self._pending))
+
+    def _take_batch(self):
+        """Block until a batch is full or its oldest utterance reached the deadline."""
+        with self._cond:
+            while True:
+                if self._pending:
+                    wait = self._pending[0].queued + self.max_wait - time.monotonic()
+                    if len(self._pending) >= self.max_batch or wait <= 0 or self._closed:
+                        batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+                        self._record_depth()
+                        return batch
+                    self._cond.wait(wait)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _start_worker(self):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child, self.spec), daemon=True)
+        process.start()
+        child.close()
+        # Wait for the model to load, without a timeout (the first load may download it) but not past the
+        # worker's death; a worker that died is noticed and restarted on its first batch
+        ready = False
+        while not ready and process.is_alive():
+            ready = parent.poll(1.0)
+        if ready:
+            try:
+                parent.recv()
+            except EOFError:
+                pass
+        return process, parent
+
+    def _dispatch(self):
+        process, conn = self._start_worker()
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                break
+            try:
+                conn.send([request.audio for request in batch])
+                if not conn.poll(self.timeout):
+                    raise TimeoutError(f"no transcripts after {self.timeout:.0f}s")
+                status, result, busy = conn.recv()
+            except (EOFError, OSError) as e:
+                # TimeoutError is an OSError too: a hung worker is replaced like a dead one
+                logger.error(f"ASR worker failed, restarting: {e}")
+                status, result, busy = "error", f"worker failed: {e}", 0.0
+                process.kill()
+                process.join(5)
+                conn.close()
+                process, conn = self._start_worker()
+            self._finish(batch, status, result, busy)
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+        process.join(5)
+
+    def _finish(self, batch, status, result, busy):
+        audio_seconds = sum(len(request.audio) for request in batch) / self.sample_rate
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["utterances"] += len(batch)
+            self._stats["audio_seconds"] += audio_seconds
+            self._stats["busy_seconds"] += busy
+            if status != "ok":
+                self._stats["failed"] += len(batch)
+
+        now = time.monotonic()
+        for i, request in enumerate(batch):
+            if status == "ok":
+                request.future.set_result(result[i])
+            else:
+                request.future.set_exception(RuntimeError(result))
+            if config.METRICS_ENABLED:
+                ASR_SECONDS.observe(now - request.queued)
+        if config.METRICS_ENABLED:
+            ASR_BATCH_SIZE.observe(len(batch))
+            if audio_seconds:
+                ASR_REAL_TIME_FACTOR.observe(busy / audio_seconds)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_asr_pool():
+    """Return the process-wide ASR pool, starting its workers on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ASRPool()
+    return _pool
@@ -0,0 +1,160 @@
+"""
+Audio helpers for Twilio Media Streams: μ-law codec, resampling, a
+preallocated ring buffer and energy-based voice-activity endpointing.
+
+Twilio sends 8 kHz μ-law in 20 ms frames; faster-whisper expects 16 kHz float32.
+Everything here works on whole frames with numpy, without per-sample Python loops.
+"""
+import numpy as np
+import config
+
+STREAM_RATE = 8000
+ASR_RATE = 16000
+FRAME_SAMPLES = 160  # 20 ms at 8 kHz, the size of a Twilio media frame
+
+_BIAS = 0x84
+_CLIP = 32635
+
+
+def _ulaw_table():
+    codes = ~np.arange(256, dtype=np.uint8)
+    sign = codes & 0x80
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = ((mantissa.astype(np.int32) << 3) + _BIAS) << exponent
+    samples = np.where(sign != 0, _BIAS - magnitude, magnitude - _BIAS)
+    return (samples / 32768.0).astype(np.float32)
+
+
+_ULAW_TO_FLOAT = _ulaw_table()
+
+
+def ulaw_decode(payload):
+    """Decode μ-law bytes to float32 samples in [-1, 1]."""
+    return _ULAW_TO_FLOAT[np.frombuffer(payload, dtype=np.uint8)]
+
+
+def ulaw_encode(samples):
+    """Encode float samples in [-1, 1] to μ-law bytes."""
+    pcm = np.clip(np.asarray(samples, dtype=np.float32) * 32768.0, -32768, 32767).astype(np.int32)
+    sign = np.where(pcm < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(pcm), _CLIP) + _BIAS
+    exponent = np.clip(np.floor(np.log2(magnitude)).astype(np.int32) - 7, 0, 7)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+
+def resample(samples, from_rate, to_rate):
+    """Linear-interpolation resampling; enough for speech going into an ASR model."""
+    if from_rate == to_rate or not len(samples):
+        return np.asarray(samples, dtype=np.float32)
+    count = int(round(len(samples) * to_rate / from_rate))
+    positions = np.arange(count, dtype=np.float64) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def upsample_2x(samples, out):
+    """8 kHz -> 16 kHz into `out` (len 2 * len(samples)), interpolating the odd samples."""
+    out[0::2] = samples
+    out[1:-1:2] = (samples[:-1] + samples[1:]) * 0.5
+    out[-1] = samples[-1]
+    return out
+
+
+class RingBuffer:
+    """Fixed-capacity float32 buffer holding the most recent samples."""
+
+    def __init__(self, capacity):
+        self._data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self._end = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, samples):
+        n = len(samples)
+        if n >= self.capacity:
+            self._data[:] = samples[-self.capacity:]
+            self._end, self._size = 0, self.capacity
+            return
+        first = min(n, self.capacity - self._end)
+        self._data[self._end:self._end + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+        self._end = (self._end + n) % self.capacity
+        self._size = min(self.capacity, self._size + n)
+
+    def read(self, count=None):
+        """Copy of the last `count` samples (all of them by default), oldest first."""
+        count = self._size if count is None else min(count, self._size)
+        start = (self._end - count) % self.capacity
+        if start + count <= self.capacity:
+            return self._data[start:start + count].copy()
+        return np.concatenate((self._data[start:], self._data[:self._end]))
+
+    def clear(self):
+        self._end = self._size = 0
+
+
+class Endpointer:
+    """
+    Energy-based voice-activity endpointing over 20 ms frames.
+
+    feed(frame) returns "start" when speech begins, "end" when the speaker has
+    been silent for `silence_ms` after at least `min_speech_ms` of speech (or
+    the utterance hits `max_seconds`), and None otherwise. The silence threshold
+    tracks the background noise floor, so line noise does not read as speech.
+    """
+
+    def __init__(self, threshold_db=None, silence_ms=None, min_speech_ms=None, max_seconds=None):
+        self.threshold_db = config.MEDIA_VAD_THRESHOLD_DB if threshold_db is None else threshold_db
+        frame_ms = FRAME_SAMPLES * 1000 // STREAM_RATE
+        self.silence_frames = (config.MEDIA_VAD_SILENCE_MS if silence_ms is None else silence_ms) // frame_ms
+        self.min_speech_frames = (config.MEDIA_VAD_MIN_SPEECH_MS if min_speech_ms is None else min_speech_ms) // frame_ms
+        self.max_frames = int((max_seconds or config.MEDIA_MAX_UTTERANCE_SECONDS) * 1000 // frame_ms)
+        self.noise_db = -60.0
+        self.in_speech = False
+        self._speech = 0
+        self._silence = 0
+        self._frames = 0
+
+    @staticmethod
+    def frame_db(frame):
+        rms = np.sqrt(np.mean(np.square(frame), dtype=np.float64))
+        return 20 * np.log10(max(rms, 1e-6))
+
+    def feed(self, frame):
+        level = self.frame_db(frame)
+        voiced = level > max(self.threshold_db, self.noise_db + 10)
+        if not voiced:
+            self.noise_db = 0.95 * self.noise_db + 0.05 * level
+
+        if not self.in_speech:
+            self._speech = self._speech + 1 if voiced else 0
+            if self._speech >= 3:
+                self.in_speech = True
+                self._frames = self._speech
+                self._silence = 0
+                return "start"
+            return None
+
+        self._frames += 1
+        if voiced:
+            self._speech += 1
+            self._silence = 0
+        else:
+            self._silence += 1
+        if (self._silence >= self.silence_frames and self._speech >= self.min_speech_frames) \
+                or self._frames >= self.max_frames:
+            self.reset()
+            return "end"
+        if self._silence >= self.silence_frames:
+            # Too short to be an utterance (a click or a cough)
+            self.reset()
+            return "discard"
+        return None
+
+    def reset(self):
+        self.in_speech = False
+        self._speech = self._silence = self._frames = 0
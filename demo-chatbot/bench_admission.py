@@ -0,0 +1,122 @@
+"""
+Load test: a burst of callers speaking at once, with and without admission control.
+
+--calls simulated callers each speak --turns utterances at the same moments,
+posting /transcribe to the <Gather> action and following /pending-reply
+redirects until the reply is spoken, sleeping through every <Pause> as Twilio
+would (the time to speak the filler line itself is not simulated). The fake
+model answers after --llm-latency seconds but generates at most --capacity
+replies at once, like a provider with a concurrency limit, so the burst queues
+up behind it.
+
+Each server runs with ADMISSION_MAX_ACTIVE=0 (no limit: every webhook waits for
+the model) and with ADMISSION_MAX_ACTIVE=--capacity. The report gives the
+latency of every webhook request Twilio makes (the one that must stay under
+Twilio's 15s timeout), the time until each reply is spoken, how many turns got
+the canned reply, and the generation queue's counters.
+
+    python bench_admission.py --calls 60 --turns 3 --capacity 8 --llm-latency 0.8
+"""
+import time
+import logging
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import config
+import sales_bot
+import admission
+from llm_router import ModelRouter
+from bench_server import start_flask, start_asgi
+from bench_utils import summarize, use_temporary_storage
+from fake_services import FakeOpenAIServer
+
+UTTERANCES = ["What does the hub do?", "How much is it per month?", "Does it work with my lights?",
+              "Can I cancel anytime?", "Tell me about the annual plan."]
+
+
+def take_turn(base_url, path, values, timings):
+    """Post a turn and follow /pending-reply redirects; returns the next <Gather> action."""
+    start = time.perf_counter()
+    while True:
+        request_start = time.perf_counter()
+        # A new connection per request: keep-alive connections idle at the barrier get closed by uvicorn
+        res = requests.post(f"{base_url}{path}", data=values, timeout=60)
+        res.raise_for_status()
+        timings["request"].append(time.perf_counter() - request_start)
+        root = ET.fromstring(res.text)
+        redirect = next((el.text for el in root.iter("Redirect")), None) or ""
+        if not redirect.startswith("/pending-reply"):
+            break
+        for pause in root.iter("Pause"):
+            time.sleep(float(pause.get("length", 1)))
+        path = redirect
+    timings["reply"].append(time.perf_counter() - start)
+    if any(el.text == sales_bot.FALLBACK_RESPONSE for el in root.iter("Say")):
+        timings["canned"] += 1
+    return next((el.get("action") for el in root.iter("Gather")), None) or "/transcribe"
+
+
+def run(base_url, args, label):
+    timings = {"request": [], "reply": [], "canned": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.calls)
+
+    def one(i):
+        local = {"request": [], "reply": [], "canned": 0}
+        call_sid = f"CA{label}{i:028d}"
+        action = "/transcribe"
+        for turn in range(args.turns):
+            barrier.wait()  # everyone speaks at once
+            action = take_turn(base_url, action,
+                               {"CallSid": call_sid, "SpeechResult": UTTERANCES[(i + turn) % len(UTTERANCES)]},
+                               local)
+        with lock:
+            for key in ("request", "reply"):
+                timings[key].extend(local[key])
+            timings["canned"] += local["canned"]
+
+    with ThreadPoolExecutor(args.calls) as pool:
+        for future in [pool.submit(one, i) for i in range(args.calls)]:
+            future.result()
+    summarize(f"{label} webhook request", timings["request"])
+    summarize(f"{label} reply spoken", timings["reply"])
+    stats = admission.get_generation_queue().stats()
+    print(f"{'':<28} canned replies {timings['canned']} | inline {stats['inline']} | deferred {stats['deferred']} | "
+          f"rejected {stats['rejected']} | max queued {stats['max_queued']} | "
+          f"mean wait {stats['mean_wait_seconds'] * 1000:.0f}ms | max wait {stats['max_wait_seconds'] * 1000:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test admission control of reply generation")
+    parser.add_argument("--server", choices=["flask", "asgi"], nargs="+", default=["flask", "asgi"])
+    parser.add_argument("--calls", type=int, default=60)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--capacity", type=int, default=8, help="Replies the fake model generates at once")
+    parser.add_argument("--max-queued", type=int, default=100)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--filler-pause", type=int, default=config.ADMISSION_FILLER_PAUSE,
+                        help="Seconds of <Pause> after the filler while a turn waits for a slot")
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)  # turns past the model deadline without admission control
+    use_temporary_storage()
+    sales_bot.context.token_budget = 0
+    config.ADMISSION_MAX_QUEUED = args.max_queued
+    config.ADMISSION_FILLER_PAUSE = args.filler_pause
+    with FakeOpenAIServer(first_token_latency=args.llm_latency, token_interval=0, capacity=args.capacity) as llm:
+        sales_bot.router = ModelRouter.for_url(llm.base_url)
+        for server in args.server:
+            base_url, stop = start_flask(args.calls * 3) if server == "flask" else start_asgi()
+            try:
+                for max_active in (0, args.capacity):
+                    config.ADMISSION_MAX_ACTIVE = max_active
+                    admission._queue = None
+                    run(base_url, args, f"{server}-{'on' if max_active else 'off'}")
+            finally:
+                stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark the transcription pool as the number of concurrent calls grows.
+
+Each simulated call submits an utterance, waits for its transcript, pauses
+for --think seconds (the bot talking) and repeats. By default the workers run
+SyntheticTranscriber, which burns CPU for BENCH_ASR_RTF x audio seconds per
+utterance. Batching gains nothing with it, just as with WhisperTranscriber,
+which decodes a batch one utterance at a time. Set BENCH_ASR_BATCH_SECONDS
+to also charge a fixed cost per batch. That models an engine with a real
+batched forward pass, which this repo does not ship. Any gain from
+--max-batch then comes from that assumed cost, not from faster-whisper. Pass
+--transcriber whisper to measure faster-whisper itself.
+
+    python bench_asr.py --calls 1 4 16 32 --workers 2 --max-batch 1 8
+    BENCH_ASR_BATCH_SECONDS=0.05 python bench_asr.py --calls 32 --max-batch 1 8   # a batched engine
+"""
+import os
+import time
+import argparse
+import threading
+import numpy as np
+import config
+from asr import ASRPool
+from bench_utils import percentile
+
+PER_BATCH_SECONDS = float(os.getenv("BENCH_ASR_BATCH_SECONDS", "0"))
+RTF = float(os.getenv("BENCH_ASR_RTF", "0.05"))
+
+
+def _burn(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+class SyntheticTranscriber:
+    """CPU-bound stand-in for a model: a cost per audio second, plus PER_BATCH_SECONDS per batch."""
+
+    def transcribe_batch(self, audios):
+        _burn(PER_BATCH_SECONDS + RTF * sum(len(audio) for audio in audios) / 16000)
+        return [f"utterance of {len(audio) / 16000:.1f} seconds" for audio in audios]
+
+
+def run(pool, calls, duration, utterance, think):
+    latencies = []
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def caller():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            pool.transcribe(utterance)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+            time.sleep(think)
+
+    threads = [threading.Thread(target=caller) for _ in range(calls)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batched transcription worker pool")
+    parser.add_argument("--calls", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--max-wait-ms", type=float, default=config.ASR_MAX_WAIT_MS)
+    parser.add_argument("--seconds", type=float, default=5, help="Duration of each run")
+    parser.add_argument("--utterance-seconds", type=float, default=2.0)
+    parser.add_argument("--think", type=float, default=0.5, help="Pause between a call's utterances (s)")
+    parser.add_argument("--transcriber", default="bench_asr:SyntheticTranscriber")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    utterance = (rng.standard_normal(int(args.utterance_seconds * 16000)) * 0.1).astype(np.float32)
+    # The metrics exporter is not needed here
+    config.METRICS_ENABLED = False
+
+    for max_batch in args.max_batch:
+        pool = ASRPool(workers=args.workers, max_batch=max_batch, max_wait=args.max_wait_ms / 1000,
+                       spec=args.transcriber)
+        pool.transcribe(utterance)  # wait for the models to load
+        for calls in args.calls:
+            before = pool.stats()
+            latencies, elapsed = run(pool, calls, args.seconds, utterance, args.think)
+            after = pool.stats()
+            batches = after["batches"] - before["batches"]
+            utterances = after["utterances"] - before["utterances"]
+            rtf = (after["busy_seconds"] - before["busy_seconds"]) / (after["audio_seconds"] - before["audio_seconds"])
+            print(f"max_batch={max_batch:<2} calls={calls:<3} | {len(latencies) / elapsed:6.1f} utterances/sec | "
+                  f"p50={percentile(latencies, 50) * 1000:7.1f}ms p95={percentile(latencies, 95) * 1000:7.1f}ms | "
+                  f"avg batch {utterances / max(batches, 1):4.1f} | rtf {rtf:.3f}")
+        pool.close()
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Stress test: overlapping webhooks for the same call across several workers.
+
+Starts --workers Flask server processes sharing one SQLite conversation store
+(as gunicorn workers on one host would), then for each of --calls calls fires
+--burst concurrent /transcribe webhooks with distinct utterances, spread over
+the workers, followed by /call-status. Afterwards every history is checked:
+each utterance must be stored exactly once and directly followed by its own
+reply, and the uploaded conversation must match the stored one.
+
+    python bench_call_concurrency.py --workers 4 --calls 20 --burst 8
+    python bench_call_concurrency.py --lock-wait 0   # no waiting: versioned saves alone must keep every turn
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from fake_services import FakeOpenAIServer, FakeBackendServer
+
+REPLY_PREFIX = "Reply to "
+
+
+def _reply(request):
+    user = [m.get("content", "") for m in request["messages"] if m["role"] == "user"]
+    return f"{REPLY_PREFIX}{user[-1] if user else ''}"
+
+
+def _serve(threads, ready):
+    """Worker process: one Flask server on a pooled WSGI server."""
+    logging.disable(logging.WARNING)
+    sys.stdout = open(os.devnull, "w")
+    from bench_server import start_flask
+
+    url, _ = start_flask(threads)
+    ready.put(url)
+    threading.Event().wait()
+
+
+def check_history(conversation, utterances):
+    """(lost, duplicated, out of order) turns of one call."""
+    said = [m["content"] for m in conversation if m["role"] == "user"]
+    lost = sum(1 for u in utterances if u not in said)
+    duplicated = len(said) - len(set(said))
+    out_of_order = 0
+    for i, message in enumerate(conversation):
+        if message["role"] == "user":
+            following = conversation[i + 1] if i + 1 < len(conversation) else {}
+            if following.get("content") != f"{REPLY_PREFIX}{message['content']}":
+                out_of_order += 1
+    return lost, duplicated, out_of_order
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent webhooks for the same call across workers")
+    parser.add_argument("--workers", type=int, default=4, help="Server processes")
+    parser.add_argument("--threads", type=int, default=16, help="Request threads per worker")
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=8, help="Concurrent /transcribe webhooks per call")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--lock-wait", type=float, default=None, help="CALL_LOCK_WAIT_SECONDS for the workers")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_call_concurrency_")
+    llm = FakeOpenAIServer(reply=_reply, first_token_latency=args.llm_latency, token_interval=0).start()
+    backend = FakeBackendServer(latency=0).start()
+    os.environ.update({
+        "API_BASE_URL": llm.base_url, "API_KEY": "fake", "MODEL_NAME": "fake",
+        "CONVERSATION_STORE": "sqlite", "CONVERSATION_DB": os.path.join(workdir, "conversations.db"),
+        "CALL_PROFILES_DB": os.path.join(workdir, "call_profiles.db"),
+        "OUTBOX_DB": os.path.join(workdir, "outbox.db"), "OUTBOX_BATCH_WAIT": "0.05",
+        "NODE_BACKEND_URL": backend.url, "CONTEXT_TOKEN_BUDGET": "0",
+    })
+    if args.lock_wait is not None:
+        os.environ["CALL_LOCK_WAIT_SECONDS"] = str(args.lock_wait)
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    processes = [context.Process(target=_serve, args=(args.threads, ready), daemon=True)
+                 for _ in range(args.workers)]
+    try:
+        for process in processes:
+            process.start()
+        urls = [ready.get(timeout=60) for _ in processes]
+
+        calls = {f"CA{i:032x}": [f"utterance {j} of call {i}" for j in range(args.burst)] for i in range(args.calls)}
+        sessions = threading.local()
+
+        def post(url, path, data):
+            session = getattr(sessions, "session", None) or requests.Session()
+            sessions.session = session
+            session.post(f"{url}{path}", data=data, timeout=120).raise_for_status()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.calls * args.burst) as pool:
+            futures = [pool.submit(post, urls[j % len(urls)], "/transcribe", {"CallSid": call_sid, "SpeechResult": u})
+                       for call_sid, utterances in calls.items() for j, u in enumerate(utterances)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+        for i, call_sid in enumerate(calls):
+            post(urls[i % len(urls)], "/call-status", {"CallSid": call_sid, "CallStatus": "completed"})
+
+        deadline = time.monotonic() + 30
+        while len(backend.conversations) < len(calls) and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        from storage import SQLiteConversationStore
+        store = SQLiteConversationStore(os.environ["CONVERSATION_DB"])
+        totals = [0, 0, 0]
+        upload_mismatches = 0
+        for call_sid, utterances in calls.items():
+            conversation = store.load(call_sid) or []
+            for k, count in enumerate(check_history(conversation, utterances)):
+                totals[k] += count
+            uploaded = backend.conversations.get(call_sid, {}).get("conversation")
+            if uploaded is None or len(uploaded) != len(conversation):
+                upload_mismatches += 1
+
+        turns = args.calls * args.burst
+        print(f"{args.workers} workers | {args.calls} calls x {args.burst} concurrent turns | "
+              f"{turns / elapsed:.1f} turns/sec")
+        print(f"lost turns {totals[0]} | duplicated {totals[1]} | replies out of order {totals[2]} | "
+              f"uploads not matching the history {upload_mismatches}")
+        ok = not any(totals) and not upload_mismatches
+        print("✅ every turn kept, in order" if ok else "❌ turns lost, duplicated or out of order")
+        sys.exit(0 if ok else 1)
+    finally:
+        for process in processes:
+            process.kill()
+        llm.stop()
+        backend.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
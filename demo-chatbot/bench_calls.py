@@ -0,0 +1,194 @@
+"""
+End-to-end call simulation: many concurrent scripted calls, fully offline.
+
+Each simulated call is placed through make_outbound_call against a fake Twilio
+REST API, then walks the webhooks the way Twilio would: /voice, one /transcribe
+per scripted utterance (following /continue-reply redirects when replies are
+streamed) and finally /call-status, whose upload goes through the outbox to a
+fake Node backend. Completions come from a fake OpenAI server with
+--llm-latency seconds to the first token.
+
+Turn latency is measured from the webhook request to the first <Say> the caller
+would hear. CPU and memory are measured for the whole process (server, fakes
+and simulated callers alike), so compare them between runs of this script
+rather than reading them as absolute server cost.
+
+    python bench_calls.py --calls 200 --concurrency 50 --server asgi --llm-latency 0.3
+    python bench_calls.py --scripts transcripts.jsonl --max-p95-ms 1500   # exits 1 above the limit
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import contextlib
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import config
+from bench_utils import percentile, summarize, use_temporary_storage, rss_bytes
+from fake_services import FakeOpenAIServer, FakeTwilioServer, FakeBackendServer
+
+SCRIPTS = [
+    ["Hi, who is this?", "What does the smart home hub do?", "How much is it per month?",
+     "Okay, tell me about the annual plan.", "Sounds good, goodbye."],
+    ["Hello?", "I'm not sure, I need to think about it.", "Is there a trial?", "That's all, bye."],
+    ["Yes, speaking.", "Does it work with my existing lights?", "What about the mobile app?",
+     "How long does setup take?", "Can I cancel anytime?", "Have a good day."],
+]
+
+
+def load_scripts(path):
+    """One JSON list of utterances per line."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _twiml(text):
+    root = ET.fromstring(text)
+    says = [el.text or "" for el in root.iter("Say") if el.text]
+    redirect = next((el.text for el in root.iter("Redirect")), None)
+    action = next((el.get("action") for el in root.iter("Gather")), None)
+    hangup = root.find("Hangup") is not None
+    return says, redirect, action, hangup
+
+
+def _turn(session, base_url, path, values, timings):
+    """
+    POST a webhook and follow /continue-reply and /pending-reply redirects until the reply is complete.
+    Returns the <Gather> action to post the next utterance to (None once the bot hangs up).
+    """
+    start = time.perf_counter()
+    first = None
+    while True:
+        res = session.post(f"{base_url}{path}", data=values, timeout=60)
+        res.raise_for_status()
+        says, redirect, action, hangup = _twiml(res.text)
+        if says and first is None:
+            first = time.perf_counter() - start
+        if not (redirect or "").startswith(("/continue-reply", "/pending-reply")):
+            break
+        path = redirect
+    timings["first_say"].append(first if first is not None else time.perf_counter() - start)
+    timings["full_reply"].append(time.perf_counter() - start)
+    return None if hangup else action or "/transcribe"
+
+
+def simulate_call(base_url, call_sid, script, timings):
+    session = requests.Session()
+    caller = {"CallSid": call_sid, "From": "+15550100"}
+    action = _turn(session, base_url, "/voice", caller, timings)
+    for utterance in script:
+        action = _turn(session, base_url, action, {**caller, "SpeechResult": utterance}, timings)
+        if action is None:
+            break
+    session.post(f"{base_url}/call-status", data={**caller, "CallStatus": "completed"}, timeout=60).raise_for_status()
+
+
+def point_at_fakes(llm, twilio, backend, workdir):
+    """Route every outbound dependency of the bot to the local fakes."""
+    import sales_bot
+    from llm_router import ModelRouter
+
+    use_temporary_storage()
+    config.CALL_PROFILES_DB = os.path.join(workdir, "call_profiles.db")
+    config.OUTBOX_DB = os.path.join(workdir, "outbox.db")
+    config.OUTBOX_BATCH_WAIT = 0.05
+    config.NODE_BACKEND_URL = backend.url
+    config.TWILIO_API_BASE_URL = twilio.url
+    config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN = "AC" + "0" * 32, "fake"
+    config.PREGENERATE_INTROS = True  # intros come from the fake model too
+    sales_bot.router = ModelRouter.for_url(llm.base_url)
+
+
+def run(base_url, scripts, calls, concurrency):
+    from twilio_handler import make_outbound_call
+
+    timings = {"first_say": [], "full_reply": []}
+    lock = threading.Lock()
+    failures = []
+
+    def one(i):
+        call_sid = make_outbound_call(f"+1555{i:07d}", base_url, {"name": f"Prospect {i}", "interests": "home automation"})
+        try:
+            local = {"first_say": [], "full_reply": []}
+            simulate_call(base_url, call_sid, scripts[i % len(scripts)], local)
+            with lock:
+                for key, values in local.items():
+                    timings[key].extend(values)
+        except Exception as e:
+            with lock:
+                failures.append(f"{call_sid}: {e}")
+
+    cpu_start, rss_start, start = time.process_time(), rss_bytes(), time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(calls)))
+    elapsed = time.perf_counter() - start
+    return {
+        "timings": timings,
+        "failures": failures,
+        "seconds": elapsed,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "rss_growth": rss_bytes() - rss_start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent scripted calls end to end against local fakes")
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--server", choices=["flask", "asgi"], default=config.SERVER_BACKEND)
+    parser.add_argument("--flask-threads", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake OpenAI time to first token (s)")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="Fake OpenAI time between tokens (s)")
+    parser.add_argument("--twilio-latency", type=float, default=0.05)
+    parser.add_argument("--backend-latency", type=float, default=0.01)
+    parser.add_argument("--scripts", help="JSON-lines file of utterance lists (default: built-in scripts)")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit with status 1 if p95 turn latency exceeds this")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    scripts = load_scripts(args.scripts) if args.scripts else SCRIPTS
+    workdir = tempfile.mkdtemp(prefix="bench_calls_")
+
+    with FakeOpenAIServer(first_token_latency=args.llm_latency, token_interval=args.token_interval) as llm, \
+            FakeTwilioServer(latency=args.twilio_latency) as twilio, \
+            FakeBackendServer(latency=args.backend_latency) as backend:
+        point_at_fakes(llm, twilio, backend, workdir)
+        from bench_server import start_flask, start_asgi
+        base_url, stop = start_asgi() if args.server == "asgi" else start_flask(args.flask_threads)
+        try:
+            # conversation.py reports uploads with print(); keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(base_url, scripts, args.calls, args.concurrency)
+            from outbox import get_outbox
+            outbox = get_outbox()
+            deadline = time.monotonic() + 30
+            while outbox.depth() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop()
+
+    timings, calls = result["timings"], args.calls
+    print(f"{args.server} | {calls} calls, {args.concurrency} concurrent | "
+          f"{calls / result['seconds']:.1f} calls/sec | {len(result['failures'])} failed | "
+          f"{len(twilio.calls)} placed | {len(backend.conversations)} uploaded in {backend.requests} requests")
+    summarize("turn latency (first <Say>)", timings["first_say"])
+    summarize("turn latency (full reply)", timings["full_reply"])
+    print(f"cpu per call: {result['cpu_seconds'] / calls * 1000:.1f}ms | "
+          f"rss growth per call: {result['rss_growth'] / calls / 1024:.1f}KiB | "
+          f"model requests: {len(llm.requests)}")
+    for failure in result["failures"][:5]:
+        print(f"  failed: {failure}")
+
+    p95_ms = percentile(timings["first_say"], 95) * 1000
+    if result["failures"] or (args.max_p95_ms and p95_ms > args.max_p95_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Show per-turn prompt size on a long simulated call, with and without the
+token-budgeted context window, against a local fake OpenAI server.
+
+    python bench_context.py --turns 40 --budget 2000
+"""
+import time
+import argparse
+import sales_bot
+from llm_router import ModelRouter
+from bench_utils import use_temporary_storage
+from context_window import ContextWindow, message_tokens
+from fake_services import FakeOpenAIServer
+
+USER_INFO = {"name": "Michael", "interests": "Home automation"}
+
+
+def run_call(server, call_sid, turns):
+    """Return the prompt tokens of each turn's request as received by the fake server."""
+    counts = []
+    for i in range(turns):
+        utterance = f"Can you tell me more about feature number {i}?"
+        sales_bot.generate_response(utterance, call_sid, USER_INFO)
+        # Skip the background summarizer's requests
+        request = next(r for r in reversed(server.requests) if r["messages"][-1]["content"] == utterance)
+        counts.append(sum(message_tokens(m) for m in request["messages"]))
+        # Give the background summarizer a moment, as the caller's speaking time would
+        time.sleep(0.05)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn prompt tokens with and without a context budget")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--recent-turns", type=int, default=4)
+    args = parser.parse_args()
+
+    use_temporary_storage()
+    with FakeOpenAIServer(first_token_latency=0, token_interval=0) as server:
+        sales_bot.router = ModelRouter.for_url(server.base_url)
+
+        sales_bot.context = ContextWindow(sales_bot._summarize, token_budget=0)
+        unbounded = run_call(server, "BENCH_UNBOUNDED", args.turns)
+        sales_bot.context = ContextWindow(sales_bot._summarize, token_budget=args.budget,
+                                          recent_turns=args.recent_turns)
+        budgeted = run_call(server, "BENCH_BUDGETED", args.turns)
+
+    print(f"{'turn':>4} | {'full history':>12} | {'budgeted':>8}")
+    for turn, (full, bounded) in enumerate(zip(unbounded, budgeted), 1):
+        print(f"{turn:>4} | {full:>12} | {bounded:>8}")
+
+
+if __name__ == "__main__":
+    main()
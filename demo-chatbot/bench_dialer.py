@@ -0,0 +1,79 @@
+"""
+Run an outbound campaign against a local fake Twilio REST API.
+
+Streams a generated JSON-lines prospects file through the dialer, interrupts
+the campaign halfway with a KeyboardInterrupt, resumes it from the checkpoint
+and checks every prospect was called exactly once. The first --failures call
+requests fail, so the resumed run must retry those prospects.
+
+    python bench_dialer.py --prospects 2000 --rate 200 --concurrency 16 --latency 0.05 --failures 20
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import config
+from dialer import Dialer, iter_prospects
+from fake_services import FakeTwilioServer
+
+
+def write_prospects(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps({"phone": f"+1555{i:07d}", "user_info": {"name": f"Prospect {i}"}}) + "\n")
+
+
+def interrupt_after(prospects, count):
+    """Yield `count` prospects, then raise KeyboardInterrupt like a Ctrl-C mid-campaign."""
+    for index, prospect in enumerate(prospects):
+        if index == count:
+            raise KeyboardInterrupt
+        yield prospect
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the outbound dialer")
+    parser.add_argument("--prospects", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake Twilio request latency (s)")
+    parser.add_argument("--failures", type=int, default=20, help="Call requests the fake Twilio API fails")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_dialer_")
+    prospects_path = os.path.join(workdir, "prospects.jsonl")
+    checkpoint_path = os.path.join(workdir, "campaign.checkpoint")
+    config.CALL_PROFILES_DB = os.path.join(workdir, "call_profiles.db")
+    config.DIALER_CONCURRENCY = args.concurrency
+    config.PREGENERATE_INTROS = False  # no model here; the campaign only talks to the fake Twilio API
+    write_prospects(prospects_path, args.prospects)
+
+    with FakeTwilioServer(latency=args.latency) as twilio:
+        config.TWILIO_API_BASE_URL = twilio.url
+        config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN = "AC" + "0" * 32, "fake"
+        twilio.fail_next = args.failures
+
+        started = time.monotonic()
+        first = Dialer("https://example.test", rate=args.rate, concurrency=args.concurrency,
+                       checkpoint_path=checkpoint_path)
+        try:
+            first.run(interrupt_after(iter_prospects(prospects_path), args.prospects // 2))
+        except KeyboardInterrupt:
+            pass
+        first_stats = dict(first.stats, seconds=time.monotonic() - started)
+        second = Dialer("https://example.test", rate=args.rate, concurrency=args.concurrency,
+                        checkpoint_path=checkpoint_path)
+        second_stats = second.run(iter_prospects(prospects_path))
+
+        dialed = [call["To"] for call in twilio.calls]
+        elapsed = first_stats["seconds"] + second_stats["seconds"]
+        print(f"interrupted run: {first_stats}")
+        print(f"resumed run:     {second_stats}")
+        print(f"{len(dialed)} calls ({len(set(dialed))} unique, {args.prospects} prospects) in {elapsed:.1f}s "
+              f"= {len(dialed) / elapsed:.0f} calls/sec, peak {twilio.max_in_flight} in flight "
+              f"(legacy loop: >= {args.prospects * 3:.0f}s)")
+
+
+if __name__ == "__main__":
+    main()
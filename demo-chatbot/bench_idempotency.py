@@ -0,0 +1,123 @@
+"""
+Measure duplicate webhook handling under Twilio-style retries.
+
+Simulated calls answer /voice and then post one /transcribe per turn to the
+<Gather> action, against a fake model slower than Twilio's patience: --retry-after
+seconds into each request the same request is posted again (a retry), and a
+fraction --repeat-rate of turns is posted a third time once answered (a late
+re-request). Every call says "Yes." more than once, so distinct turns with the
+same words must not be merged.
+
+Each server runs once with WEBHOOK_DEDUP off and once on. The report gives the
+latency of the original requests, the model requests made per turn, the user
+turns appended to the histories per turn, and the deduplication counters.
+
+    python bench_idempotency.py --calls 10 --turns 4 --llm-latency 1.5 --retry-after 0.5
+"""
+import time
+import random
+import logging
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import requests
+import config
+import sales_bot
+import idempotency
+from llm_router import ModelRouter
+from conversation import load_conversation_history
+from bench_server import start_flask, start_asgi
+from bench_utils import summarize, use_temporary_storage
+from fake_services import FakeOpenAIServer
+
+UTTERANCES = ["Yes.", "What does the hub do?", "Yes.", "How much is it?", "Okay.", "Yes."]
+
+
+def _action(text):
+    root = ET.fromstring(text)
+    return next((el.get("action") for el in root.iter("Gather")), None) or "/transcribe"
+
+
+def simulate_call(base_url, call_sid, args, rng, latencies):
+    caller = {"CallSid": call_sid, "From": "+15550100"}
+
+    def post(path, values):
+        res = requests.post(f"{base_url}{path}", data=values, timeout=60)
+        res.raise_for_status()
+        return res.text
+
+    with ThreadPoolExecutor(2) as pool:
+        path, values = "/voice", caller
+        for turn in range(args.turns + 1):
+            start = time.perf_counter()
+            original = pool.submit(post, path, values)
+            try:
+                text = original.result(timeout=args.retry_after)
+            except TimeoutError:
+                retry = pool.submit(post, path, values)
+                text = original.result()
+                retry.result()
+            latencies.append(time.perf_counter() - start)
+            if rng.random() < args.repeat_rate:
+                post(path, values)
+            path = _action(text)
+            values = {**caller, "SpeechResult": UTTERANCES[turn % len(UTTERANCES)]}
+    requests.post(f"{base_url}/call-status", data={**caller, "CallStatus": "in-progress"}, timeout=60)
+
+
+def run(base_url, args, llm, label):
+    latencies = []
+    lock = threading.Lock()
+    requests_before = len(llm.requests)
+
+    def one(i):
+        local = []
+        simulate_call(base_url, f"CA{label}{i:028d}", args, random.Random(i), local)
+        with lock:
+            latencies.extend(local)
+
+    with ThreadPoolExecutor(args.calls) as pool:
+        for future in [pool.submit(one, i) for i in range(args.calls)]:
+            future.result()
+
+    turns = args.calls * args.turns
+    user_turns = sum(sum(1 for m in load_conversation_history(f"CA{label}{i:028d}") if m["role"] == "user")
+                     for i in range(args.calls))
+    summarize(f"{label} per request", latencies)
+    print(f"{'':<28} model requests per turn {(len(llm.requests) - requests_before) / (turns + args.calls):.2f} | "
+          f"user turns saved per turn {user_turns / turns:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark idempotent webhooks under Twilio retries")
+    parser.add_argument("--server", choices=["flask", "asgi"], nargs="+", default=["flask", "asgi"])
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=1.5)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--repeat-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    use_temporary_storage()
+    config.PREGENERATE_INTROS = False
+    sales_bot.context.token_budget = 0
+    with FakeOpenAIServer(first_token_latency=args.llm_latency) as llm:
+        sales_bot.router = ModelRouter.for_url(llm.base_url)
+        for server in args.server:
+            base_url, stop = start_flask(args.calls * 4) if server == "flask" else start_asgi()
+            try:
+                for dedup in (False, True):
+                    config.WEBHOOK_DEDUP = dedup
+                    idempotency._deduplicator = None
+                    run(base_url, args, llm, f"{server}-{'on' if dedup else 'off'}")
+            finally:
+                stop()
+            stats = idempotency.get_deduplicator().stats()
+            print(f"{'':<28} executed {stats['executed']} | coalesced {stats['coalesced']} | "
+                  f"replayed {stats['replayed']} | cached {stats['cached']}")
+
+
+if __name__ == "__main__":
+    main()
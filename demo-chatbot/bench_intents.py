@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: substring loops over indicator lists vs the compiled IntentMatcher.
+
+    python bench_intents.py --phrases 14 500 5000 --transcripts 10000
+"""
+import time
+import random
+import argparse
+import config
+from intent_matcher import IntentMatcher
+
+WORDS = (
+    "price plan hub speaker smart home app monthly annual discount offer later maybe think call back "
+    "expensive budget family music stream device phone laptop install setup support warranty trial"
+).split()
+
+
+def make_phrases(count, rng):
+    phrases = list(config.CLOSING_INDICATORS)
+    while len(phrases) < count:
+        phrases.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))))
+    return phrases[:count]
+
+
+def make_transcripts(count, rng):
+    return [" ".join(rng.choice(WORDS + ["I", "we", "the", "is", "recommend"]) for _ in range(rng.randint(3, 20)))
+            for _ in range(count)]
+
+
+def loop_match(phrases, text):
+    text_lower = text.lower()
+    for indicator in phrases:
+        if indicator in text_lower:
+            return indicator
+    return None
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indicator matching")
+    parser.add_argument("--phrases", type=int, nargs="+", default=[len(config.CLOSING_INDICATORS), 500, 5000])
+    parser.add_argument("--transcripts", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    transcripts = make_transcripts(args.transcripts, rng)
+    for count in args.phrases:
+        phrases = make_phrases(count, rng)
+        build_time, matcher = timed(lambda: IntentMatcher(phrases))
+        loop_time, loop_hits = timed(lambda: [loop_match(phrases, t) for t in transcripts])
+        single_time, hits = timed(lambda: [matcher.search(t) for t in transcripts])
+        batch_time, batch_hits = timed(lambda: matcher.search_batch(transcripts))
+        assert hits == batch_hits
+
+        n = len(transcripts)
+        print(f"{count:>5} phrases (compiled in {build_time * 1000:.1f}ms): "
+              f"loop {n / loop_time:>9.0f}/s ({sum(h is not None for h in loop_hits)} hits) | "
+              f"matcher {n / single_time:>9.0f}/s | batch {n / batch_time:>9.0f}/s "
+              f"({sum(h is not None for h in hits)} hits)")
+
+
+if __name__ == "__main__":
+    main()
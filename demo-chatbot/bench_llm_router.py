@@ -0,0 +1,99 @@
+"""
+Exercise the model router against local fake endpoints with injected latency.
+
+Scenarios (three fake endpoints: fast, medium and slow):
+  steady   - latencies stay fixed; turns should go to the fast endpoint
+  degrade  - the fast endpoint slows past the deadline halfway through; hedges
+             cover the switch and later turns move to the medium endpoint
+  outage   - the fast endpoint fails every request; turns fail over
+  overload - every endpoint is slower than the deadline; turns get the canned
+             reply once the deadline passes
+
+Reports per-turn latency (to the first token for --mode stream), which
+endpoint answered and the router's hedge/fail-over counts.
+
+    python bench_llm_router.py --mode chat stream async --turns 40
+"""
+import time
+import asyncio
+import argparse
+from collections import Counter
+import config
+from bench_utils import summarize
+from fake_services import FakeOpenAIServer
+from llm_router import ModelRouter, Endpoint, ModelUnavailable
+
+MESSAGES = [{"role": "user", "content": "Tell me about the hub."}]
+LATENCIES = {"fast": 0.1, "medium": 0.4, "slow": 1.2}
+
+
+def turn(router, mode, loop):
+    """(seconds until the reply or its first token, endpoint that answered)."""
+    start = time.perf_counter()
+    try:
+        if mode == "chat":
+            response = router.chat(messages=MESSAGES, max_tokens=50)
+            return time.perf_counter() - start, response.model
+        if mode == "async":
+            response = loop.run_until_complete(router.achat(messages=MESSAGES, max_tokens=50))
+            return time.perf_counter() - start, response.model
+        first = None
+        for chunk in router.stream(messages=MESSAGES, max_tokens=50):
+            if first is None:
+                first = time.perf_counter() - start, chunk.model
+        return first
+    except ModelUnavailable:
+        return time.perf_counter() - start, "canned reply"
+
+
+def scenario(name, mode, servers, turns, deadline, hedge_after, loop):
+    for server, latency in zip(servers.values(), LATENCIES.values()):
+        server.first_token_latency = latency
+        server.error_rate = 0.0
+    if name == "outage":
+        servers["fast"].error_rate = 1.0
+    if name == "overload":
+        for server in servers.values():
+            server.first_token_latency = deadline * 1.5
+
+    router = ModelRouter([Endpoint(label, server.base_url, "fake", model=label) for label, server in servers.items()],
+                         deadline=deadline, hedge_after=hedge_after)
+    latencies, winners = [], Counter()
+    for i in range(turns):
+        if name == "degrade" and i == turns // 2:
+            servers["fast"].first_token_latency = deadline * 2
+        seconds, winner = turn(router, mode, loop)
+        latencies.append(seconds)
+        winners[winner] += 1
+
+    stats = router.stats()
+    summarize(f"{mode}/{name}", latencies)
+    print(f"{'':<28} answered by {dict(winners)} | hedged {stats['hedged']} (won {stats['hedge_wins']}) | "
+          f"failovers {stats['failovers']} | canned {stats['unavailable']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latency-aware model routing with fake endpoints")
+    parser.add_argument("--mode", nargs="+", default=["chat", "stream", "async"], choices=["chat", "stream", "async"])
+    parser.add_argument("--scenario", nargs="+", default=["steady", "degrade", "outage", "overload"])
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--deadline", type=float, default=2.0)
+    parser.add_argument("--hedge-after", type=float, default=0.5)
+    args = parser.parse_args()
+    config.METRICS_ENABLED = False
+
+    servers = {label: FakeOpenAIServer(first_token_latency=latency, token_interval=0).start()
+               for label, latency in LATENCIES.items()}
+    loop = asyncio.new_event_loop()  # one loop for every async turn, as under the ASGI server
+    try:
+        for mode in args.mode:
+            for name in args.scenario:
+                scenario(name, mode, servers, args.turns, args.deadline, args.hedge_after, loop)
+            print()
+    finally:
+        for server in servers.values():
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
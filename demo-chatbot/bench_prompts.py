@@ -0,0 +1,82 @@
+"""
+Measure the bytes per call saved by storing prompt template references.
+
+Writes the same simulated calls once with the system prompts expanded (the
+old format) and once as template references, to both conversation stores and
+through the outbox to a fake Node backend, and reports bytes per call on disk
+and on the wire.
+
+    python bench_prompts.py --calls 500 --turns 4
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from conversation import initialize_sales_conversation
+from fake_services import FakeBackendServer
+from outbox import Outbox
+from prompts import expand
+from storage import FileConversationStore, AppendLogStore
+
+USER_INFO = {"name": "Michael", "last_visit_date": "2024-03-02", "interests": "Home automation, Music streaming"}
+
+
+def conversations(calls, turns):
+    for i in range(calls):
+        conversation = initialize_sales_conversation(USER_INFO)
+        for turn in range(turns):
+            conversation.append({"role": "user", "content": f"Tell me more about option {turn}."})
+            conversation.append({"role": "assistant", "content": "Our Smart Home Hub connects all your devices. " * 3})
+        yield f"CA{i:032x}", conversation
+
+
+def disk_bytes(make_store, calls):
+    directory = tempfile.mkdtemp(prefix="bench_prompts_")
+    try:
+        store = make_store(directory)
+        for call_sid, conversation in calls:
+            store.save(call_sid, conversation)
+        store.close()
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def wire_bytes(calls):
+    directory = tempfile.mkdtemp(prefix="bench_prompts_outbox_")
+    try:
+        with FakeBackendServer(latency=0) as backend:
+            outbox = Outbox(path=os.path.join(directory, "outbox.db"), backend_url=backend.url, batch_wait=0)
+            for call_sid, conversation in calls:
+                outbox.enqueue(call_sid, conversation, USER_INFO)
+            outbox.start()
+            while outbox.depth():
+                time.sleep(0.05)
+            outbox.stop()
+            return backend.bytes_received
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes saved by prompt template references")
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=4, help="User/bot exchanges per call")
+    args = parser.parse_args()
+
+    referenced = list(conversations(args.calls, args.turns))
+    expanded = [(call_sid, expand(conversation)) for call_sid, conversation in referenced]
+    log_store = lambda d: AppendLogStore(d, flush_interval=60)
+
+    for name, measure in [("file store", lambda calls: disk_bytes(FileConversationStore, calls)),
+                          ("log store", lambda calls: disk_bytes(log_store, calls)),
+                          ("upload", wire_bytes)]:
+        before = measure(expanded) / args.calls
+        after = measure(referenced) / args.calls
+        print(f"{name:<10} | expanded {before:8.0f} B/call | referenced {after:8.0f} B/call | "
+              f"saved {before - after:8.0f} B/call ({(1 - after / before) * 100:4.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
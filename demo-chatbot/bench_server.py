@@ -0,0 +1,124 @@
+"""
+Load test: concurrent simulated calls against the Flask and ASGI webhook servers.
+
+Each simulated call posts /voice, then --turns x /transcribe, then /call-status,
+against a local fake OpenAI server with --llm-latency seconds per completion.
+The Flask app is served by a fixed pool of --flask-threads worker threads (as a
+gthread gunicorn worker would); the ASGI app by a single uvicorn event loop.
+
+    python bench_server.py --concurrency 10 50 200 --turns 3 --llm-latency 0.5
+"""
+import time
+import socket
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import uvicorn
+from werkzeug.serving import BaseWSGIServer
+import sales_bot
+from llm_router import ModelRouter
+import asgi_app
+from app import app as flask_app
+from bench_utils import summarize, use_temporary_storage
+from fake_services import FakeOpenAIServer
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling requests on a fixed-size thread pool."""
+
+    request_queue_size = 1024
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_flask(threads):
+    server = PooledWSGIServer("127.0.0.1", free_port(), flask_app, threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def start_asgi():
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(asgi_app.app, host="127.0.0.1", port=port,
+                                           log_level="warning", backlog=1024))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return f"http://127.0.0.1:{port}", stop
+
+
+def simulate_call(base_url, call_sid, turns, turn_latencies):
+    session = requests.Session()
+    caller = {"CallSid": call_sid, "From": "+15550100"}
+    start = time.perf_counter()
+    session.post(f"{base_url}/voice", data=caller).raise_for_status()
+    turn_latencies.append(time.perf_counter() - start)
+    for i in range(turns):
+        start = time.perf_counter()
+        session.post(f"{base_url}/transcribe",
+                     data={**caller, "SpeechResult": f"Tell me more about option {i}."}).raise_for_status()
+        turn_latencies.append(time.perf_counter() - start)
+    session.post(f"{base_url}/call-status", data={**caller, "CallStatus": "in-progress"}).raise_for_status()
+
+
+def run_load(name, base_url, concurrency, turns):
+    turn_latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = [pool.submit(simulate_call, base_url, f"CA{name}{concurrency}_{i}", turns, turn_latencies)
+                   for i in range(concurrency)]
+        failures = sum(1 for f in futures if f.exception())
+    elapsed = time.perf_counter() - start
+    print(f"{name:>5} | {concurrency:>4} concurrent calls | {concurrency / elapsed:7.1f} calls/sec | {failures} failed")
+    summarize(f"{name} turn latency", turn_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Flask and ASGI webhook servers under concurrent calls")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--flask-threads", type=int, default=16)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    use_temporary_storage()
+    with FakeOpenAIServer(first_token_latency=args.llm_latency, token_interval=0) as llm:
+        sales_bot.router = ModelRouter.for_url(llm.base_url)
+
+        for name, start_server in (("flask", lambda: start_flask(args.flask_threads)), ("asgi", start_asgi)):
+            base_url, stop = start_server()
+            for concurrency in args.concurrency:
+                run_load(name, base_url, concurrency, args.turns)
+            stop()
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Measure speculative replies from partial transcripts.
+
+Simulated callers speak scripted utterances word by word (--word-ms apart),
+posting a /partial-transcript for each word the way <Gather> does. When they
+stop, the recognizer confirms the last partial with a high stability and Twilio
+waits --endpoint-ms of silence before posting the final SpeechResult to
+/transcribe. Some callers pause mid-sentence (--pause-rate: a stable partial
+that is then extended), and some final transcripts correct a word of the last
+partial (--correction-rate), so speculations are also superseded and missed.
+
+Each run is made with speculation off and on; the report gives the /transcribe
+latency and the time from the end of speech to the reply, plus the hit rate,
+the wasted-token ratio and the generation time saved per hit.
+
+    python bench_speculation.py --calls 20 --turns 4 --llm-latency 0.6
+    python bench_speculation.py --streaming   # latency to the first spoken sentence
+"""
+import os
+import time
+import random
+import logging
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import config
+import sales_bot
+from llm_router import ModelRouter
+from bench_server import start_flask
+from bench_utils import summarize, use_temporary_storage
+from fake_services import FakeOpenAIServer, FakeBackendServer
+
+UTTERANCES = [
+    "What does the smart home hub do",
+    "How much is it per month",
+    "Does it work with my existing lights",
+    "Can I cancel the subscription anytime",
+    "Tell me about the annual plan",
+    "How long does the setup take",
+]
+CORRECTIONS = {"do": "cost", "month": "year", "lights": "light switches", "anytime": "online",
+               "plan": "discount", "take": "involve"}
+
+
+def _post(session, base_url, path, values):
+    """
+    POST a webhook, following /continue-reply and /pending-reply redirects. Returns the seconds until
+    the first <Say> and the <Gather> action to post the next transcript to.
+    """
+    start = time.perf_counter()
+    first = None
+    while True:
+        res = session.post(f"{base_url}{path}", data=values, timeout=60)
+        res.raise_for_status()
+        if not res.text.startswith("<?xml"):
+            return time.perf_counter() - start, None
+        root = ET.fromstring(res.text)
+        if first is None and any(el.text for el in root.iter("Say")):
+            first = time.perf_counter() - start
+        redirect = next((el.text for el in root.iter("Redirect")), None)
+        if not (redirect or "").startswith(("/continue-reply", "/pending-reply")):
+            action = next((el.get("action") for el in root.iter("Gather")), None)
+            return (first if first is not None else time.perf_counter() - start), action
+        path = redirect
+
+
+def speak(session, base_url, call_sid, words, word_seconds, sequence, pause_at=None):
+    """
+    Post the partials of `words` as they are spoken. The recognizer confirms the
+    partial with a high stability where the caller pauses (after `pause_at`
+    words) and when they stop speaking.
+    """
+    for k in range(1, len(words) + 1):
+        time.sleep(word_seconds)
+        partial = " ".join(words[:k])
+        for stability in ("0.5", "0.9") if k in (pause_at, len(words)) else ("0.5",):
+            sequence += 1
+            _post(session, base_url, "/partial-transcript",
+                  {"CallSid": call_sid, "UnstableSpeechResult": partial, "Stability": stability,
+                   "SequenceNumber": sequence})
+        if k == pause_at:
+            time.sleep(word_seconds * 2)
+    return sequence
+
+
+def simulate_call(base_url, call_sid, args, rng, timings):
+    session = requests.Session()
+    sequence = 0
+    action = "/transcribe"
+    for turn in range(args.turns):
+        words = rng.choice(UTTERANCES).split()
+        paused = rng.random() < args.pause_rate
+        sequence = speak(session, base_url, call_sid, words, args.word_ms / 1000, sequence,
+                         pause_at=rng.randint(3, len(words) - 1) if paused else None)
+        if rng.random() < args.correction_rate:
+            words = words[:-1] + [CORRECTIONS[words[-1]]]
+        end_of_speech = time.perf_counter()
+        time.sleep(args.endpoint_ms / 1000)
+        transcribe, action = _post(session, base_url, action or "/transcribe",
+                                   {"CallSid": call_sid, "SpeechResult": " ".join(words) + "?"})
+        timings["transcribe"].append(transcribe)
+        timings["end_of_speech"].append(time.perf_counter() - end_of_speech)
+    session.post(f"{base_url}/call-status", data={"CallSid": call_sid, "CallStatus": "completed"}, timeout=60)
+
+
+def run(base_url, args, label):
+    timings = {"transcribe": [], "end_of_speech": []}
+    lock = threading.Lock()
+
+    def one(i):
+        local = {"transcribe": [], "end_of_speech": []}
+        simulate_call(base_url, f"CA{label}{i:030d}", args, random.Random(i), local)
+        with lock:
+            for key, values in local.items():
+                timings[key].extend(values)
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for future in [pool.submit(one, i) for i in range(args.calls)]:
+            future.result()
+    summarize(f"{label} /transcribe", timings["transcribe"])
+    summarize(f"{label} end of speech->reply", timings["end_of_speech"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speculative replies from partial transcripts")
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--word-ms", type=float, default=150)
+    parser.add_argument("--endpoint-ms", type=float, default=700, help="Silence before the final transcript")
+    parser.add_argument("--pause-rate", type=float, default=0.2)
+    parser.add_argument("--correction-rate", type=float, default=0.15)
+    parser.add_argument("--llm-latency", type=float, default=0.6)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--streaming", action="store_true", help="Stream replies (latency to the first sentence)")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    use_temporary_storage()
+    config.STREAMING_REPLIES = args.streaming
+    config.CONTEXT_TOKEN_BUDGET = 0
+    with FakeOpenAIServer(first_token_latency=args.llm_latency, token_interval=args.token_interval) as llm, \
+            FakeBackendServer(latency=0) as backend:
+        config.NODE_BACKEND_URL = backend.url
+        config.OUTBOX_DB = os.path.join(config.CONVERSATION_DIR, "outbox.db")
+        config.CALL_PROFILES_DB = os.path.join(config.CONVERSATION_DIR, "call_profiles.db")
+        sales_bot.router = ModelRouter.for_url(llm.base_url)
+        base_url, stop = start_flask(max(16, args.concurrency * 2))
+        try:
+            config.SPECULATIVE_REPLIES = False
+            run(base_url, args, "off")
+            config.SPECULATIVE_REPLIES = True
+            run(base_url, args, "on")
+        finally:
+            stop()
+
+    stats = sales_bot.speculations.stats()
+    print(f"speculations started {stats['started']} | hit {stats['hit']} | miss {stats['miss']} | "
+          f"superseded {stats['superseded']} | turns without one {stats['none']}")
+    print(f"hit rate {stats['hit_rate'] * 100:.0f}% | wasted-token ratio {stats['wasted_token_ratio'] * 100:.0f}% "
+          f"({stats['tokens_wasted']} of {stats['tokens_used'] + stats['tokens_wasted']} tokens) | "
+          f"generation time saved per hit {stats['saved_seconds_per_hit'] * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
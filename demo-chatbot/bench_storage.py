@@ -0,0 +1,67 @@
+"""
+Benchmark conversation storage engines.
+
+Simulates many interleaved calls: every round, each call loads its history,
+appends a user/assistant turn and saves it again. Reports turns/sec for the
+legacy file-per-call store and the append-only log store.
+
+    python bench_storage.py --sizes 1000 10000 100000 --rounds 3
+"""
+import time
+import shutil
+import argparse
+import tempfile
+import config
+from conversation import initialize_sales_conversation
+from storage import FileConversationStore, AppendLogStore
+
+USER_INFO = {"name": "Michael", "interests": "Home automation, Music streaming"}
+
+
+def run_turns(store, call_sids, rounds):
+    turns = 0
+    start = time.perf_counter()
+    for round_no in range(rounds):
+        for call_sid in call_sids:
+            conversation = store.load(call_sid) or initialize_sales_conversation(USER_INFO)
+            conversation.append({"role": "user", "content": f"Tell me more about option {round_no}."})
+            conversation.append({"role": "assistant", "content": "Our Smart Home Hub connects all your devices. " * 3})
+            store.save(call_sid, conversation)
+            turns += 1
+    store.flush()
+    return turns / (time.perf_counter() - start)
+
+
+def bench(name, make_store, calls, rounds):
+    directory = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    try:
+        store = make_store(directory)
+        call_sids = [f"CA{i:032x}" for i in range(calls)]
+        rate = run_turns(store, call_sids, rounds)
+        store.close()
+        print(f"{name:>6} | {calls:>7} calls | {rounds} rounds | {rate:>10.0f} turns/sec")
+        return rate
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conversation storage engines")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--rounds", type=int, default=3, help="Turns per call")
+    parser.add_argument("--cache-size", type=int, default=config.CONVERSATION_CACHE_SIZE)
+    args = parser.parse_args()
+
+    for calls in args.sizes:
+        file_rate = bench("file", FileConversationStore, calls, args.rounds)
+        log_rate = bench(
+            "log",
+            lambda d: AppendLogStore(d, cache_size=args.cache_size, flush_interval=config.CONVERSATION_FLUSH_INTERVAL),
+            calls,
+            args.rounds,
+        )
+        print(f"{'':>6} | speedup x{log_rate / file_rate:.1f}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Measure time-to-first-sentence of streamed replies against a local fake
+OpenAI-compatible server.
+
+Compares how long the caller waits before anything can be spoken with
+`generate_response` (full completion) and `stream_response` (first sentence).
+
+    python bench_streaming.py --requests 50 --first-token-latency 0.3 --token-interval 0.03
+"""
+import time
+import argparse
+import sales_bot
+from llm_router import ModelRouter
+from bench_utils import summarize, use_temporary_storage
+from fake_services import FakeOpenAIServer
+
+USER_INFO = {"name": "Michael", "interests": "Home automation"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streamed time-to-first-sentence")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--token-interval", type=float, default=0.03)
+    args = parser.parse_args()
+
+    use_temporary_storage()
+    with FakeOpenAIServer(first_token_latency=args.first_token_latency,
+                          token_interval=args.token_interval) as server:
+        sales_bot.router = ModelRouter.for_url(server.base_url)
+
+        full, first = [], []
+        for i in range(args.requests):
+            start = time.perf_counter()
+            sales_bot.generate_response("Tell me about the hub.", f"BENCH_FULL_{i}", USER_INFO)
+            full.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            sentences = sales_bot.stream_response("Tell me about the hub.", f"BENCH_STREAM_{i}", USER_INFO)
+            next(sentences)
+            first.append(time.perf_counter() - start)
+            for _ in sentences:
+                pass
+
+    summarize("full completion", full)
+    summarize("first streamed sentence", first)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Tunnel overhead per /trigger-call: spawning ngrok every time vs the tunnel manager.
+
+Runs against the fake ngrok agent from fake_services.py (--startup-delay
+seconds until its tunnel is listed) and a fake Twilio API holding the bot's
+phone number. The legacy path spawns an agent, sleeps 2s and updates the
+webhooks on every trigger, as start_ngrok used to. The manager starts one
+agent, then the agent is killed halfway through the triggers to measure how
+quickly the health check brings the tunnel back.
+
+    python bench_tunnel.py --triggers 20 --startup-delay 0.5
+"""
+import sys
+import time
+import logging
+import argparse
+import subprocess
+import requests
+import config
+import fake_services
+from bench_server import free_port
+from bench_utils import summarize
+from fake_services import FakeTwilioServer
+from ngrok_manager import TunnelManager, update_twilio_webhooks
+
+PHONE_NUMBER = "+15550001111"
+
+
+def legacy_trigger(binary, api_url, port, processes):
+    """The old start_ngrok: a new agent, a fixed sleep and a webhook update per call."""
+    processes.append(subprocess.Popen(binary + ["http", str(port)],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    time.sleep(2)
+    tunnels = requests.get(f"{api_url}/api/tunnels").json()["tunnels"]
+    public_url = next(t["public_url"] for t in tunnels if t["proto"] == "https")
+    update_twilio_webhooks(public_url)
+    return public_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ngrok tunnel manager against a fake agent")
+    parser.add_argument("--triggers", type=int, default=20)
+    parser.add_argument("--legacy-triggers", type=int, default=3, help="The legacy path sleeps 2s per trigger")
+    parser.add_argument("--startup-delay", type=float, default=0.5)
+    parser.add_argument("--health-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    twilio = FakeTwilioServer(latency=0.02).start()
+    twilio.add_phone_number(PHONE_NUMBER)
+    config.TWILIO_API_BASE_URL = twilio.url
+    config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN = "AC" + "0" * 32, "fake"
+    config.TWILIO_PHONE_NUMBER = PHONE_NUMBER
+    config.METRICS_ENABLED = False
+    logging.disable(logging.INFO)
+
+    api_port, app_port = free_port(), free_port()
+    api_url = f"http://127.0.0.1:{api_port}"
+    binary = [sys.executable, fake_services.__file__, "ngrok", "--api-port", str(api_port),
+              "--startup-delay", str(args.startup_delay)]
+
+    processes, latencies = [], []
+    for _ in range(args.legacy_triggers):
+        start = time.perf_counter()
+        legacy_trigger(binary, api_url, app_port, processes)
+        latencies.append(time.perf_counter() - start)
+    running = sum(1 for p in processes if p.poll() is None)
+    summarize("legacy per trigger", latencies)
+    print(f"{'':<28} webhook updates {twilio.webhook_updates} | agents spawned {len(processes)} | "
+          f"still running {running}")
+    for process in processes:
+        process.kill()
+        process.wait()
+
+    twilio.webhook_updates = 0
+    tunnel = TunnelManager(port=app_port, binary=" ".join(binary), api_url=api_url,
+                           health_interval=args.health_interval)
+    latencies, recovery = [], None
+    for i in range(args.triggers):
+        if i == args.triggers // 2:
+            tunnel._process.kill()
+            killed = time.perf_counter()
+            # Recovered once a new agent is up and the webhooks point at its URL
+            while tunnel.stats()["webhook_updates"] < 2 and time.perf_counter() - killed < 30:
+                time.sleep(0.01)
+            recovery = time.perf_counter() - killed
+        start = time.perf_counter()
+        if not tunnel.public_url():
+            print("❌ tunnel did not start")
+        latencies.append(time.perf_counter() - start)
+    stats = tunnel.stats()
+    agent = tunnel._process
+    tunnel.stop()
+    summarize("manager per trigger", latencies)
+    print(f"{'':<28} first trigger {latencies[0] * 1000:.0f}ms (agent startup) | "
+          f"recovered {recovery * 1000:.0f}ms after the agent was killed (health checks every "
+          f"{args.health_interval * 1000:.0f}ms)")
+    print(f"{'':<28} agents started {stats['starts']} | restarts {stats['restarts']} | "
+          f"webhook updates {twilio.webhook_updates} | still running after stop {int(agent.poll() is None)}")
+    twilio.stop()
+
+
+if __name__ == "__main__":
+    main()
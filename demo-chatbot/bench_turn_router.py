@@ -0,0 +1,130 @@
+"""
+Measure tiered turn routing against two fake model endpoints.
+
+The main endpoint answers after --main-latency seconds, the cheaper one after
+--small-latency; both reply with as many words as max_tokens allows, so the
+completion tokens reflect each tier's cap. Simulated calls replay a scripted
+mix of acknowledgements, simple questions, repeats and objections, once with
+routing off (every turn on the main model) and once with it on.
+
+The report gives per-turn latency for both runs, the per-tier latency and turn
+counts, completion tokens per endpoint, and how many turns the script marks as
+complex were sent to a cheaper tier.
+
+    python bench_turn_router.py --calls 20 --main-latency 0.6 --small-latency 0.15
+"""
+import time
+import random
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+import sales_bot
+from llm_router import ModelRouter
+from turn_router import TurnRouter
+from bench_utils import summarize, use_temporary_storage
+from fake_services import FakeOpenAIServer
+
+LONG_REPLY = " ".join(["word"] * 400)
+
+# (utterance, whether the main model should answer it)
+SCRIPT = [
+    ("Hello, who is this?", False),
+    ("Okay.", False),
+    ("What does the smart home hub do exactly for someone like me?", True),
+    ("Sorry, can you repeat that?", False),
+    ("I'm not sure, it sounds expensive.", True),
+    ("Sure, go ahead.", False),
+    ("How does it compare to Google Home and what happens to my data?", True),
+    ("Got it, thanks.", False),
+    ("Tell me more.", False),
+    ("Is there a contract or can I cancel anytime?", True),
+    # Short objections that are not among the classifier's seed examples
+    ("Sounds shady to me.", True),
+    ("Nah, we're good.", True),
+    ("Why should I trust you?", True),
+    ("My partner handles this stuff.", True),
+    ("I already have Alexa.", True),
+]
+
+
+def _reply(request):
+    return " ".join(LONG_REPLY.split()[:request.get("max_tokens") or 150])
+
+
+def simulate_call(call_sid, args, rng, timings, misrouted):
+    for _ in range(args.turns):
+        text, complex_turn = rng.choice(SCRIPT)
+        start = time.perf_counter()
+        sales_bot.generate_response(text, call_sid)
+        timings.append(time.perf_counter() - start)
+        if complex_turn and config.TURN_ROUTING and sales_bot.turns.route(text).tier != "main":
+            misrouted.append(text)
+    sales_bot.end_call(call_sid)
+
+
+def run(args, label):
+    timings, misrouted = [], []
+    lock = threading.Lock()
+
+    def one(i):
+        local, wrong = [], []
+        simulate_call(f"CA{label}{i:030d}", args, random.Random(i), local, wrong)
+        with lock:
+            timings.extend(local)
+            misrouted.extend(wrong)
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for future in [pool.submit(one, i) for i in range(args.calls)]:
+            future.result()
+    summarize(f"routing {label} per turn", timings)
+    return misrouted
+
+
+def completion_tokens(server):
+    return sum(min(r.get("max_tokens") or 150, len(LONG_REPLY.split())) for r in server.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tiered routing of conversation turns")
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--main-latency", type=float, default=0.6)
+    parser.add_argument("--small-latency", type=float, default=0.15)
+    parser.add_argument("--token-interval", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    use_temporary_storage()
+    sales_bot.context.token_budget = 0  # no background summaries: only turn completions hit the endpoints
+    with FakeOpenAIServer(reply=_reply, first_token_latency=args.main_latency,
+                          token_interval=args.token_interval) as main_llm, \
+            FakeOpenAIServer(reply=_reply, first_token_latency=args.small_latency,
+                             token_interval=args.token_interval) as small_llm:
+        sales_bot.router = ModelRouter.for_url(main_llm.base_url)
+        sales_bot.small_router = ModelRouter.for_url(small_llm.base_url)
+
+        config.TURN_ROUTING = False
+        run(args, "off")
+        off_tokens = completion_tokens(main_llm)
+        main_llm.requests.clear()
+
+        config.TURN_ROUTING = True
+        sales_bot.turns = TurnRouter()
+        misrouted = run(args, "on")
+        main_tokens, small_tokens = completion_tokens(main_llm), completion_tokens(small_llm)
+
+    stats = sales_bot.turns.stats()
+    for tier, values in sorted(stats["tiers"].items()):
+        print(f"tier {tier:<9} turns {values['turns']:>4} | mean {values['mean_seconds'] * 1000:>6.0f}ms")
+    print("decisions " + ", ".join(f"{reason} {count}" for reason, count in sorted(stats["reasons"].items())))
+    print(f"completion tokens: off {off_tokens} (main) | on {main_tokens + small_tokens} "
+          f"(main {main_tokens}, small {small_tokens})")
+    print(f"complex turns sent to a cheaper tier: {len(misrouted)}" +
+          (f" ({', '.join(sorted(set(misrouted)))})" if misrouted else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Small helpers shared by the bench_*.py scripts."""
+import os
+import tempfile
+import config
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (pct in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(name, values, unit="ms", scale=1000):
+    print(
+        f"{name:<28} n={len(values):<5} "
+        f"p50={percentile(values, 50) * scale:8.1f}{unit} "
+        f"p95={percentile(values, 95) * scale:8.1f}{unit} "
+        f"p99={percentile(values, 99) * scale:8.1f}{unit}"
+    )
+
+
+def use_temporary_storage():
+    """Point the conversation store at a throwaway directory."""
+    config.CONVERSATION_DIR = tempfile.mkdtemp(prefix="bench_conversations_")
+    return config.CONVERSATION_DIR
+
+
+def rss_bytes():
+    """Resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,186 @@
+"""
+Per-call serialization of conversation turns.
+
+The webhooks of one call (/voice, /transcribe, a streamed reply that is still
+being generated, /call-status) each load, extend and save the call's history,
+so they run one at a time per CallSid: under an in-process lock and, when the
+conversation store is shared between processes (it offers acquire_lease),
+under a lease in the store. Leases are renewed while held and expire if their
+holder dies. A turn that cannot get the lock within CALL_LOCK_WAIT_SECONDS goes
+ahead anyway; versioned saves (see save_conversation_history) still merge its
+messages into the history instead of overwriting another turn.
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+import config
+from storage import get_store, DEFAULT_KEY
+from metrics import CALL_LOCK_WAIT_SECONDS, CALL_LOCK_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+
+class _Held:
+    __slots__ = ("key", "entry", "owner", "locked")
+
+    def __init__(self, key, entry):
+        self.key = key
+        self.entry = entry
+        self.owner = None
+        self.locked = False
+
+
+class CallLocks:
+    def __init__(self, store=None, lease_seconds=None, wait_seconds=None):
+        self._store = store
+        self.lease_seconds = lease_seconds or config.CALL_LOCK_LEASE_SECONDS
+        self.wait_seconds = config.CALL_LOCK_WAIT_SECONDS if wait_seconds is None else wait_seconds
+        self._owner_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> [threading.Lock, users]
+        self._leases = {}  # owner -> key, renewed in the background
+        self._renewer = None
+        self._renewing = threading.Lock()  # a lease is never renewed while it is being released
+        self._stats = {"acquired": 0, "contended": 0, "timeouts": 0}
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    @contextmanager
+    def hold(self, call_sid):
+        """Run the block as the only turn of `call_sid` (or unlocked, after the wait timeout)."""
+        held = self._enter(call_sid or DEFAULT_KEY)
+        start = time.monotonic()
+        deadline = start + self.wait_seconds
+        try:
+            held.locked = held.entry[0].acquire(timeout=self.wait_seconds)
+            if held.locked:
+                while not self._try_lease(held):
+                    if time.monotonic() >= deadline:
+                        break
+                    time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+            self._record(held, time.monotonic() - start)
+            yield
+        finally:
+            self._release(held)
+
+    @asynccontextmanager
+    async def ahold(self, call_sid):
+        """Async variant of hold(); waits without blocking the event loop."""
+        held = self._enter(call_sid or DEFAULT_KEY)
+        start = time.monotonic()
+        deadline = start + self.wait_seconds
+        delay = 0.005
+        try:
+            while True:
+                if not held.locked:
+                    held.locked = held.entry[0].acquire(blocking=False)
+                if held.locked and await asyncio.to_thread(self._try_lease, held):
+                    break
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+            self._record(held, time.monotonic() - start)
+            yield
+        finally:
+            await asyncio.to_thread(self._release, held)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, held_leases=len(self._leases), locked_calls=len(self._entries))
+
+    def _enter(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        return _Held(key, entry)
+
+    def _try_lease(self, held):
+        store = self.store
+        if not hasattr(store, "acquire_lease"):
+            return True
+        owner = held.owner or f"{self._owner_prefix}:{uuid.uuid4().hex}"
+        if not store.acquire_lease(held.key, owner, self.lease_seconds):
+            return False
+        held.owner = owner
+        with self._lock:
+            self._leases[owner] = held.key
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, name="call-lease-renewer", daemon=True)
+                self._renewer.start()
+        return True
+
+    def _record(self, held, waited):
+        acquired = held.locked and (held.owner is not None or not hasattr(self.store, "acquire_lease"))
+        with self._lock:
+            self._stats["acquired" if acquired else "timeouts"] += 1
+            if waited > 0.01:
+                self._stats["contended"] += 1
+        if not acquired:
+            logger.warning(f"Gave up waiting {waited:.1f}s for the lock of call {held.key}; continuing unlocked")
+        if config.METRICS_ENABLED:
+            CALL_LOCK_WAIT_SECONDS.observe(waited)
+            if not acquired:
+                CALL_LOCK_TIMEOUTS.inc()
+
+    def _release(self, held):
+        if held.owner is not None:
+            with self._renewing:
+                with self._lock:
+                    self._leases.pop(held.owner, None)
+                try:
+                    self.store.release_lease(held.key, held.owner)
+                except Exception as e:
+                    logger.error(f"Error releasing the lease of call {held.key}: {e}")
+        if held.locked:
+            held.entry[0].release()
+        with self._lock:
+            held.entry[1] -= 1
+            if held.entry[1] == 0 and self._entries.get(held.key) is held.entry:
+                del self._entries[held.key]
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._renewing:
+                with self._lock:
+                    leases = list(self._leases.items())
+                for owner, key in leases:
+                    try:
+                        if not self.store.acquire_lease(key, owner, self.lease_seconds):
+                            logger.warning(f"Lost the lease of call {key} to another worker")
+                    except Exception as e:
+                        logger.error(f"Error renewing the lease of call {key}: {e}")
+
+
+_locks = None
+_locks_lock = threading.Lock()
+
+
+def get_call_locks():
+    """Return the process-wide call locks."""
+    global _locks
+    if _locks is None:
+        with _locks_lock:
+            if _locks is None:
+                _locks = CallLocks()
+    return _locks
+
+
+def call_lock(call_sid):
+    """Context manager serializing the turns of `call_sid` across threads, workers and hosts."""
+    return get_call_locks().hold(call_sid)
+
+
+def acall_lock(call_sid):
+    """Async context manager variant of call_lock."""
+    return get_call_locks().ahold(call_sid)
@@ -0,0 +1,137 @@
+"""
+Customer profiles (and pre-generated introductions) bound to outbound calls
+when they are placed, the calls Twilio has reported completed, and queued
+replies (see admission.py) so any webhook worker can speak them.
+
+The dialer and the webhook server usually run as separate processes, so the
+profile from the prospects file is kept in a small SQLite database both can
+reach, keyed by call SID.
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+import config
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(config.CALL_PROFILES_DB, timeout=10)
+        # Workers opening the database at once race on the journal mode switch
+        # and the schema; wait for the lock instead of failing the lookup
+        conn.execute("PRAGMA busy_timeout = 10000")
+        for attempt in range(5):
+            try:
+                _create_tables(conn)
+                break
+            except sqlite3.OperationalError as e:
+                if attempt == 4:
+                    conn.close()
+                    raise
+                logger.warning(f"Retrying setup of {config.CALL_PROFILES_DB}: {e}")
+                time.sleep(0.05 * 2 ** attempt)
+        _local.conn = conn
+    return conn
+
+
+def _create_tables(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS call_profiles ("
+        "call_sid TEXT PRIMARY KEY, phone TEXT, user_info TEXT, created REAL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS call_introductions ("
+        "call_sid TEXT PRIMARY KEY, introduction TEXT, created REAL)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS finished_calls (call_sid TEXT PRIMARY KEY, finished REAL)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS queued_replies ("
+        "call_sid TEXT PRIMARY KEY, hangup INTEGER, done INTEGER, reply TEXT, created REAL)"
+    )
+
+
+def bind_profile(call_sid, phone, user_info):
+    """Remember the prospect's profile for a call that has just been placed."""
+    conn = _connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO call_profiles (call_sid, phone, user_info, created) VALUES (?, ?, ?, ?)",
+            (call_sid, phone, json.dumps(user_info), time.time()),
+        )
+
+
+def get_profile(call_sid):
+    """Return the profile bound to `call_sid`, or None."""
+    row = _connection().execute("SELECT user_info FROM call_profiles WHERE call_sid = ?", (call_sid,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def bind_introduction(call_sid, introduction):
+    """Store the introduction pre-generated for a call."""
+    conn = _connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO call_introductions (call_sid, introduction, created) VALUES (?, ?, ?)",
+            (call_sid, introduction, time.time()),
+        )
+
+
+def get_introduction(call_sid):
+    """Return the introduction pre-generated for `call_sid`, or None."""
+    row = _connection().execute(
+        "SELECT introduction FROM call_introductions WHERE call_sid = ?", (call_sid,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def mark_finished(call_sid):
+    """Record that a call has completed and its history will not change any more."""
+    conn = _connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO finished_calls (call_sid, finished) VALUES (?, ?)",
+                     (call_sid, time.time()))
+
+
+def finished_calls():
+    """The SIDs of every call recorded as finished."""
+    return {row[0] for row in _connection().execute("SELECT call_sid FROM finished_calls")}
+
+
+def bind_queued_reply(call_sid, hangup):
+    """Record that a call's turn is queued for generation (replacing any earlier one)."""
+    conn = _connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO queued_replies (call_sid, hangup, done, reply, created) "
+            "VALUES (?, ?, 0, NULL, ?)",
+            (call_sid, int(hangup), time.time()),
+        )
+
+
+def finish_queued_reply(call_sid, reply):
+    """Store the generated reply of a queued turn (None when the generation failed)."""
+    conn = _connection()
+    with conn:
+        conn.execute("UPDATE queued_replies SET done = 1, reply = ? WHERE call_sid = ?", (reply, call_sid))
+
+
+def get_queued_reply(call_sid):
+    """Return (hangup, done, reply) for the queued turn of `call_sid`, or None."""
+    row = _connection().execute(
+        "SELECT hangup, done, reply FROM queued_replies WHERE call_sid = ?", (call_sid,)
+    ).fetchone()
+    return (bool(row[0]), bool(row[1]), row[2]) if row else None
+
+
+def drop_queued_reply(call_sid):
+    """Forget the queued turn of `call_sid` once its reply has been spoken."""
+    conn = _connection()
+    with conn:
+        conn.execute("DELETE FROM queued_replies WHERE call_sid = ?", (call_sid,))
@@ -8,9 +8,46 @@ load_dotenv()
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
+# Override the Twilio REST API base URL (e.g. a local fake for load tests)
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL")
+
+# Outbound dialer: new calls per second across the campaign and Twilio requests in flight
+DIALER_CALLS_PER_SECOND = float(os.getenv("DIALER_CALLS_PER_SECOND", "1"))
+DIALER_CONCURRENCY = int(os.getenv("DIALER_CONCURRENCY", "8"))
 
 # File paths
 CONVERSATION_FILE = "conversation.json"
+CALL_PROFILES_DB = os.getenv("CALL_PROFILES_DB", "call_profiles.db")
+
+# Conversation storage ("log" = append-only log with LRU cache, "file" = one JSON file per call,
+# "sqlite" = database shared by several worker processes, or "module:ClassName" for a store shared across hosts)
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "log")
+CONVERSATION_DIR = os.getenv("CONVERSATION_DIR", "conversations")
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", "conversations.db")
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "1024"))
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.5"))
+CONVERSATION_COMPACT_RATIO = float(os.getenv("CONVERSATION_COMPACT_RATIO", "0.5"))
+
+# Turns of one call are serialized: a per-call lock in each process plus, with a shared store,
+# a lease renewed while held. A webhook waits at most CALL_LOCK_WAIT_SECONDS, then proceeds and
+# relies on versioned saves to merge its turn into the history.
+CALL_LOCK_LEASE_SECONDS = float(os.getenv("CALL_LOCK_LEASE_SECONDS", "15"))
+CALL_LOCK_WAIT_SECONDS = float(os.getenv("CALL_LOCK_WAIT_SECONDS", "20"))
+
+# Finished conversations are queued in a durable outbox and uploaded to the Node backend in batches;
+# a conversation still failing after OUTBOX_MAX_ATTEMPTS attempts (or rejected with a 4xx) is dead-lettered
+NODE_BACKEND_URL = os.getenv("NODE_BACKEND_URL", "http://localhost:8000")
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox.db")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_BATCH_WAIT = float(os.getenv("OUTBOX_BATCH_WAIT", "0.5"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_TIMEOUT = float(os.getenv("OUTBOX_TIMEOUT", "10"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+
+# Columnar archive of finished calls (python archive.py archive|stats|gc)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Legacy JSON conversations with no completed call-status count as finished after this long unmodified (s)
+ARCHIVE_MIN_IDLE = float(os.getenv("ARCHIVE_MIN_IDLE", "3600"))
 
 # Sales Bot Configuration
 BOT_NAME = "Alex"
@@ -21,9 +58,144 @@ API_BASE_URL = os.getenv("API_BASE_URL")
 API_KEY = os.getenv("API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME")
 
+# Model routing: LLM_ENDPOINTS is a JSON list of {"name", "base_url", "api_key", "model"} (default: the
+# endpoint above). Requests go to the endpoint with the lowest latency EWMA; a hedged request goes to the
+# next one once LLM_HEDGE_AFTER of the per-turn deadline has passed, and the canned reply is spoken if
+# nothing answered by the deadline. Endpoints failing LLM_FAILURES_TO_DOWN times in a row cool down.
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+LLM_TURN_DEADLINE = float(os.getenv("LLM_TURN_DEADLINE", "6"))
+LLM_SUMMARY_DEADLINE = float(os.getenv("LLM_SUMMARY_DEADLINE", "30"))
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0.5"))
+LLM_EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.3"))
+LLM_FAILURES_TO_DOWN = int(os.getenv("LLM_FAILURES_TO_DOWN", "2"))
+LLM_MAX_DOWN_SECONDS = float(os.getenv("LLM_MAX_DOWN_SECONDS", "60"))
+
+# Tiered turns: simple turns (short acknowledgements, closings, and what the classifier scores as simple with at
+# least TURN_SIMPLE_MIN_CONFIDENCE) go to a cheaper model with a smaller token cap; "can you repeat that" is
+# answered from a template; objections and everything else go to the main model. The cheaper model is
+# TURN_SMALL_MODEL on the main endpoints, or TURN_SMALL_ENDPOINTS (same format as LLM_ENDPOINTS).
+# TURN_CLASSIFIER is "bayes" (trained on built-in examples plus TURN_CLASSIFIER_DATA, JSON lines of
+# {"text", "label": "simple"|"complex"}) or "module:ClassName"; TURN_ROUTER_LOG appends every decision as JSON.
+TURN_ROUTING = os.getenv("TURN_ROUTING", "false").lower() == "true"
+TURN_SMALL_MODEL = os.getenv("TURN_SMALL_MODEL", "")
+TURN_SMALL_ENDPOINTS = os.getenv("TURN_SMALL_ENDPOINTS", "")
+TURN_SMALL_MAX_TOKENS = int(os.getenv("TURN_SMALL_MAX_TOKENS", "60"))
+TURN_MAIN_MAX_TOKENS = int(os.getenv("TURN_MAIN_MAX_TOKENS", "150"))
+TURN_SIMPLE_MAX_WORDS = int(os.getenv("TURN_SIMPLE_MAX_WORDS", "10"))
+TURN_SIMPLE_MIN_CONFIDENCE = float(os.getenv("TURN_SIMPLE_MIN_CONFIDENCE", "0.8"))
+TURN_CLASSIFIER = os.getenv("TURN_CLASSIFIER", "bayes")
+TURN_CLASSIFIER_DATA = os.getenv("TURN_CLASSIFIER_DATA", "")
+TURN_ROUTER_LOG = os.getenv("TURN_ROUTER_LOG", "")
+
+# Context window: token budget per model request (0 sends the full history),
+# number of recent user turns kept verbatim, and size of the rolling summary of older turns
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "4"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "200"))
+
+# Streamed replies: speak the first sentence as soon as it is generated and
+# fetch the rest through /continue-reply redirects
+STREAMING_REPLIES = os.getenv("STREAMING_REPLIES", "false").lower() == "true"
+STREAM_FIRST_SENTENCE_TIMEOUT = float(os.getenv("STREAM_FIRST_SENTENCE_TIMEOUT", "8"))
+STREAM_NEXT_SENTENCE_TIMEOUT = float(os.getenv("STREAM_NEXT_SENTENCE_TIMEOUT", "5"))
+STREAM_MIN_SENTENCE_CHARS = int(os.getenv("STREAM_MIN_SENTENCE_CHARS", "12"))
+
+# Speculative replies: <Gather> posts partial transcripts to /partial-transcript and the reply to a stable
+# partial (Twilio stability >= SPECULATION_MIN_STABILITY, or the same words twice) starts generating early.
+# /transcribe reuses it when the final words match at least SPECULATION_MATCH_RATIO (word-level similarity).
+SPECULATIVE_REPLIES = os.getenv("SPECULATIVE_REPLIES", "false").lower() == "true"
+SPECULATION_MIN_STABILITY = float(os.getenv("SPECULATION_MIN_STABILITY", "0.8"))
+SPECULATION_MIN_WORDS = int(os.getenv("SPECULATION_MIN_WORDS", "3"))
+SPECULATION_MATCH_RATIO = float(os.getenv("SPECULATION_MATCH_RATIO", "0.9"))
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", "16"))
+
 # Flask Configuration
 FLASK_PORT = int(os.getenv("FLASK_PORT", "5000"))
 
+# ngrok tunnel: agent command (shell-split; "http <port>" is appended), its local API, how long to wait
+# for the tunnel to come up and how often to health-check it (0 disables the checks)
+NGROK_BIN = os.getenv("NGROK_BIN", "ngrok")
+NGROK_API_URL = os.getenv("NGROK_API_URL", "http://localhost:4040")
+NGROK_READY_TIMEOUT = float(os.getenv("NGROK_READY_TIMEOUT", "15"))
+NGROK_HEALTH_INTERVAL = float(os.getenv("NGROK_HEALTH_INTERVAL", "30"))
+
+# Public https base URL of the webhook server when it is not exposed through the ngrok tunnel of this
+# process (e.g. behind a reverse proxy); used for absolute URLs such as the /tts audio of inline TwiML
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
+
+# Webhook server for --mode server: "flask" (threaded WSGI) or "asgi" (uvicorn + async OpenAI client)
+SERVER_BACKEND = os.getenv("SERVER_BACKEND", "flask")
+
+# Admission control: at most ADMISSION_MAX_ACTIVE replies generate at once (0: no limit). Turns over the budget
+# are queued (at most ADMISSION_MAX_QUEUED, beyond that they get the canned reply) and answered at once with
+# ADMISSION_FILLER and a redirect to /pending-reply, which waits up to ADMISSION_POLL_WAIT seconds per request;
+# ADMISSION_FILLER_PAUSE whole seconds of <Pause> may follow the filler while the turn still waits for a slot.
+# With a shared (sqlite) conversation store, queued replies are shared through CALL_PROFILES_DB across workers
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "0"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "100"))
+ADMISSION_POLL_WAIT = float(os.getenv("ADMISSION_POLL_WAIT", "2"))
+ADMISSION_FILLER = os.getenv("ADMISSION_FILLER", "One moment, let me check on that for you.")
+ADMISSION_FILLER_PAUSE = int(os.getenv("ADMISSION_FILLER_PAUSE", "0"))
+
+# Idempotent TwiML webhooks: Twilio retries and re-requests of /voice, /transcribe and /continue-reply
+# (same CallSid, SpeechResult and turn token) share the first request's TwiML, kept for WEBHOOK_DEDUP_TTL
+# seconds, at most WEBHOOK_DEDUP_SIZE responses
+WEBHOOK_DEDUP = os.getenv("WEBHOOK_DEDUP", "true").lower() == "true"
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", "300"))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
+
+# CRM: adapter ("demo" or "module:ClassName") and profile cache
+CRM_ADAPTER = os.getenv("CRM_ADAPTER", "demo")
+CRM_CACHE_TTL = float(os.getenv("CRM_CACHE_TTL", "3600"))
+CRM_CACHE_SIZE = int(os.getenv("CRM_CACHE_SIZE", "10000"))
+
+# Introductions generated in the background when a call is placed, served by /voice. Off by default:
+# every placed call then costs a model request, even one that is never answered
+PREGENERATE_INTROS = os.getenv("PREGENERATE_INTROS", "false").lower() == "true"
+INTRO_WAIT_TIMEOUT = float(os.getenv("INTRO_WAIT_TIMEOUT", "3"))
+INTRO_CACHE_SIZE = int(os.getenv("INTRO_CACHE_SIZE", "10000"))
+INTRO_WORKERS = int(os.getenv("INTRO_WORKERS", "4"))
+
+# Twilio Media Streams (ASGI server only): wss:// URL of /media-stream; empty keeps <Gather> speech input.
+# Utterances are endpointed by frame energy and transcribed locally with faster-whisper.
+MEDIA_STREAM_URL = os.getenv("MEDIA_STREAM_URL", "")
+MEDIA_VAD_THRESHOLD_DB = float(os.getenv("MEDIA_VAD_THRESHOLD_DB", "-45"))
+MEDIA_VAD_SILENCE_MS = int(os.getenv("MEDIA_VAD_SILENCE_MS", "600"))
+MEDIA_VAD_MIN_SPEECH_MS = int(os.getenv("MEDIA_VAD_MIN_SPEECH_MS", "200"))
+MEDIA_MAX_UTTERANCE_SECONDS = float(os.getenv("MEDIA_MAX_UTTERANCE_SECONDS", "15"))
+MEDIA_LISTEN_SECONDS = int(os.getenv("MEDIA_LISTEN_SECONDS", "120"))
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base.en")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+
+# Transcription worker pool shared by all calls: one model per worker process, utterances
+# coalesced into batches of up to ASR_MAX_BATCH, none held back longer than ASR_MAX_WAIT_MS;
+# a worker that has not answered a batch after ASR_WORKER_TIMEOUT seconds is restarted
+ASR_TRANSCRIBER = os.getenv("ASR_TRANSCRIBER", "whisper")
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "2"))
+ASR_THREADS_PER_WORKER = int(os.getenv("ASR_THREADS_PER_WORKER", "2"))
+ASR_MAX_BATCH = int(os.getenv("ASR_MAX_BATCH", "8"))
+ASR_MAX_WAIT_MS = float(os.getenv("ASR_MAX_WAIT_MS", "50"))
+ASR_WORKER_TIMEOUT = float(os.getenv("ASR_WORKER_TIMEOUT", "30"))
+
+# Pre-rendered audio for fixed and repeated bot lines, served to <Play> from a size-bounded disk cache
+# (backend "pyttsx3" or "module:ClassName"; lines not rendered yet are still spoken with <Say>)
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "false").lower() == "true"
+TTS_BACKEND = os.getenv("TTS_BACKEND", "pyttsx3")
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+TTS_RENDER_AFTER = int(os.getenv("TTS_RENDER_AFTER", "3"))
+TTS_RATE = int(os.getenv("TTS_RATE", "160"))
+TTS_VOICE = os.getenv("TTS_VOICE", "")
+
+# Stage timings and model usage exported on /metrics (Prometheus text format)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Opt-in cache of replies to short utterances, keyed by utterance, conversation state and personalization
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_WORDS = int(os.getenv("RESPONSE_CACHE_MAX_WORDS", "6"))
+
 # Conversation indicators
 CLOSING_INDICATORS = [
     "bye", "goodbye", "see you", "talk to you later", "that's all", 
@@ -37,3 +209,21 @@ HESITATION_INDICATORS = [
     "not convinced", "don't know", "hesitant", "uncertain",
     "on the fence", "not now", "possibly", "might", "perhaps"
 ]
+
+ACKNOWLEDGEMENT_INDICATORS = [
+    "ok", "okay", "yes", "yeah", "yep", "sure", "right", "got it", "i see",
+    "sounds good", "that's great", "great", "cool", "alright", "uh huh", "mhm"
+]
+
+# Objections and negations: turns that always go to the main model when tiered routing is on
+OBJECTION_INDICATORS = [
+    "no", "nah", "nope", "not", "don't", "do not", "doesn't", "won't", "can't", "never", "nothing",
+    "not interested", "no thanks", "no thank you", "stop calling", "remove me", "scam", "spam",
+    "trust", "already have", "why should", "why would", "decides", "my husband", "my wife", "my partner",
+    "expensive", "cheaper", "competitor", "cancel", "refund", "complaint", "problem", "worried", "privacy"
+]
+
+REPEAT_INDICATORS = [
+    "repeat that", "say that again", "come again", "pardon", "didn't catch that",
+    "didn't hear you", "what did you say", "can you repeat", "one more time"
+]
@@ -0,0 +1,172 @@
+import logging
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_PREFIX = "Summary of the earlier part of this call:"
+# Start folding older turns once the full prompt reaches this share of the
+# budget, so the summary is usually ready before any turn has to be dropped
+FOLD_AT_BUDGET_SHARE = 0.75
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable, estimating token counts: {e}")
+
+
+@lru_cache(maxsize=65536)
+def count_tokens(text):
+    """Token count of `text`; estimated at ~4 characters per token without tiktoken."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content") or "")
+
+
+class _CallContext:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.summary = None
+        self.summarized_upto = 0  # history index up to which `summary` covers
+        self.summarizing = False
+        self.prompt_tokens = []
+
+
+class ContextWindow:
+    """
+    Builds the messages sent to the model for a call under a token budget.
+
+    The leading system prompt and the last `recent_turns` user turns are sent
+    verbatim. Older turns are sent verbatim while the prompt stays under
+    FOLD_AT_BUDGET_SHARE of the budget; past that they are folded into a
+    running summary produced in the background by
+    `summarize(previous_summary, messages)`. Until it is ready they are sent
+    verbatim, oldest dropped first, as far as the budget allows.
+    """
+
+    def __init__(self, summarize, token_budget=None, recent_turns=None, max_calls=4096):
+        self.summarize = summarize
+        self.token_budget = config.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+        self.recent_turns = config.CONTEXT_RECENT_TURNS if recent_turns is None else recent_turns
+        self.max_calls = max_calls
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarizer")
+
+    def build(self, call_sid, conversation):
+        """Return the messages to send for this turn and record their token count."""
+        if self.token_budget <= 0:
+            return conversation
+
+        state = self._state(call_sid)
+        head_end = self._system_prefix_length(conversation)
+        tail_start = self._recent_start(conversation, head_end)
+        head = conversation[:head_end]
+        tail = conversation[tail_start:]
+
+        with state.lock:
+            summary = state.summary
+            summarized_upto = max(state.summarized_upto, head_end)
+
+        budget = self.token_budget - sum(message_tokens(m) for m in head) - sum(message_tokens(m) for m in tail)
+        middle = []
+        if summary:
+            summary_message = {"role": "system", "content": f"{SUMMARY_PREFIX}\n{summary}"}
+            budget -= message_tokens(summary_message)
+            middle.append(summary_message)
+
+        # Only summarize when the history no longer fits comfortably: every
+        # fold is an extra model request
+        unsummarized = conversation[summarized_upto:tail_start]
+        full_prompt_tokens = self.token_budget - budget + sum(message_tokens(m) for m in unsummarized)
+        if unsummarized and full_prompt_tokens >= self.token_budget * FOLD_AT_BUDGET_SHARE:
+            with state.lock:
+                if not state.summarizing and state.summarized_upto <= summarized_upto:
+                    state.summarizing = True
+                    self._executor.submit(self._fold, call_sid, state, summary, unsummarized, tail_start)
+
+        # Turns not yet covered by the summary, newest first, while they fit
+        pending = []
+        for message in reversed(unsummarized):
+            budget -= message_tokens(message)
+            if budget < 0:
+                break
+            pending.append(message)
+        middle.extend(reversed(pending))
+
+        # Over budget even without history: drop the oldest recent turns,
+        # but always keep the latest message
+        while budget < 0 and len(tail) > 1:
+            budget += message_tokens(tail.pop(0))
+
+        messages = head + middle + tail
+        tokens = sum(message_tokens(m) for m in messages)
+        with state.lock:
+            state.prompt_tokens.append(tokens)
+        logger.info(f"Prompt for call {call_sid}: {len(messages)} messages, ~{tokens} tokens "
+                    f"({len(conversation)} in history)")
+        return messages
+
+    def prompt_token_counts(self, call_sid):
+        """Per-turn prompt token counts recorded for a call."""
+        with self._lock:
+            state = self._calls.get(call_sid)
+        return list(state.prompt_tokens) if state else []
+
+    def forget(self, call_sid):
+        with self._lock:
+            self._calls.pop(call_sid, None)
+
+    def _state(self, call_sid):
+        with self._lock:
+            state = self._calls.get(call_sid)
+            if state is None:
+                if len(self._calls) >= self.max_calls:
+                    self._calls.pop(next(iter(self._calls)))
+                state = self._calls[call_sid] = _CallContext()
+            return state
+
+    def _fold(self, call_sid, state, previous_summary, messages, upto):
+        try:
+            summary = self.summarize(previous_summary, messages)
+            with state.lock:
+                state.summary = summary
+                state.summarized_upto = upto
+            logger.info(f"Summarized {len(messages)} older messages for call {call_sid}")
+        except Exception as e:
+            logger.error(f"Error summarizing conversation for call {call_sid}: {e}")
+        finally:
+            with state.lock:
+                state.summarizing = False
+
+    @staticmethod
+    def _system_prefix_length(conversation):
+        for i, message in enumerate(conversation):
+            if message["role"] != "system":
+                return i
+        return len(conversation)
+
+    def _recent_start(self, conversation, head_end):
+        """Index of the first message of the last `recent_turns` user turns."""
+        seen = 0
+        for i in range(len(conversation) - 1, head_end - 1, -1):
+            if conversation[i]["role"] == "user":
+                seen += 1
+                if seen == self.recent_turns:
+                    return i
+        return head_end
@@ -1,135 +1,138 @@
-import os
-import json
 import logging
-from datetime import datetime
+from functools import lru_cache
 import config
-import requests
+from outbox import get_outbox
+from storage import get_store, ConflictError, DEFAULT_KEY
+from intent_matcher import IntentMatcher
+from prompts import SALES_INTRO, CUSTOMER_CONTEXT, template_message
+from metrics import HISTORY_CONFLICTS
 
 logger = logging.getLogger(__name__)
 
+MAX_SAVE_ATTEMPTS = 5
+
+class History(list):
+    """A call's messages as loaded from the store, with the stored version and how many messages were stored."""
+
+    def __init__(self, messages=(), version=None, base=0):
+        super().__init__(messages)
+        self.version = version
+        self.base = base
+
 def initialize_sales_conversation(user_info=None):
-    """Initialize a new sales conversation with system prompts."""
-    # Prepare the system prompt with company introduction and persuasive sales guidance
-    company_intro = f"""
-    You are {config.BOT_NAME}, an AI sales representative for {config.COMPANY_NAME}, a leading provider of consumer technology products and services.
-    
-    Company Information:
-    - Founded in 2015
-    - Serves over 100,000 customers globally
-    - Award-winning customer support with 24/7 availability
-    - Products include: Smart home devices, Premium subscription services, Mobile applications, and Personal productivity tools
-    - Key selling points: Ease of use, Integration with existing devices, Personalization options, Affordable pricing
-    
-    Your goal is to engage the customer in a friendly conversation and CLOSE THE SALE. The customer may be reluctant, but your job is to persist and convert them.
-    
-    Advanced Sales Techniques to Use:
-    1. FOMO (Fear of Missing Out): Mention limited-time offers and how other users are already benefiting
-    2. Social Proof: Share success stories of similar users with similar interests
-    3. Problem Agitation: Highlight the inconveniences of not having our solution
-    4. Future Pacing: Help them visualize how their daily life will improve with our product
-    5. Assumptive Close: Speak as if they've already decided to buy ("When you start using our product...")
-    6. Alternative Choice Close: Instead of asking yes/no, offer choices ("Would you prefer the monthly or annual subscription?")
-    7. Objection Handling: Have 2-3 powerful responses ready for common objections
-    8. Urgency Creation: Mention upcoming price increases or limited availability
-    
-    When facing resistance or hesitation:
-    - Acknowledge their concern but gently redirect to benefits
-    - Use "feel, felt, found" technique: "I understand how you feel, others felt the same way, but they found that..."
-    - Never give up after the first "no" - most sales happen after 5+ follow-ups
-    - If they're not interested in one product, pivot to another that might better address their needs
-    - Use flattery and personalization to make them feel special and valued
-    
-    Your responses should be conversational, friendly, and persuasive. Keep them concise (1-3 sentences) for a natural conversation flow.
-    """
-    
+    """Initialize a new sales conversation with system prompts (stored as prompt template references)."""
     conversation = [
-        {
-            "role": "system",
-            "content": company_intro
-        }
+        template_message(SALES_INTRO, {"bot_name": config.BOT_NAME, "company_name": config.COMPANY_NAME})
     ]
     
     # Add user information if available
     if user_info:
-        user_context = f"""
-        Customer Information:
-        - Name: {user_info.get('name', 'Unknown')}
-        - Last Visit Date: {user_info.get('last_visit_date', 'Unknown')}
-        - Products Viewed: {user_info.get('products_viewed', 'Unknown')}
-        - Previous Purchases: {user_info.get('previous_purchases', 'None')}
-        - Interests: {user_info.get('interests', 'Unknown')}
-        - Age Group: {user_info.get('age_group', 'Unknown')}
-        - Device Usage: {user_info.get('device_usage', 'Unknown')}
-        
-        Use this information to personalize the conversation. Reference their previous interactions, product interests, and past purchases to create a tailored experience. Make them feel remembered and valued as a returning customer.
-        """
-        conversation.append({
-            "role": "system",
-            "content": user_context
-        })
+        conversation.append(template_message(
+            CUSTOMER_CONTEXT, {key: user_info[key] for key in CUSTOMER_CONTEXT.defaults if key in user_info}
+        ))
     
     return conversation
 
 def load_conversation_history(call_sid=None, user_info=None):
-    """Load conversation history from file or initialize a new one."""
+    """Load conversation history from the store or initialize a new one."""
     try:
-        # If call_sid is provided, use it to create a unique conversation file
-        conversation_file = f"{call_sid}_{config.CONVERSATION_FILE}" if call_sid else config.CONVERSATION_FILE
-        
-        if os.path.exists(conversation_file):
-            with open(conversation_file, "r") as f:
-                return json.load(f)
-        else:
-            # Initialize new sales conversation
-            return initialize_sales_conversation(user_info)
+        conversation, version = get_store().load_versioned(call_sid or DEFAULT_KEY)
+        if conversation is not None:
+            return History(conversation, version, len(conversation))
+        # Initialize new sales conversation
+        return History(initialize_sales_conversation(user_info), version, 0)
     except Exception as e:
         logger.error(f"Error loading conversation history: {e}")
         return initialize_sales_conversation(user_info)
 
 def save_conversation_history(conversation, call_sid=None):
-    """Save conversation history to file."""
+    """
+    Save conversation history; only messages added since the last save are written.
+
+    A History is saved only if the call was not saved by another turn since it
+    was loaded; otherwise the messages it added are appended to the newer
+    history and the save is retried, so overlapping turns are merged, not lost.
+    """
+    key = call_sid or DEFAULT_KEY
     try:
-        # If call_sid is provided, use it to create a unique conversation file
-        conversation_file = f"{call_sid}_{config.CONVERSATION_FILE}" if call_sid else config.CONVERSATION_FILE
-        
-        with open(conversation_file, "w") as f:
-            json.dump(conversation, f, indent=2)
+        store = get_store()
+        if not isinstance(conversation, History) or conversation.version is None:
+            store.save(key, conversation)
+            return
+        messages, version = list(conversation), conversation.version
+        for _ in range(MAX_SAVE_ATTEMPTS):
+            try:
+                conversation.version = store.save(key, messages, expected_version=version)
+                conversation[:] = messages
+                conversation.base = len(messages)
+                return
+            except ConflictError as e:
+                logger.warning(f"Conversation {key} was saved concurrently; merging this turn into it")
+                if config.METRICS_ENABLED:
+                    HISTORY_CONFLICTS.inc()
+                messages, version = _rebase(conversation, e.current), e.version
+        logger.error(f"Error saving conversation history: gave up after {MAX_SAVE_ATTEMPTS} conflicting saves")
     except Exception as e:
         logger.error(f"Error saving conversation history: {e}")
 
+def _rebase(conversation, current):
+    """The messages `conversation` added since it was loaded, appended to the `current` stored history."""
+    added = conversation[conversation.base:]
+    if current is None:
+        return list(conversation)
+    if conversation.base == 0:
+        # A new conversation: the other turn already stored the initial system prompts
+        while added and added[0]["role"] == "system":
+            added = added[1:]
+    return current + added
+
+@lru_cache(maxsize=8)
+def _matcher(phrases):
+    return IntentMatcher(phrases)
+
+def closing_matcher():
+    """Compiled matcher for config.CLOSING_INDICATORS (rebuilt only if the list changes)."""
+    return _matcher(tuple(config.CLOSING_INDICATORS))
+
+def hesitation_matcher():
+    """Compiled matcher for config.HESITATION_INDICATORS (rebuilt only if the list changes)."""
+    return _matcher(tuple(config.HESITATION_INDICATORS))
+
+def acknowledgement_matcher():
+    """Compiled matcher for config.ACKNOWLEDGEMENT_INDICATORS (rebuilt only if the list changes)."""
+    return _matcher(tuple(config.ACKNOWLEDGEMENT_INDICATORS))
+
+def objection_matcher():
+    """Compiled matcher for config.OBJECTION_INDICATORS (rebuilt only if the list changes)."""
+    return _matcher(tuple(config.OBJECTION_INDICATORS))
+
+def repeat_matcher():
+    """Compiled matcher for config.REPEAT_INDICATORS (rebuilt only if the list changes)."""
+    return _matcher(tuple(config.REPEAT_INDICATORS))
+
 def detect_conversation_end(text):
     """Detect if the text contains indicators that the conversation should end."""
-    text_lower = text.lower()
-    for indicator in config.CLOSING_INDICATORS:
-        if indicator in text_lower:
-            return True
-    return False
+    indicator = closing_matcher().search(text)
+    if indicator:
+        logger.info(f"Closing indicator matched: {indicator!r}")
+    return indicator is not None
 
 def detect_hesitation(text):
     """Detect if the text contains hesitation or reluctance."""
-    text_lower = text.lower()
-    for indicator in config.HESITATION_INDICATORS:
-        if indicator in text_lower:
-            return True
-    return False
+    indicator = hesitation_matcher().search(text)
+    if indicator:
+        logger.info(f"Hesitation indicator matched: {indicator!r}")
+    return indicator is not None
 
 def reset_conversation(call_sid=None):
     """Reset the conversation history."""
-    conversation_file = f"{call_sid}_{config.CONVERSATION_FILE}" if call_sid else config.CONVERSATION_FILE
-    if os.path.exists(conversation_file):
-        os.remove(conversation_file)
+    get_store().delete(call_sid or DEFAULT_KEY)
     logger.info("Conversation history has been reset.")
     
 def upload_conversation_to_backend(call_sid, conversation, user_info=None):
+    """Queue a finished conversation for upload; the outbox posts it in the background."""
     try:
-        print("⬆️ Uploading to Node backend...")
-        backend_url = os.getenv("NODE_BACKEND_URL", "http://localhost:8000")
-        payload = {
-            "call_sid": call_sid,
-            "user_info": user_info,
-            "conversation": conversation,
-        }
-        res = requests.post(f"{backend_url}/api/save-conversation", json=payload)
-        print("✅ Response from backend:", res.status_code, res.text)
+        get_outbox().enqueue(call_sid, conversation, user_info)
+        print("⬆️ Queued conversation for upload to Node backend")
     except Exception as e:
-        print(f"❌ Error uploading conversation: {e}")
+        print(f"❌ Error queueing conversation: {e}")
@@ -0,0 +1,216 @@
+"""
+CRM lookups with an in-process TTL/LRU cache.
+
+Webhooks ask for the caller's profile on every turn; the cache keys profiles
+by call SID and phone number so a call costs at most one CRM round-trip.
+Profiles bound at dial time (call_profiles) are used before asking the CRM.
+Lookups by outcome, the hit rate and CRM request times are exported on /metrics.
+"""
+import time
+import logging
+import importlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+import config
+from call_profiles import get_profile
+from metrics import CRM_LOOKUPS, CRM_HIT_RATE, CRM_REQUEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class CRMAdapter:
+    """Interface for CRM backends."""
+
+    def lookup(self, phone_number=None, call_sid=None):
+        """Return the customer profile dict for a phone number / call SID, or None."""
+        raise NotImplementedError
+
+
+class DemoCRMAdapter(CRMAdapter):
+    """Simulated CRM that returns the same demo customer for everyone."""
+
+    def lookup(self, phone_number=None, call_sid=None):
+        return {
+            "name": "Michael",
+            "last_visit_date": "April 10, 2025",
+            "products_viewed": "Smart Home Hub, Voice Assistant Speaker",
+            "previous_purchases": "Annual Premium Subscription (expired last month)",
+            "interests": "Home automation, Music streaming, Productivity apps",
+            "age_group": "30-45",
+            "device_usage": "Smartphone, Laptop, Smart TV"
+        }
+
+
+def create_adapter(spec=None):
+    """Build the adapter named by `spec`: "demo" or a "module:ClassName" path."""
+    spec = spec or config.CRM_ADAPTER
+    if spec == "demo":
+        return DemoCRMAdapter()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class _TTLCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedCRM:
+    """
+    Caches an adapter's profiles by call SID and phone number.
+
+    Concurrent lookups for the same call share one CRM request, and
+    `prefetch` warms the cache when a call is placed.
+    """
+
+    def __init__(self, adapter, ttl=None, max_entries=None):
+        self.adapter = adapter
+        ttl = config.CRM_CACHE_TTL if ttl is None else ttl
+        max_entries = max_entries or config.CRM_CACHE_SIZE
+        self._by_sid = _TTLCache(ttl, max_entries)
+        self._by_phone = _TTLCache(ttl, max_entries)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="crm-prefetch")
+        self._stats = {"hits": 0, "bound": 0, "misses": 0, "errors": 0, "lookup_seconds": 0.0, "lookup_max_seconds": 0.0}
+
+    def get(self, call_sid=None, phone_number=None):
+        """Return the profile for a call, asking the CRM only on a cache miss."""
+        with self._lock:
+            profile = self._cached(call_sid, phone_number)
+            if profile is None:
+                key = call_sid or phone_number
+                future = self._in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = self._in_flight[key] = Future()
+
+        if profile is not None:
+            self._count("hits")
+            return profile
+        if not owner:
+            self._count("hits")
+            return future.result()
+
+        try:
+            profile = self._load(call_sid, phone_number)
+            future.set_result(profile)
+            return profile
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def prefetch(self, call_sid, phone_number=None, profile=None):
+        """Bind a known profile to a new call, or load it in the background."""
+        if profile:
+            with self._lock:
+                self._store(call_sid, phone_number, profile)
+            return
+        self._executor.submit(self._prefetch, call_sid, phone_number)
+
+    def forget(self, call_sid):
+        with self._lock:
+            self._by_sid.pop(call_sid)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, cached_calls=len(self._by_sid), cached_phones=len(self._by_phone))
+        lookups = stats["misses"] + stats["errors"]
+        stats["lookup_avg_seconds"] = stats["lookup_seconds"] / lookups if lookups else 0.0
+        return stats
+
+    def _prefetch(self, call_sid, phone_number):
+        try:
+            self.get(call_sid, phone_number)
+        except Exception as e:
+            logger.error(f"Error prefetching CRM profile for call {call_sid}: {e}")
+
+    def _cached(self, call_sid, phone_number):
+        profile = self._by_sid.get(call_sid) if call_sid else None
+        if profile is None and phone_number:
+            profile = self._by_phone.get(phone_number)
+            if profile is not None and call_sid:
+                self._by_sid.put(call_sid, profile)
+        return profile
+
+    def _store(self, call_sid, phone_number, profile):
+        if call_sid:
+            self._by_sid.put(call_sid, profile)
+        if phone_number:
+            self._by_phone.put(phone_number, profile)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+            lookups = self._stats["hits"] + self._stats["bound"] + self._stats["misses"] + self._stats["errors"]
+            hits = self._stats["hits"]
+        if config.METRICS_ENABLED:
+            CRM_LOOKUPS.inc(amount, outcome=key)
+            CRM_HIT_RATE.set(hits / lookups)
+
+    def _load(self, call_sid, phone_number):
+        profile = get_profile(call_sid) if call_sid else None
+        if profile is not None:
+            self._count("bound")
+        else:
+            started = time.monotonic()
+            try:
+                # Unknown customers are cached too, as an empty profile
+                profile = self.adapter.lookup(phone_number=phone_number, call_sid=call_sid) or {}
+            except Exception:
+                self._count("errors")
+                raise
+            finally:
+                elapsed = time.monotonic() - started
+                if config.METRICS_ENABLED:
+                    CRM_REQUEST_SECONDS.observe(elapsed)
+                with self._lock:
+                    self._stats["lookup_seconds"] += elapsed
+                    self._stats["lookup_max_seconds"] = max(self._stats["lookup_max_seconds"], elapsed)
+            self._count("misses")
+        with self._lock:
+            self._store(call_sid, phone_number, profile)
+        return profile
+
+
+_crm = None
+_crm_lock = threading.Lock()
+
+
+def get_crm():
+    """Return the process-wide cached CRM."""
+    global _crm
+    if _crm is None:
+        with _crm_lock:
+            if _crm is None:
+                _crm = CachedCRM(create_adapter())
+    return _crm
@@ -0,0 +1,193 @@
+"""
+Outbound campaign dialer: rate-limited, concurrent, resumable.
+
+Prospects are streamed from a JSON-lines file (one {"phone": ..., "user_info": ...}
+object per line) so campaigns of any size run in constant memory. A checkpoint
+file records which prospects have been dialed so an interrupted campaign
+resumes where it stopped; prospects whose call could not be placed are
+recorded as failed and dialed again on resume.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+from twilio_handler import make_outbound_call
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """
+    Tracks dialed prospects by their position in the input.
+
+    Calls finish out of order, so the file stores the first position not yet
+    done plus the positions done beyond it (at most the number in flight).
+    Failed positions count as done for that bookkeeping but are kept in a
+    separate list, so a resumed campaign retries them.
+    """
+
+    def __init__(self, path, save_every=50):
+        self.path = path
+        self.save_every = save_every
+        self.next_index = 0
+        self.done_above = set()
+        self.failed = set()
+        self._since_save = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            self.next_index = state.get("next_index", 0)
+            self.done_above = set(state.get("done_above", []))
+            self.failed = set(state.get("failed", []))
+            logger.info(f"Resuming campaign from prospect #{self.next_index}")
+
+    def is_done(self, index):
+        return (index < self.next_index or index in self.done_above) and index not in self.failed
+
+    def mark_done(self, index, failed=False):
+        with self._lock:
+            if failed:
+                self.failed.add(index)
+            else:
+                self.failed.discard(index)
+            self.done_above.add(index)
+            while self.next_index in self.done_above:
+                self.done_above.remove(self.next_index)
+                self.next_index += 1
+            self._since_save += 1
+            if self._since_save >= self.save_every:
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        self._since_save = 0
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"next_index": self.next_index, "done_above": sorted(self.done_above),
+                       "failed": sorted(self.failed)}, f)
+        os.replace(tmp_path, self.path)
+
+
+def iter_prospects(path):
+    """
+    Yield prospects from a JSON-lines file, one at a time.
+
+    A legacy file holding a single JSON list is still accepted, but is loaded
+    into memory.
+    """
+    with open(path, "r") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            logger.warning(f"{path} is a JSON list; use JSON lines to stream large campaigns")
+            yield from json.load(f)
+            return
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.error(f"Skipping malformed prospect on line {line_no} of {path}")
+
+
+class Dialer:
+    """
+    Places calls to a stream of prospects with at most `concurrency` Twilio
+    requests in flight and at most `rate` new calls per second.
+    """
+
+    def __init__(self, webhook_url, rate=None, concurrency=None, checkpoint_path=None):
+        self.webhook_url = webhook_url
+        self.concurrency = concurrency or config.DIALER_CONCURRENCY
+        self.bucket = TokenBucket(rate or config.DIALER_CALLS_PER_SECOND)
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.stats = {"dialed": 0, "failed": 0, "skipped": 0, "resumed": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _dial(self, index, prospect, slots):
+        try:
+            phone_number = prospect.get('phone')
+            user_info = prospect.get('user_info')
+            self.bucket.acquire()
+            logger.info(f"Calling prospect at {phone_number}...")
+            try:
+                call_sid = make_outbound_call(phone_number, self.webhook_url, user_info)
+            except Exception as e:
+                logger.error(f"Error calling {phone_number}: {e}")
+                call_sid = None
+            if call_sid:
+                logger.info(f"Call initiated to {phone_number} with SID: {call_sid}")
+                self._count("dialed")
+            else:
+                logger.error(f"Failed to initiate call to {phone_number}; it is retried when the campaign resumes")
+                self._count("failed")
+            self.checkpoint.mark_done(index, failed=not call_sid)
+        finally:
+            slots.release()
+
+    def run(self, prospects):
+        """Dial every prospect in the iterable; returns the campaign stats."""
+        started = time.monotonic()
+        # Bound the number of queued prospects so a streamed input stays streamed
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+        try:
+            with ThreadPoolExecutor(self.concurrency, thread_name_prefix="dialer") as pool:
+                for index, prospect in enumerate(prospects):
+                    if self.checkpoint.is_done(index):
+                        self._count("resumed")
+                        continue
+                    if not prospect.get('phone'):
+                        logger.warning("Skipping prospect with no phone number")
+                        self._count("skipped")
+                        self.checkpoint.mark_done(index)
+                        continue
+                    slots.acquire()
+                    pool.submit(self._dial, index, prospect, slots)
+        finally:
+            # Also on an error or Ctrl-C: leaving the pool waits for the calls in
+            # flight, so every prospect dialed so far is recorded and not dialed again
+            self.checkpoint.save()
+
+        elapsed = time.monotonic() - started
+        logger.info(f"Campaign finished in {elapsed:.1f}s: {self.stats}")
+        return dict(self.stats, seconds=elapsed)
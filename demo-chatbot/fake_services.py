@@ -0,0 +1,399 @@
+"""
+Local stand-ins for the external services the bot talks to, for benchmarks and
+offline runs. Each server runs in a background thread on an ephemeral port.
+"""
+import sys
+import re
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import nullcontext
+from urllib.parse import parse_qs, urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLY = (
+    "That's a great question! Our Smart Home Hub ties all of your devices together in one app. "
+    "Customers like you usually save an hour a week on routines. "
+    "Would you prefer the monthly or the annual plan?"
+)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (cancelled hedges, timeouts) are expected.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _FakeServer:
+    handler_class = _QuietHandler
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.httpd = _HTTPServer((host, port), self.handler_class)
+        self.httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"{type(self).__name__} listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _OpenAIHandler(_QuietHandler):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json({"error": {"message": "not found"}}, status=404)
+            return
+        fake = self.server.fake
+        request = self._read_json()
+        fake.record(request)
+        with fake.capacity:
+            self._complete(fake, request)
+
+    def _complete(self, fake, request):
+        if fake.error_rate and random.random() < fake.error_rate:
+            time.sleep(fake.first_token_latency)
+            self._send_json({"error": {"message": "injected failure"}}, status=500)
+            return
+        tokens = fake.tokens_for(request)
+        model = request.get("model") or "fake-model"
+        usage = {
+            "prompt_tokens": sum(len(str(m.get("content", "")).split()) for m in request.get("messages", [])),
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        time.sleep(fake.first_token_latency)
+        if request.get("stream"):
+            self._stream(tokens, model, usage, request)
+        else:
+            time.sleep(fake.token_interval * len(tokens))
+            self._send_json({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def _stream(self, tokens, model, usage, request):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(choices, **extra):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+                **extra,
+            }
+            self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.server.fake.token_interval)
+            event([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class FakeOpenAIServer(_FakeServer):
+    """
+    OpenAI-compatible /v1/chat/completions endpoint with injected latency.
+
+    `first_token_latency` is the delay before the first token, `token_interval`
+    the delay between tokens. `reply` is a string or a callable taking the
+    request body and returning the reply text. A fraction `error_rate` of
+    requests is answered with a 500 instead. With `capacity`, at most that many
+    requests are generated at once and the rest wait their turn, as at a
+    provider with a concurrency limit.
+    """
+
+    handler_class = _OpenAIHandler
+
+    def __init__(self, reply=DEFAULT_REPLY, first_token_latency=0.3, token_interval=0.02, error_rate=0.0,
+                 capacity=None, **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply
+        self.capacity = threading.Semaphore(capacity) if capacity else nullcontext()
+        self.error_rate = error_rate
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.requests = []
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def record(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+    def tokens_for(self, request):
+        text = self.reply(request) if callable(self.reply) else self.reply
+        words = text.split(" ")
+        return [word + " " for word in words[:-1]] + words[-1:]
+
+
+class _TwilioHandler(_QuietHandler):
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        if not url.path.endswith("/IncomingPhoneNumbers.json"):
+            self._send_json({"code": 20404, "message": "not found", "status": 404}, status=404)
+            return
+        wanted = parse_qs(url.query).get("PhoneNumber", [None])[0]
+        with fake.lock:
+            numbers = [dict(n) for n in fake.phone_numbers.values() if wanted in (None, n["phone_number"])]
+        self._send_json({
+            "incoming_phone_numbers": numbers,
+            "meta": {"key": "incoming_phone_numbers", "next_page_url": None, "page": 0, "page_size": 50},
+        })
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length", 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        number = re.search(r"/IncomingPhoneNumbers/(PN\w+)\.json$", self.path)
+        if number:
+            self._update_number(number.group(1), form)
+            return
+        if not self.path.endswith("/Calls.json"):
+            self._send_json({"code": 20404, "message": "not found", "status": 404}, status=404)
+            return
+
+        with fake.lock:
+            fake.in_flight += 1
+            fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+        try:
+            time.sleep(fake.latency)
+            with fake.lock:
+                failing = fake.fail_next > 0
+                if failing:
+                    fake.fail_next -= 1
+                else:
+                    fake.calls.append(form)
+                    sid = f"CA{len(fake.calls):032x}"
+            if failing:
+                self._send_json({"code": 20503, "message": "Service unavailable", "status": 503}, status=503)
+                return
+            self._send_json({
+                "sid": sid,
+                "to": form.get("To"),
+                "from": form.get("From"),
+                "status": "queued",
+                "direction": "outbound-api",
+            }, status=201)
+        finally:
+            with fake.lock:
+                fake.in_flight -= 1
+
+    def _update_number(self, sid, form):
+        fake = self.server.fake
+        with fake.lock:
+            number = fake.phone_numbers.get(sid)
+            if number is not None:
+                for field, value in form.items():
+                    number[re.sub(r"(?<!^)(?=[A-Z])", "_", field).lower()] = value
+                fake.webhook_updates += 1
+                number = dict(number)
+        if number is None:
+            self._send_json({"code": 20404, "message": "not found", "status": 404}, status=404)
+        else:
+            self._send_json(number)
+
+
+class FakeTwilioServer(_FakeServer):
+    """
+    Twilio REST API stand-in that accepts Calls.json create requests and
+    lists and updates IncomingPhoneNumbers.
+
+    Point the app at it with config.TWILIO_API_BASE_URL = server.url. Each
+    call request takes `latency` seconds; created calls are kept in `calls` and
+    the peak number of concurrent requests in `max_in_flight`. The next
+    `fail_next` call requests are answered with a 503. `phone_numbers`
+    holds the account's numbers by SID (add one with add_phone_number) and
+    `webhook_updates` counts updates to them.
+    """
+
+    handler_class = _TwilioHandler
+
+    def __init__(self, latency=0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.phone_numbers = {}
+        self.webhook_updates = 0
+        self.fail_next = 0
+        self.lock = threading.Lock()
+
+    def add_phone_number(self, phone_number, voice_url=None):
+        with self.lock:
+            sid = f"PN{len(self.phone_numbers) + 1:032x}"
+            self.phone_numbers[sid] = {"sid": sid, "phone_number": phone_number, "voice_url": voice_url,
+                                       "status_callback": None}
+        return sid
+
+
+class _BackendHandler(_QuietHandler):
+    def do_POST(self):
+        fake = self.server.fake
+        body = self._read_json()
+        time.sleep(fake.latency)
+        with fake.lock:
+            fake.requests += 1
+            fake.bytes_received += int(self.headers.get("Content-Length", 0))
+            failing = fake.fail_next > 0
+            if failing:
+                fake.fail_next -= 1
+        if failing:
+            self._send_json({"error": "unavailable"}, status=503)
+        elif self.path == "/api/save-conversations":
+            with fake.lock:
+                for convo in body.get("conversations", []):
+                    fake.conversations[convo.get("call_sid")] = convo
+            self._send_json({"message": "Conversations saved", "count": len(body.get("conversations", []))})
+        elif self.path == "/api/save-conversation":
+            with fake.lock:
+                fake.conversations[body.get("call_sid")] = body
+            self._send_json({"message": "Conversation saved", "id": body.get("call_sid")})
+        elif self.path == "/api/prompt-templates":
+            with fake.lock:
+                fake.templates.update(body.get("templates", {}))
+            self._send_json({"message": "Templates saved", "count": len(body.get("templates", {}))})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+
+class FakeBackendServer(_FakeServer):
+    """
+    Node backend stand-in for /api/save-conversation(s) and /api/prompt-templates.
+
+    Saved conversations are kept in `conversations` by call SID and registered
+    prompt templates in `templates`; set
+    `fail_next` to answer that many requests with 503 to exercise retries.
+    """
+
+    handler_class = _BackendHandler
+
+    def __init__(self, latency=0.01, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.conversations = {}
+        self.templates = {}
+        self.requests = 0
+        self.bytes_received = 0
+        self.fail_next = 0
+        self.lock = threading.Lock()
+
+
+class _NgrokHandler(_QuietHandler):
+    def do_GET(self):
+        fake = self.server.fake
+        if self.path.rstrip("/") != "/api/tunnels":
+            self._send_json({"error": "not found"}, status=404)
+            return
+        tunnels = []
+        if time.monotonic() >= fake.ready_at:
+            tunnels.append({"name": "command_line", "proto": "https", "public_url": fake.public_url,
+                            "config": {"addr": f"http://localhost:{fake.tunnel_port}"}})
+        self._send_json({"tunnels": tunnels})
+
+
+class FakeNgrokAgent(_FakeServer):
+    """
+    ngrok agent stand-in: serves the local /api/tunnels API, listing one https
+    tunnel to `tunnel_port` with a new random public URL once `startup_delay` has
+    passed. Run it as a process in place of the ngrok binary with
+
+        NGROK_BIN="python fake_services.py ngrok --api-port 4041"
+        NGROK_API_URL=http://127.0.0.1:4041
+    """
+
+    handler_class = _NgrokHandler
+
+    def __init__(self, tunnel_port, startup_delay=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.tunnel_port = tunnel_port
+        self.public_url = f"https://{random.getrandbits(48):012x}.ngrok.fake"
+        self.ready_at = time.monotonic() + startup_delay
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fake external services")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ngrok = commands.add_parser("ngrok", help="Fake ngrok agent (arguments as for `ngrok http <port>`)")
+    ngrok.add_argument("--api-port", type=int, default=4040)
+    ngrok.add_argument("--startup-delay", type=float, default=0.5)
+    ngrok.add_argument("proto", choices=["http"])
+    ngrok.add_argument("port", type=int)
+    args = parser.parse_args()
+
+    agent = FakeNgrokAgent(args.port, startup_delay=args.startup_delay, port=args.api_port)
+    agent.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Idempotent TwiML webhooks.
+
+Twilio retries a webhook that answers slowly and re-requests /voice, so a
+slow turn could be generated twice and appended to the history twice. Each
+request to a wrapped webhook is keyed on its route, CallSid, SpeechResult and
+the `turn` token of the URL it was sent to: every URL the bot hands Twilio
+(<Gather action>, the /voice and /continue-reply redirects) carries the token
+of the request that produced it, so the key also tells apart a caller saying
+"yes" twice in a row. A duplicate of a request still in flight waits for that
+request's TwiML instead of generating its own; a repeat within
+WEBHOOK_DEDUP_TTL seconds gets the cached TwiML replayed. At most
+WEBHOOK_DEDUP_SIZE responses are kept, oldest dropped first.
+"""
+import time
+import asyncio
+import hashlib
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import Future
+import config
+from metrics import WEBHOOK_DUPLICATES
+
+logger = logging.getLogger(__name__)
+
+_turn = contextvars.ContextVar("webhook_turn", default=None)
+
+
+def request_key(route, values):
+    """Fingerprint of a webhook request; retries of the same request share it."""
+    parts = (route, values.get("CallSid", ""), values.get("turn", ""), values.get("SpeechResult", ""))
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def turn_url(path):
+    """`path` tagged with the turn token of the request being answered, if any."""
+    turn = _turn.get()
+    return f"{path}?turn={turn}" if turn else path
+
+
+class _Entry:
+    __slots__ = ("future", "created")
+
+    def __init__(self):
+        self.future = Future()
+        self.created = time.monotonic()
+
+
+class WebhookDeduplicator:
+    """Runs each keyed webhook request once; duplicates share or replay its response."""
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = config.WEBHOOK_DEDUP_TTL if ttl is None else ttl
+        self.max_entries = max_entries or config.WEBHOOK_DEDUP_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"executed": 0, "coalesced": 0, "replayed": 0, "failed": 0, "expired": 0, "evicted": 0}
+
+    def run(self, key, handle, route="webhook"):
+        """Return handle()'s response, or that of the same request already answered or in flight."""
+        entry, owner = self._claim(key, route)
+        if not owner:
+            return entry.future.result()
+        try:
+            result = handle()
+        except BaseException as e:
+            self._fail(key, entry, e)
+            raise
+        entry.future.set_result(result)
+        return result
+
+    async def arun(self, key, handle, route="webhook"):
+        """Async variant of run(); `handle` returns a coroutine and duplicates wait without blocking the loop."""
+        entry, owner = self._claim(key, route)
+        if not owner:
+            return await asyncio.wrap_future(entry.future)
+        try:
+            result = await handle()
+        except BaseException as e:
+            self._fail(key, entry, e)
+            raise
+        entry.future.set_result(result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, cached=len(self._entries))
+        requests = stats["executed"] + stats["coalesced"] + stats["replayed"]
+        stats["duplicate_rate"] = (stats["coalesced"] + stats["replayed"]) / requests if requests else 0.0
+        return stats
+
+    def _claim(self, key, route):
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+                self._stats["executed"] += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evicted"] += 1
+                return entry, True
+            outcome = "replayed" if entry.future.done() else "coalesced"
+            self._stats[outcome] += 1
+        logger.info(f"Duplicate {route} request {key} {outcome}")
+        if config.METRICS_ENABLED:
+            WEBHOOK_DUPLICATES.inc(route=route, outcome=outcome)
+        return entry, False
+
+    def _expire(self):
+        # Entries are in creation order, so the expired ones are at the front
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.created > cutoff:
+                break
+            del self._entries[key]
+            self._stats["expired"] += 1
+
+    def _fail(self, key, entry, error):
+        # Duplicates already waiting get the error too; the next retry runs the request again
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            self._stats["failed"] += 1
+        entry.future.set_exception(error)
+
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator():
+    global _deduplicator
+    if _deduplicator is None:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                _deduplicator = WebhookDeduplicator()
+    return _deduplicator
+
+
+def idempotent(route, get_values=None):
+    """
+    Decorate a TwiML webhook handler (sync or async) so duplicates of a request
+    are answered with its response. The request values come from
+    `get_values()` (Flask) or the handler's first argument (ASGI).
+    """
+    def decorator(handler):
+        def key_of(args):
+            values = get_values() if get_values else args[0]
+            if not config.WEBHOOK_DEDUP or not values.get("CallSid"):
+                return None
+            return request_key(route, values)
+
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                key = key_of(args)
+                if key is None:
+                    return await handler(*args, **kwargs)
+
+                async def handle():
+                    token = _turn.set(key)
+                    try:
+                        return await handler(*args, **kwargs)
+                    finally:
+                        _turn.reset(token)
+                return await get_deduplicator().arun(key, handle, route)
+        else:
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                key = key_of(args)
+                if key is None:
+                    return handler(*args, **kwargs)
+
+                def handle():
+                    token = _turn.set(key)
+                    try:
+                        return handler(*args, **kwargs)
+                    finally:
+                        _turn.reset(token)
+                return get_deduplicator().run(key, handle, route)
+        return wrapper
+    return decorator
@@ -0,0 +1,78 @@
+import re
+from bisect import bisect_right
+
+# Joins transcripts for batch matching; a non-word character, so \b still holds at the edges
+BATCH_SEPARATOR = "\x00"
+
+
+def _normalize(phrase):
+    return " ".join(phrase.lower().split())
+
+
+def _trie_pattern(node):
+    """Regex for a character trie, with common prefixes factored out."""
+    alternatives = []
+    for char in sorted(k for k in node if k):
+        piece = r"\s+" if char == " " else re.escape(char)
+        alternatives.append(piece + _trie_pattern(node[char]))
+    if not alternatives:
+        return ""
+    optional = "" in node
+    if len(alternatives) == 1 and not optional:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")" + ("?" if optional else "")
+
+
+class IntentMatcher:
+    """
+    Finds indicator phrases in text with a single compiled regex.
+
+    Phrases are merged into a trie-shaped pattern and matched on word
+    boundaries, so "end" no longer fires inside "recommend". Each match is
+    mapped back to the configured phrase that produced it.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = {_normalize(p): p for p in phrases if p.strip()}
+        trie = {}
+        for phrase in self.phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        body = _trie_pattern(trie) if trie else r"(?!)"
+        self.pattern = re.compile(rf"\b(?:{body})\b", re.IGNORECASE)
+
+    def _phrase(self, match):
+        return self.phrases[_normalize(match.group(0))]
+
+    def search(self, text):
+        """Return the first indicator found in `text`, or None."""
+        match = self.pattern.search(text)
+        return self._phrase(match) if match else None
+
+    def find_all(self, text):
+        return [self._phrase(m) for m in self.pattern.finditer(text)]
+
+    def search_batch(self, texts):
+        """Return the first indicator found in each of `texts` (None where nothing matched)."""
+        texts = [t.replace(BATCH_SEPARATOR, " ") for t in texts]
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + len(BATCH_SEPARATOR)
+
+        joined = BATCH_SEPARATOR.join(texts)
+        results = [None] * len(texts)
+        pos = 0
+        while True:
+            match = self.pattern.search(joined, pos)
+            if not match:
+                return results
+            i = bisect_right(starts, match.start()) - 1
+            results[i] = self._phrase(match)
+            # Only the first match per transcript is needed; resume at the next one
+            if i + 1 == len(starts):
+                return results
+            pos = starts[i + 1]
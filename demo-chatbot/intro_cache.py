@@ -0,0 +1,129 @@
+"""
+Introductions generated ahead of time, keyed by call SID.
+
+The introduction is generated in the background as soon as a call is placed,
+so /voice can answer with it immediately. Finished introductions are also
+written to the shared call_profiles database, for when the dialer and the
+webhook server run as separate processes.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import config
+from call_profiles import bind_introduction, get_introduction
+from metrics import INTRO_CACHE_EVENTS, INTRO_READY_RATE
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, future=None, text=None):
+        self.future = future
+        self.text = text
+        self.answered = False
+
+
+class IntroCache:
+    """
+    Pre-generates introductions with `generate(call_sid, user_info)` on a
+    background pool and serves them by call SID.
+
+    The first lookup for a call is counted as ready (generated before the
+    callee answered), waited (still in progress, awaited up to the timeout)
+    or missed (generated on demand by the caller). The counts and the
+    ready-before-answer rate are exported on /metrics.
+    """
+
+    def __init__(self, generate, max_entries=None, workers=None):
+        self.generate = generate
+        self.max_entries = max_entries or config.INTRO_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers or config.INTRO_WORKERS, thread_name_prefix="intro")
+        self._stats = {"pregenerated": 0, "failed": 0, "ready": 0, "waited": 0, "missed": 0}
+
+    def pregenerate(self, call_sid, user_info=None):
+        """Start generating the introduction for a call that has just been placed."""
+        with self._lock:
+            if call_sid in self._entries:
+                return
+            entry = self._put(call_sid, _Entry())
+            entry.future = self._executor.submit(self._run, call_sid, user_info)
+
+    def remember(self, call_sid, text):
+        """Keep an introduction generated on demand, so redirects back to /voice reuse it."""
+        with self._lock:
+            entry = self._entries.get(call_sid)
+            if entry is None:
+                entry = self._put(call_sid, _Entry())
+                entry.answered = True
+            entry.text = text
+
+    def get(self, call_sid, timeout=None):
+        """Return the introduction for a call, or None if it has to be generated now."""
+        timeout = config.INTRO_WAIT_TIMEOUT if timeout is None else timeout
+        with self._lock:
+            entry = self._entries.get(call_sid)
+            first = entry is not None and not entry.answered
+            if entry is not None:
+                entry.answered = True
+
+        if entry is None:
+            text = get_introduction(call_sid)
+            if text:
+                self.remember(call_sid, text)
+            self._count("ready" if text else "missed")
+            return text
+
+        pending = entry.text is None and entry.future is not None and not entry.future.done()
+        if pending:
+            try:
+                entry.future.result(timeout=timeout)
+            except TimeoutError:
+                logger.warning(f"Introduction for call {call_sid} not ready after {timeout}s")
+
+        if first:
+            self._count("missed" if entry.text is None else "waited" if pending else "ready")
+        return entry.text
+
+    def forget(self, call_sid):
+        with self._lock:
+            self._entries.pop(call_sid, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, cached=len(self._entries))
+        answered = stats["ready"] + stats["waited"] + stats["missed"]
+        stats["ready_before_answer_rate"] = stats["ready"] / answered if answered else 0.0
+        return stats
+
+    def _put(self, call_sid, entry):
+        self._entries[call_sid] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+            answered = self._stats["ready"] + self._stats["waited"] + self._stats["missed"]
+            ready = self._stats["ready"]
+        if config.METRICS_ENABLED:
+            INTRO_CACHE_EVENTS.inc(outcome=key)
+            if answered:
+                INTRO_READY_RATE.set(ready / answered)
+
+    def _run(self, call_sid, user_info):
+        try:
+            text = self.generate(call_sid, user_info)
+            with self._lock:
+                entry = self._entries.get(call_sid)
+                if entry is not None:
+                    entry.text = text
+            bind_introduction(call_sid, text)
+            self._count("pregenerated")
+            logger.info(f"Introduction ready for call {call_sid}")
+        except Exception as e:
+            self._count("failed")
+            logger.error(f"Error pre-generating introduction for call {call_sid}: {e}")
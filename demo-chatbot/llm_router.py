@@ -0,0 +1,385 @@
+"""
+Latency-aware routing of model requests over several OpenAI-compatible endpoints.
+
+Each endpoint's latency (time to the first token for streams, to the whole
+response otherwise) is tracked as an EWMA, and every request goes to the
+fastest healthy endpoint first. A request has a per-turn deadline: if no
+answer has arrived once LLM_HEDGE_AFTER of it has passed, a hedged request is
+sent to the next endpoint and whichever answers first wins. The async and
+streaming paths cancel the loser; a plain sync request cannot be interrupted,
+so its loser runs on in the router's thread pool until it answers or its
+timeout (the turn deadline) passes, and its answer is dropped. Failed requests
+fail over to the next endpoint at once, and an endpoint that keeps failing is
+taken out of rotation for a growing cooldown. If nothing answers before the
+deadline ModelUnavailable is raised and the caller speaks its canned fallback
+reply.
+
+Endpoints come from LLM_ENDPOINTS (a JSON list of {"name", "base_url",
+"api_key", "model"}) or default to API_BASE_URL / API_KEY / MODEL_NAME.
+"""
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openai import OpenAI, AsyncOpenAI
+import config
+from metrics import (
+    LLM_ENDPOINT_SECONDS, LLM_ENDPOINT_LATENCY, LLM_ENDPOINT_HEALTHY, LLM_HEDGES, LLM_FALLBACKS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ModelUnavailable(Exception):
+    """No endpoint answered before the deadline."""
+
+
+class Endpoint:
+    def __init__(self, name, base_url, api_key, model=None):
+        self.name = name
+        self.model = model or config.MODEL_NAME
+        # Retries are the router's job (fail-over and hedging), not the client's
+        self.client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        self.latency = None  # EWMA, seconds
+        self.failures = 0
+        self.down_until = 0.0
+
+    def healthy(self, now):
+        return self.down_until <= now
+
+    def __repr__(self):
+        return f"Endpoint({self.name!r})"
+
+
+def endpoints_from_config(endpoints=None, model=None):
+    """Endpoints from a JSON list like LLM_ENDPOINTS (the default), else API_BASE_URL; `model` overrides theirs."""
+    endpoints = config.LLM_ENDPOINTS if endpoints is None else endpoints
+    if endpoints:
+        specs = json.loads(endpoints)
+        return [Endpoint(spec.get("name") or spec["base_url"], spec["base_url"], spec.get("api_key", config.API_KEY),
+                         model or spec.get("model")) for spec in specs]
+    return [Endpoint("default", config.API_BASE_URL, config.API_KEY, model)]
+
+
+def _retrieve_exception(task):
+    if not task.cancelled():
+        task.exception()
+
+
+class _StreamAttempt:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.cancelled = threading.Event()
+        self.finished = False
+
+
+class ModelRouter:
+    def __init__(self, endpoints=None, deadline=None, hedge_after=None, alpha=None, failures_to_down=None,
+                 max_down_seconds=None):
+        self.endpoints = list(endpoints or endpoints_from_config())
+        self.deadline = deadline or config.LLM_TURN_DEADLINE
+        self.hedge_after = config.LLM_HEDGE_AFTER if hedge_after is None else hedge_after
+        self.alpha = alpha or config.LLM_EWMA_ALPHA
+        self.failures_to_down = failures_to_down or config.LLM_FAILURES_TO_DOWN
+        self.max_down_seconds = max_down_seconds or config.LLM_MAX_DOWN_SECONDS
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm")
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "unavailable": 0}
+
+    @classmethod
+    def for_url(cls, base_url, api_key="fake", model=None, **kwargs):
+        """A router over a single endpoint (benchmarks and tests against a fake server)."""
+        return cls([Endpoint("default", base_url, api_key, model)], **kwargs)
+
+    def ranked(self):
+        """Healthy endpoints fastest first (unmeasured ones first, to measure them), then the ones cooling down."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy(now)]
+            down = [e for e in self.endpoints if not e.healthy(now)]
+            healthy.sort(key=lambda e: e.latency or 0.0)
+            down.sort(key=lambda e: e.down_until)
+        return healthy + down
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["endpoints"] = {
+                e.name: {"latency": e.latency, "failures": e.failures, "healthy": e.healthy(time.monotonic())}
+                for e in self.endpoints
+            }
+        return stats
+
+    # --- plain completions -------------------------------------------------
+
+    def chat(self, kind="chat", deadline=None, **kwargs):
+        """chat.completions.create on the fastest endpoint, hedged and failed over within the deadline."""
+        start = time.monotonic()
+        end = start + (deadline or self.deadline)
+        hedge_at = start + (end - start) * self.hedge_after
+        candidates = iter(self.ranked())
+        pending = {}
+
+        def launch():
+            endpoint = next(candidates, None)
+            if endpoint is not None:
+                pending[self._executor.submit(self._call, endpoint, kwargs, end)] = endpoint
+            return endpoint
+
+        first = launch()
+        self._count("requests")
+        hedged = False
+        while pending:
+            now = time.monotonic()
+            timeout = (end if hedged else min(hedge_at, end)) - now
+            done, _ = wait(pending, timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception:
+                    continue
+                self._hedge_outcome(hedged, endpoint is not first)
+                return response
+            if time.monotonic() >= end:
+                break
+            if done and not pending:
+                if launch():
+                    self._count("failovers")
+            elif not done and not hedged:
+                hedged = True
+                if launch():
+                    self._count("hedged")
+        return self._unavailable(kind, start)
+
+    async def achat(self, kind="chat", deadline=None, **kwargs):
+        """Async variant of chat(); the losing request of a hedge is cancelled."""
+        start = time.monotonic()
+        end = start + (deadline or self.deadline)
+        hedge_at = start + (end - start) * self.hedge_after
+        candidates = iter(self.ranked())
+        pending = {}
+
+        def launch():
+            endpoint = next(candidates, None)
+            if endpoint is not None:
+                pending[asyncio.ensure_future(self._acall(endpoint, kwargs, end))] = endpoint
+            return endpoint
+
+        first = launch()
+        self._count("requests")
+        hedged = False
+        try:
+            while pending:
+                timeout = (end if hedged else min(hedge_at, end)) - time.monotonic()
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, timeout), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    endpoint = pending.pop(task)
+                    if task.exception() is None:
+                        self._hedge_outcome(hedged, endpoint is not first)
+                        return task.result()
+                if time.monotonic() >= end:
+                    break
+                if done and not pending:
+                    if launch():
+                        self._count("failovers")
+                elif not done and not hedged:
+                    hedged = True
+                    if launch():
+                        self._count("hedged")
+        finally:
+            for task in pending:
+                # A loser may already have failed; retrieve its exception so it is not logged as never retrieved
+                task.add_done_callback(_retrieve_exception)
+                task.cancel()
+        return self._unavailable(kind, start)
+
+    def _call(self, endpoint, kwargs, end):
+        start = time.monotonic()
+        try:
+            if end - start <= 0:
+                raise TimeoutError("turn deadline passed")
+            client = endpoint.client.with_options(timeout=end - start)
+            response = client.chat.completions.create(**dict(kwargs, model=endpoint.model))
+        except Exception as e:
+            self._failed(endpoint, time.monotonic() - start, e)
+            raise
+        self._succeeded(endpoint, time.monotonic() - start)
+        return response
+
+    async def _acall(self, endpoint, kwargs, end):
+        start = time.monotonic()
+        try:
+            if end - start <= 0:
+                raise TimeoutError("turn deadline passed")
+            client = endpoint.async_client.with_options(timeout=end - start)
+            response = await client.chat.completions.create(**dict(kwargs, model=endpoint.model))
+        except asyncio.CancelledError:
+            self._cancelled(endpoint, time.monotonic() - start)
+            raise
+        except Exception as e:
+            self._failed(endpoint, time.monotonic() - start, e)
+            raise
+        self._succeeded(endpoint, time.monotonic() - start)
+        return response
+
+    # --- streams -----------------------------------------------------------
+
+    def stream(self, kind="stream", deadline=None, **kwargs):
+        """
+        Yield the chunks of a streamed completion. The race is on the first
+        token: a hedge starts if none has arrived by the hedge point, and the
+        first endpoint to produce content is streamed while the others are closed.
+        """
+        start = time.monotonic()
+        end = start + (deadline or self.deadline)
+        hedge_at = start + (end - start) * self.hedge_after
+        candidates = iter(self.ranked())
+        events = queue.Queue()
+        active = []
+
+        def launch():
+            endpoint = next(candidates, None)
+            if endpoint is not None:
+                attempt = _StreamAttempt(endpoint)
+                active.append(attempt)
+                self._executor.submit(self._stream_worker, attempt, kwargs, end, events)
+            return endpoint
+
+        first = launch()
+        self._count("requests")
+        hedged = False
+        winner = None
+        try:
+            while winner is None:
+                if not active:
+                    return self._unavailable(kind, start)
+                timeout = (end if hedged else min(hedge_at, end)) - time.monotonic()
+                try:
+                    attempt, event, payload = events.get(timeout=max(0.0, timeout))
+                except queue.Empty:
+                    if time.monotonic() >= end:
+                        return self._unavailable(kind, start)
+                    if not hedged:
+                        hedged = True
+                        if launch():
+                            self._count("hedged")
+                    continue
+                if event == "chunk":
+                    if payload.choices and payload.choices[0].delta.content:
+                        winner = attempt
+                        self._hedge_outcome(hedged, attempt.endpoint is not first)
+                        yield payload
+                elif event == "done":
+                    winner = attempt
+                    winner.finished = True
+                else:
+                    active.remove(attempt)
+                    if not active and launch():
+                        self._count("failovers")
+
+            for attempt in active:
+                if attempt is not winner:
+                    attempt.cancelled.set()
+            while not winner.finished:
+                attempt, event, payload = events.get()
+                if attempt is not winner:
+                    continue
+                if event == "chunk":
+                    yield payload
+                elif event == "error":
+                    raise payload
+                else:
+                    winner.finished = True
+        finally:
+            for attempt in active:
+                attempt.cancelled.set()
+
+    def _stream_worker(self, attempt, kwargs, end, events):
+        endpoint = attempt.endpoint
+        start = time.monotonic()
+        measured = False
+        try:
+            if end - start <= 0:
+                raise TimeoutError("turn deadline passed")
+            client = endpoint.client.with_options(timeout=end - start)
+            stream = client.chat.completions.create(**dict(kwargs, model=endpoint.model), stream=True)
+            try:
+                for chunk in stream:
+                    if attempt.cancelled.is_set():
+                        if not measured:
+                            self._cancelled(endpoint, time.monotonic() - start)
+                        return
+                    if not measured and chunk.choices and chunk.choices[0].delta.content:
+                        measured = True
+                        self._succeeded(endpoint, time.monotonic() - start)
+                    events.put((attempt, "chunk", chunk))
+            finally:
+                stream.close()
+            if not measured:
+                self._succeeded(endpoint, time.monotonic() - start)
+            events.put((attempt, "done", None))
+        except Exception as e:
+            if not measured:
+                self._failed(endpoint, time.monotonic() - start, e)
+            events.put((attempt, "error", e))
+
+    # --- bookkeeping -------------------------------------------------------
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _hedge_outcome(self, hedged, hedge_won):
+        if not hedged:
+            return
+        if hedge_won:
+            self._count("hedge_wins")
+        if config.METRICS_ENABLED:
+            LLM_HEDGES.inc(outcome="won" if hedge_won else "lost")
+
+    def _unavailable(self, kind, start):
+        self._count("unavailable")
+        if config.METRICS_ENABLED:
+            LLM_FALLBACKS.inc(kind=kind)
+        raise ModelUnavailable(f"No model endpoint answered within {time.monotonic() - start:.1f}s")
+
+    def _observe(self, endpoint, seconds):
+        endpoint.latency = seconds if endpoint.latency is None else (
+            self.alpha * seconds + (1 - self.alpha) * endpoint.latency
+        )
+
+    def _succeeded(self, endpoint, seconds):
+        with self._lock:
+            self._observe(endpoint, seconds)
+            endpoint.failures = 0
+            endpoint.down_until = 0.0
+        self._export(endpoint, seconds, "ok")
+
+    def _cancelled(self, endpoint, seconds):
+        # Lost a hedge: it took at least this long, so only a slower-than-usual sample counts
+        with self._lock:
+            if endpoint.latency is None or seconds > endpoint.latency:
+                self._observe(endpoint, seconds)
+        self._export(endpoint, seconds, "cancelled")
+
+    def _failed(self, endpoint, seconds, error):
+        with self._lock:
+            self._observe(endpoint, max(seconds, endpoint.latency or 0.0))
+            endpoint.failures += 1
+            if endpoint.failures >= self.failures_to_down:
+                cooldown = min(self.max_down_seconds, 2 ** (endpoint.failures - self.failures_to_down))
+                endpoint.down_until = time.monotonic() + cooldown
+                logger.warning(f"Model endpoint {endpoint.name} is down for {cooldown}s after "
+                               f"{endpoint.failures} failures: {error}")
+        self._export(endpoint, seconds, "error")
+
+    def _export(self, endpoint, seconds, outcome):
+        if config.METRICS_ENABLED:
+            LLM_ENDPOINT_SECONDS.observe(seconds, endpoint=endpoint.name, outcome=outcome)
+            LLM_ENDPOINT_LATENCY.set(endpoint.latency or 0.0, endpoint=endpoint.name)
+            LLM_ENDPOINT_HEALTHY.set(1 if endpoint.healthy(time.monotonic()) else 0, endpoint=endpoint.name)
@@ -0,0 +1,168 @@
+"""
+Twilio Media Streams: the caller's audio over a websocket, endpointed and
+transcribed locally.
+
+With MEDIA_STREAM_URL set, /voice (ASGI server) answers with <Start><Stream>,
+so Twilio forks the caller's 8 kHz μ-law audio to /media-stream while the call
+keeps running TwiML. Each utterance cut by the endpointer is transcribed with
+faster-whisper and answered by updating the live call with new TwiML, instead
+of waiting for a <Gather> round-trip.
+
+A stream started with the custom parameter replay=true (see
+replay_media_stream.py) gets its replies back over the websocket instead, so
+recorded audio can be replayed without a phone line.
+"""
+import json
+import base64
+import asyncio
+import logging
+import numpy as np
+from twilio.twiml.voice_response import VoiceResponse
+import config
+from audio import ASR_RATE, FRAME_SAMPLES, RingBuffer, Endpointer, ulaw_decode, upsample_2x
+from asr import get_asr_pool
+from metrics import timed, span
+from twiml import speak
+from conversation import detect_conversation_end
+from sales_bot import get_user_info_from_call, agenerate_response, agenerate_closing
+
+logger = logging.getLogger(__name__)
+
+PREROLL_SECONDS = 0.3
+
+
+class MediaStreamSession:
+    """Turns a call's media frames into utterances (16 kHz float32 arrays)."""
+
+    def __init__(self, max_seconds=None):
+        max_seconds = max_seconds or config.MEDIA_MAX_UTTERANCE_SECONDS
+        self.call_sid = None
+        self.stream_sid = None
+        self.replay = False
+        self.endpointer = Endpointer(max_seconds=max_seconds)
+        self.buffer = RingBuffer(int((max_seconds + PREROLL_SECONDS + 1) * ASR_RATE))
+        self.preroll = RingBuffer(int(PREROLL_SECONDS * ASR_RATE))
+        self._frame = np.empty(FRAME_SAMPLES * 2, dtype=np.float32)
+        self._remainder = b""
+
+    def start(self, start):
+        self.call_sid = start.get("callSid")
+        self.stream_sid = start.get("streamSid")
+        self.replay = (start.get("customParameters") or {}).get("replay") == "true"
+        logger.info(f"Media stream {self.stream_sid} started for call {self.call_sid}")
+
+    def feed(self, payload):
+        """Add μ-law bytes; returns the utterances completed by them."""
+        data = self._remainder + payload
+        usable = len(data) - len(data) % FRAME_SAMPLES
+        self._remainder = data[usable:]
+        if not usable:
+            return []
+
+        samples = ulaw_decode(data[:usable])
+        utterances = []
+        for offset in range(0, usable, FRAME_SAMPLES):
+            frame = samples[offset:offset + FRAME_SAMPLES]
+            upsampled = upsample_2x(frame, self._frame)
+            event = self.endpointer.feed(frame)
+            if event == "start":
+                # Keep the quiet lead-in the endpointer needed to decide this was speech
+                self.buffer.clear()
+                self.buffer.write(self.preroll.read())
+            if self.endpointer.in_speech or event == "end":
+                self.buffer.write(upsampled)
+                if event == "end":
+                    utterances.append(self.buffer.read())
+                    self.buffer.clear()
+            else:
+                if event == "discard":
+                    self.buffer.clear()
+                self.preroll.write(upsampled)
+        return utterances
+
+
+def _say_on_call(call_sid, text, hangup):
+    """Replace the live call's TwiML: speak the reply, then keep listening (or hang up)."""
+    from twilio_handler import get_twilio_client
+
+    response = VoiceResponse()
+    speak(response, text, inline=True)
+    if hangup:
+        response.hangup()
+    else:
+        response.pause(length=config.MEDIA_LISTEN_SECONDS)
+    get_twilio_client().calls(call_sid).update(twiml=str(response))
+
+
+@timed("media_stream")
+async def _answer_utterance(session, audio, send):
+    """Transcribe one utterance and reply to it; returns True when the call should end."""
+    with span("transcription"):
+        text = await asyncio.wrap_future(get_asr_pool().submit(audio))
+    if not text:
+        return False
+    logger.info(f"Transcription for call {session.call_sid}: {text}")
+
+    with span("intent_detection"):
+        is_conversation_end = detect_conversation_end(text)
+    user_info = await asyncio.to_thread(get_user_info_from_call, session.call_sid)
+    with span("generation"):
+        if is_conversation_end:
+            reply = await agenerate_closing(session.call_sid, user_info)
+        else:
+            reply = await agenerate_response(text, session.call_sid, user_info)
+
+    if session.replay:
+        await send({"type": "websocket.send", "text": json.dumps({
+            "event": "reply", "transcript": text, "reply": reply, "hangup": is_conversation_end,
+        })})
+    else:
+        await asyncio.to_thread(_say_on_call, session.call_sid, reply, is_conversation_end)
+    return is_conversation_end
+
+
+async def _answer_utterances(session, queue, send):
+    while True:
+        audio = await queue.get()
+        if audio is None:
+            return
+        try:
+            if await _answer_utterance(session, audio, send):
+                return
+        except Exception as e:
+            logger.error(f"Error answering utterance on call {session.call_sid}: {e}")
+
+
+async def handle_media_stream(receive, send):
+    """ASGI websocket handler for Twilio Media Streams messages."""
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+
+    session = MediaStreamSession()
+    # Utterances are answered in order, one at a time, while audio keeps arriving
+    queue = asyncio.Queue()
+    worker = asyncio.create_task(_answer_utterances(session, queue, send))
+    disconnected = False
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                disconnected = True
+                break
+            data = json.loads(message.get("text") or message.get("bytes") or "{}")
+            event = data.get("event")
+            if event == "start":
+                session.start(data["start"])
+            elif event == "media":
+                for audio in session.feed(base64.b64decode(data["media"]["payload"])):
+                    queue.put_nowait(audio)
+            elif event == "stop":
+                break
+    finally:
+        queue.put_nowait(None)
+        await worker
+        if not disconnected:
+            await send({"type": "websocket.close", "code": 1000})
+    logger.info(f"Media stream {session.stream_sid} closed")
@@ -0,0 +1,343 @@
+"""
+Per-stage timings and model usage, exported in the Prometheus text format.
+
+Webhook handlers are wrapped with @timed(route); code they call marks its
+stages with `with span("history_load"):`, labelled with the route the request
+came in on. Model calls go through completion_span(kind), which also counts
+prompt and completion tokens from the response usage.
+
+With METRICS_ENABLED=false every span is a shared no-op context manager, so
+instrumented code pays one attribute lookup per stage.
+"""
+import time
+import inspect
+import threading
+import functools
+import contextvars
+from contextlib import nullcontext
+import config
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NOOP = nullcontext()
+_route = contextvars.ContextVar("metrics_route", default="background")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, labelnames=()):
+        metric = Gauge(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "sales_bot_request_seconds", "Webhook handling time", ("route",))
+REQUEST_ERRORS = REGISTRY.counter(
+    "sales_bot_request_errors_total", "Webhook requests that raised", ("route",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "sales_bot_stage_seconds", "Time spent in each stage of a webhook", ("route", "stage"))
+LLM_SECONDS = REGISTRY.histogram(
+    "sales_bot_llm_seconds", "Model request time, to the last token for streams", ("kind",))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "sales_bot_llm_first_token_seconds", "Time to the first streamed token", ("kind",))
+LLM_REQUESTS = REGISTRY.counter(
+    "sales_bot_llm_requests_total", "Model requests by outcome", ("kind", "outcome"))
+LLM_TOKENS = REGISTRY.counter(
+    "sales_bot_llm_tokens_total", "Tokens reported in the model response usage", ("kind", "type"))
+LLM_ENDPOINT_SECONDS = REGISTRY.histogram(
+    "sales_bot_llm_endpoint_seconds", "Per-endpoint latency (first token for streams)", ("endpoint", "outcome"))
+LLM_ENDPOINT_LATENCY = REGISTRY.gauge(
+    "sales_bot_llm_endpoint_latency_ewma_seconds", "Smoothed latency the router ranks endpoints by", ("endpoint",))
+LLM_ENDPOINT_HEALTHY = REGISTRY.gauge(
+    "sales_bot_llm_endpoint_healthy", "1 while the endpoint is in rotation", ("endpoint",))
+LLM_HEDGES = REGISTRY.counter(
+    "sales_bot_llm_hedges_total", "Hedged second requests, by whether the hedge answered first", ("outcome",))
+LLM_FALLBACKS = REGISTRY.counter(
+    "sales_bot_llm_fallbacks_total", "Turns answered with the canned reply because no endpoint answered", ("kind",))
+ASR_QUEUE_DEPTH = REGISTRY.gauge(
+    "sales_bot_asr_queue_depth", "Utterances waiting for a transcription worker")
+ASR_BATCH_SIZE = REGISTRY.histogram(
+    "sales_bot_asr_batch_size", "Utterances per transcription batch", buckets=(1, 2, 4, 8, 16, 32))
+ASR_REAL_TIME_FACTOR = REGISTRY.histogram(
+    "sales_bot_asr_real_time_factor", "Transcription time over audio duration, per batch",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0))
+ASR_SECONDS = REGISTRY.histogram(
+    "sales_bot_asr_seconds", "Time from queueing an utterance to its transcript")
+CALL_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "sales_bot_call_lock_wait_seconds", "Time a turn waited for its call's lock")
+CALL_LOCK_TIMEOUTS = REGISTRY.counter(
+    "sales_bot_call_lock_timeouts_total", "Turns that gave up waiting for their call's lock")
+HISTORY_CONFLICTS = REGISTRY.counter(
+    "sales_bot_history_conflicts_total", "Versioned history saves that had to merge a concurrent save")
+TURN_ROUTES = REGISTRY.counter(
+    "sales_bot_turn_routes_total", "Turns by model tier and the rule that picked it", ("tier", "reason"))
+TURN_TIER_SECONDS = REGISTRY.histogram(
+    "sales_bot_turn_tier_seconds", "Reply generation time per model tier (first token for streams)", ("tier",))
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    "sales_bot_admission_queue_depth", "Replies waiting for a generation slot")
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "sales_bot_admission_wait_seconds", "Time a reply waited for a generation slot")
+ADMISSION_SHED = REGISTRY.counter(
+    "sales_bot_admission_shed_total", "Turns over the generation budget, deferred to /pending-reply or rejected",
+    ("outcome",))
+CRM_LOOKUPS = REGISTRY.counter(
+    "sales_bot_crm_lookups_total", "Profile lookups: cache hits, profiles bound at dial time, CRM misses and errors",
+    ("outcome",))
+CRM_HIT_RATE = REGISTRY.gauge(
+    "sales_bot_crm_cache_hit_ratio", "Share of profile lookups answered from the cache")
+CRM_REQUEST_SECONDS = REGISTRY.histogram(
+    "sales_bot_crm_request_seconds", "CRM adapter lookup time on a cache miss")
+RESPONSE_CACHE_LOOKUPS = REGISTRY.counter(
+    "sales_bot_response_cache_lookups_total", "Reply cache lookups by outcome (hit, miss)", ("outcome",))
+RESPONSE_CACHE_HIT_RATE = REGISTRY.gauge(
+    "sales_bot_response_cache_hit_ratio", "Share of reply cache lookups answered from the cache")
+RESPONSE_CACHE_ENTRIES = REGISTRY.gauge(
+    "sales_bot_response_cache_entries", "Replies held in the reply cache")
+OUTBOX_QUEUE_DEPTH = REGISTRY.gauge(
+    "sales_bot_outbox_queue_depth", "Finished conversations waiting to be uploaded to the backend")
+OUTBOX_DEAD_LETTERS = REGISTRY.gauge(
+    "sales_bot_outbox_dead_letters", "Conversations given up on, kept in the outbox_dead table")
+OUTBOX_UPLOADS = REGISTRY.counter(
+    "sales_bot_outbox_uploads_total", "Outbox results: conversations uploaded or dead-lettered, failed attempts",
+    ("outcome",))
+INTRO_CACHE_EVENTS = REGISTRY.counter(
+    "sales_bot_intro_cache_total", "Pre-generated introductions (pregenerated, failed) and first lookups "
+    "(ready, waited, missed)", ("outcome",))
+INTRO_READY_RATE = REGISTRY.gauge(
+    "sales_bot_intro_ready_before_answer_ratio", "Share of answered calls whose introduction was ready in time")
+WEBHOOK_DUPLICATES = REGISTRY.counter(
+    "sales_bot_webhook_duplicates_total", "Duplicate webhook requests answered with the first request's TwiML",
+    ("route", "outcome"))
+TUNNEL_RESTARTS = REGISTRY.counter(
+    "sales_bot_tunnel_restarts_total", "ngrok tunnel restarts, by why the old one was replaced", ("reason",))
+SPECULATIONS = REGISTRY.counter(
+    "sales_bot_speculations_total", "Speculative replies by outcome (hit, miss, superseded, discarded, none)",
+    ("outcome",))
+SPECULATION_TOKENS = REGISTRY.counter(
+    "sales_bot_speculation_tokens_total", "Streamed deltas of speculative replies, used or wasted", ("outcome",))
+SPECULATION_SAVED_SECONDS = REGISTRY.histogram(
+    "sales_bot_speculation_saved_seconds", "Generation time already done when the final transcript arrived")
+
+
+def enabled():
+    return config.METRICS_ENABLED
+
+
+class _Span:
+    __slots__ = ("stage", "route", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.route = _route.get()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, route=self.route, stage=self.stage)
+        return False
+
+
+def span(stage):
+    """Time a stage of the current webhook request."""
+    return _Span(stage) if config.METRICS_ENABLED else _NOOP
+
+
+class _CompletionSpan:
+    """Set `usage` from the response; call first_token() when a stream produces its first delta."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.usage = None
+        self._first = None
+
+    def first_token(self):
+        if self._first is None:
+            self._first = time.perf_counter()
+            LLM_FIRST_TOKEN_SECONDS.observe(self._first - self.start, kind=self.kind)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        LLM_SECONDS.observe(time.perf_counter() - self.start, kind=self.kind)
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, GeneratorExit):
+            outcome = "abandoned"
+        else:
+            outcome = "error"
+        LLM_REQUESTS.inc(kind=self.kind, outcome=outcome)
+        if self.usage is not None:
+            LLM_TOKENS.inc(getattr(self.usage, "prompt_tokens", 0) or 0, kind=self.kind, type="prompt")
+            LLM_TOKENS.inc(getattr(self.usage, "completion_tokens", 0) or 0, kind=self.kind, type="completion")
+        return False
+
+
+class _NoopCompletionSpan:
+    usage = None
+
+    def first_token(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_COMPLETION = _NoopCompletionSpan()
+
+
+def completion_span(kind):
+    """Time a chat.completions.create call of the given kind ("response", "stream", "summary")."""
+    return _CompletionSpan(kind) if config.METRICS_ENABLED else _NOOP_COMPLETION
+
+
+def timed(route):
+    """Decorate a webhook handler (sync or async) to time it and label its stages with `route`."""
+    def decorator(handler):
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                if not config.METRICS_ENABLED:
+                    return await handler(*args, **kwargs)
+                token = _route.set(route)
+                start = time.perf_counter()
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception:
+                    REQUEST_ERRORS.inc(route=route)
+                    raise
+                finally:
+                    REQUEST_SECONDS.observe(time.perf_counter() - start, route=route)
+                    _route.reset(token)
+        else:
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                if not config.METRICS_ENABLED:
+                    return handler(*args, **kwargs)
+                token = _route.set(route)
+                start = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                except Exception:
+                    REQUEST_ERRORS.inc(route=route)
+                    raise
+                finally:
+                    REQUEST_SECONDS.observe(time.perf_counter() - start, route=route)
+                    _route.reset(token)
+        return wrapper
+    return decorator
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return REGISTRY.render()
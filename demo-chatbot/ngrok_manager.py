@@ -1,91 +1,265 @@
+"""
+The process-wide ngrok tunnel exposing the webhook server to Twilio.
+
+The tunnel is started once (or an ngrok agent already tunnelling to the port
+is adopted) and its public URL cached, so /trigger-call costs nothing once
+the tunnel is up. Startup polls the agent's local API until the tunnel is
+listed instead of sleeping a fixed time. A background thread health-checks
+the agent every NGROK_HEALTH_INTERVAL seconds and restarts it only when it
+has died or lost its tunnel. Twilio's phone number webhooks are updated only
+when the public URL actually changes; a failed update is retried on the next
+health check or public_url() call.
+
+NGROK_BIN (split like a shell command) and NGROK_API_URL are configurable,
+so a fake tunnel process can stand in for ngrok (see fake_services.py).
+"""
+import time
+import shlex
+import atexit
 import logging
+import threading
 import subprocess
-import time
 import requests
-from twilio.rest import Client
 import config
+from metrics import TUNNEL_RESTARTS
 
 logger = logging.getLogger(__name__)
 
+
+class TunnelManager:
+    def __init__(self, port=None, binary=None, api_url=None, ready_timeout=None, health_interval=None,
+                 update_webhooks=None):
+        self.port = port or config.FLASK_PORT
+        self.binary = shlex.split(binary or config.NGROK_BIN)
+        self.api_url = (api_url or config.NGROK_API_URL).rstrip("/")
+        self.ready_timeout = ready_timeout or config.NGROK_READY_TIMEOUT
+        self.health_interval = health_interval or config.NGROK_HEALTH_INTERVAL
+        self.update_webhooks = update_webhooks or update_twilio_webhooks
+        self._lock = threading.Lock()
+        self._process = None
+        self._url = None
+        self._webhook_url = None  # public URL the Twilio webhooks point at
+        self._stop = threading.Event()
+        self._checker = None
+        self._stats = {"starts": 0, "adopted": 0, "restarts": 0, "health_failures": 0, "webhook_updates": 0}
+
+    def public_url(self):
+        """The tunnel's public https URL, starting the tunnel if it is not running (None if it cannot start)."""
+        with self._lock:
+            started = not self._url or (self._process is not None and self._process.poll() is not None)
+            if started:
+                restart = self._url is not None
+                self._url = None
+                try:
+                    self._start()
+                except Exception as e:
+                    logger.error(f"Error starting ngrok: {e}")
+                    return None
+                if restart:
+                    self._count_restart("exited")
+            url = self._url
+        # No-op unless the URL changed or an earlier update failed
+        self._sync_webhooks(url)
+        if started:
+            self._start_checker()
+        return url
+
+    def current_url(self):
+        """The tunnel's public URL if it is up, without starting it."""
+        with self._lock:
+            return self._url
+
+    def check(self):
+        """Health-check the tunnel once, restarting it if the agent died or no longer lists the tunnel."""
+        with self._lock:
+            if self._url is None:
+                return False
+            exited = self._process is not None and self._process.poll() is not None
+            if exited or self._tunnel_url() != self._url:
+                self._stats["health_failures"] += 1
+                logger.warning(f"ngrok tunnel {self._url} is {'gone' if exited else 'unhealthy'}; restarting")
+                self._terminate()
+                self._url = None
+                try:
+                    self._start()
+                except Exception as e:
+                    logger.error(f"Error restarting ngrok: {e}")
+                    return False
+                self._count_restart("exited" if exited else "unhealthy")
+            url = self._url
+        self._sync_webhooks(url)
+        return True
+
+    def stop(self):
+        """Stop the health checks and the ngrok process this manager started."""
+        self._stop.set()
+        with self._lock:
+            self._terminate()
+            self._url = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, url=self._url, pid=self._process.pid if self._process else None)
+
+    # --- internals (called with the lock held, except _sync_webhooks) ------
+
+    def _start(self):
+        url = self._tunnel_url()
+        if url:
+            # An agent from an earlier run (or started by hand) already tunnels to our port
+            logger.info(f"Using the running ngrok tunnel {url}")
+            self._url = url
+            self._stats["adopted"] += 1
+            return
+
+        logger.info(f"Starting ngrok tunnel to port {self.port}...")
+        # Output is discarded: an unread pipe would eventually block the agent
+        self._process = subprocess.Popen(self.binary + ["http", str(self.port)],
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._stats["starts"] += 1
+        deadline = time.monotonic() + self.ready_timeout
+        delay = 0.05
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"ngrok exited with status {self._process.returncode}")
+            url = self._tunnel_url()
+            if url:
+                logger.info(f"Ngrok tunnel established: {url}")
+                self._url = url
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        self._terminate()
+        raise TimeoutError(f"no https tunnel listed by {self.api_url} after {self.ready_timeout}s")
+
+    def _tunnel_url(self):
+        """The https public URL the agent lists for our port, or None."""
+        try:
+            response = requests.get(f"{self.api_url}/api/tunnels", timeout=2)
+            response.raise_for_status()
+            tunnels = response.json().get("tunnels", [])
+        except (requests.RequestException, ValueError):
+            return None
+        for tunnel in tunnels:
+            addr = str((tunnel.get("config") or {}).get("addr", ""))
+            if tunnel.get("proto") == "https" and addr.rstrip("/").endswith(f":{self.port}"):
+                return tunnel.get("public_url")
+        return None
+
+    def _terminate(self):
+        process, self._process = self._process, None
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _count_restart(self, reason):
+        self._stats["restarts"] += 1
+        if config.METRICS_ENABLED:
+            TUNNEL_RESTARTS.inc(reason=reason)
+
+    def _sync_webhooks(self, url):
+        if url is None or url == self._webhook_url:
+            return
+        if self.update_webhooks(url):
+            with self._lock:
+                self._webhook_url = url
+                self._stats["webhook_updates"] += 1
+
+    def _start_checker(self):
+        with self._lock:
+            if self._checker is not None or self.health_interval <= 0:
+                return
+            self._checker = threading.Thread(target=self._check_loop, name="ngrok-health", daemon=True)
+            self._checker.start()
+
+    def _check_loop(self):
+        while not self._stop.wait(self.health_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error checking the ngrok tunnel: {e}")
+
+
+_tunnel = None
+_tunnel_lock = threading.Lock()
+
+
+def get_tunnel():
+    """Return the process-wide tunnel manager; its ngrok process is stopped at exit."""
+    global _tunnel
+    if _tunnel is None:
+        with _tunnel_lock:
+            if _tunnel is None:
+                _tunnel = TunnelManager()
+                atexit.register(_tunnel.stop)
+    return _tunnel
+
+
+def public_base_url():
+    """
+    PUBLIC_BASE_URL, or else the URL of this process's tunnel if it is up;
+    None when neither is known. Never starts a tunnel.
+    """
+    if config.PUBLIC_BASE_URL:
+        return config.PUBLIC_BASE_URL.rstrip("/")
+    tunnel = _tunnel
+    return tunnel.current_url() if tunnel is not None else None
+
+
 def start_ngrok():
     """
-    Start ngrok tunnel in the simplest way possible.
-    
+    Return the public ngrok URL, starting the tunnel on first use.
+
     Returns:
-        str: The public ngrok URL
+        str: The public ngrok URL, or None if the tunnel cannot be started
     """
-    try:
-        # Start ngrok in a subprocess
-        logger.info("Starting ngrok tunnel...")
-        ngrok_process = subprocess.Popen(
-            ["ngrok", "http", str(config.FLASK_PORT)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        
-        # Give ngrok a moment to start
-        time.sleep(2)
-        
-        # Get the public URL from ngrok API
-        response = requests.get("http://localhost:4040/api/tunnels")
-        tunnels = response.json()["tunnels"]
-        
-        if not tunnels:
-            logger.error("No ngrok tunnels found")
-            return None
-            
-        # Get the HTTPS tunnel URL
-        public_url = None
-        for tunnel in tunnels:
-            if tunnel["proto"] == "https":
-                public_url = tunnel["public_url"]
-                break
-        
-        if not public_url:
-            logger.error("No HTTPS tunnel found")
-            return None
-            
-        logger.info(f"Ngrok tunnel established: {public_url}")
-        
-        # Update Twilio webhook URLs
-        update_twilio_webhooks(public_url)
-        
-        return public_url
-        
-    except Exception as e:
-        logger.error(f"Error starting ngrok: {e}")
-        return None
+    return get_tunnel().public_url()
+
 
 def update_twilio_webhooks(public_url):
     """
     Update Twilio phone number webhooks to use the ngrok URL.
-    
+
     Args:
         public_url: The public ngrok URL
+
+    Returns:
+        bool: Whether the webhooks now point at public_url
     """
     try:
-        # Initialize Twilio client
-        client = Client(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN)
-        
+        from twilio_handler import get_twilio_client
+
+        client = get_twilio_client()
+
         # Get the phone number
         phone_numbers = client.incoming_phone_numbers.list(
             phone_number=config.TWILIO_PHONE_NUMBER
         )
-        
+
         if not phone_numbers:
             logger.warning(f"Phone number {config.TWILIO_PHONE_NUMBER} not found in your Twilio account")
-            return
-        
-        # Update the voice URL for the phone number
+            return False
+
+        # Update the voice URL for the phone number, unless it already points here (e.g. a reserved domain)
         phone_number = phone_numbers[0]
+        if phone_number.voice_url == f"{public_url}/voice" and phone_number.status_callback == f"{public_url}/call-status":
+            logger.info(f"Twilio webhooks for {config.TWILIO_PHONE_NUMBER} already point at {public_url}")
+            return True
         phone_number.update(
             voice_url=f"{public_url}/voice",
             voice_method="POST",
             status_callback=f"{public_url}/call-status",
             status_callback_method="POST"
         )
-        
+
         logger.info(f"Updated Twilio webhooks for {config.TWILIO_PHONE_NUMBER}")
-        
+        return True
+
     except Exception as e:
         logger.error(f"Error updating Twilio webhooks: {e}")
+        return False
@@ -0,0 +1,300 @@
+"""
+Durable outbox for uploading finished conversations to the Node backend.
+
+Conversations are written to a SQLite outbox and a background worker posts
+them in batches to /api/save-conversations over a pooled HTTP session,
+retrying failures with exponential backoff. A conversation the backend
+rejects (a 4xx other than 408/429, found by re-posting a rejected batch one
+conversation at a time), one that cannot be serialized, or one that still
+fails after OUTBOX_MAX_ATTEMPTS attempts is moved to the outbox_dead table
+instead of being retried forever. Pending uploads survive restarts and
+several processes can share one outbox (rows are claimed with a lease).
+Queue depth, dead letters and upload outcomes are exported on /metrics.
+System prompts are uploaded as prompt template references; the templates
+themselves are registered with the backend once per process, or expanded if
+the backend has no template registry.
+"""
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+import requests
+import config
+from prompts import referenced, export, expand
+from metrics import OUTBOX_QUEUE_DEPTH, OUTBOX_DEAD_LETTERS, OUTBOX_UPLOADS
+
+logger = logging.getLogger(__name__)
+
+# Client errors that are worth retrying: request timeout, too early, too many requests
+RETRYABLE_STATUS = {408, 425, 429}
+
+
+def is_retryable(error):
+    """False for errors retrying cannot fix: a 4xx from the backend, or a payload that cannot be sent."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return not (400 <= status < 500) or status in RETRYABLE_STATUS
+    return isinstance(error, requests.RequestException)
+
+
+class Outbox:
+    def __init__(self, path=None, backend_url=None, batch_size=None, batch_wait=None,
+                 max_backoff=None, timeout=None, max_attempts=None):
+        self.path = path or config.OUTBOX_DB
+        self.backend_url = (backend_url or config.NODE_BACKEND_URL).rstrip("/")
+        self.batch_size = batch_size or config.OUTBOX_BATCH_SIZE
+        self.batch_wait = config.OUTBOX_BATCH_WAIT if batch_wait is None else batch_wait
+        self.max_backoff = max_backoff or config.OUTBOX_MAX_BACKOFF
+        self.timeout = timeout or config.OUTBOX_TIMEOUT
+        self.max_attempts = max_attempts or config.OUTBOX_MAX_ATTEMPTS
+        self.session = requests.Session()
+        self._bulk_supported = True
+        self._templates_supported = True
+        self._synced_templates = set()
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {"enqueued": 0, "uploaded": 0, "batches": 0, "failed_attempts": 0, "dead_lettered": 0,
+                       "last_error": None}
+        self._started = time.monotonic()
+        self._worker = None
+        self._connection()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, call_sid TEXT, payload TEXT, "
+                "attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0, claimed_until REAL DEFAULT 0, created REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox_dead ("
+                "id INTEGER PRIMARY KEY, call_sid TEXT, payload TEXT, attempts INTEGER, error TEXT, "
+                "created REAL, failed REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._worker:
+            self._worker.join(timeout)
+
+    def enqueue(self, call_sid, conversation, user_info=None):
+        """Persist a finished conversation for upload; returns immediately."""
+        payload = json.dumps({"call_sid": call_sid, "user_info": user_info, "conversation": conversation})
+        self._connection().execute(
+            "INSERT INTO outbox (call_sid, payload, created) VALUES (?, ?, ?)", (call_sid, payload, time.time())
+        )
+        self._count("enqueued")
+        self._wake.set()
+
+    def depth(self):
+        return self._connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def dead_letters(self):
+        """Number of conversations given up on, kept in outbox_dead for inspection or replay."""
+        return self._connection().execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        elapsed = time.monotonic() - self._started
+        stats["queue_depth"] = self.depth()
+        stats["dead_letters"] = self.dead_letters()
+        stats["uploaded_per_second"] = stats["uploaded"] / elapsed if elapsed else 0.0
+        return stats
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+        if config.METRICS_ENABLED and key in ("uploaded", "failed_attempts", "dead_lettered"):
+            OUTBOX_UPLOADS.inc(amount, outcome=key)
+
+    def _export_depth(self):
+        if config.METRICS_ENABLED:
+            OUTBOX_QUEUE_DEPTH.set(self.depth())
+            OUTBOX_DEAD_LETTERS.set(self.dead_letters())
+
+    def _claim(self):
+        """Lease up to batch_size due rows to this worker."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, call_sid, payload, attempts FROM outbox "
+                "WHERE next_attempt <= ? AND claimed_until <= ? ORDER BY id LIMIT ?",
+                (now, now, self.batch_size),
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET claimed_until = ? WHERE id = ?",
+                    [(now + self.timeout * 2, row[0]) for row in rows],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _sync_templates(self, payloads):
+        """Register the prompt templates the payloads reference; False if the backend has no registry."""
+        if not self._templates_supported:
+            return False
+        missing = {template_id for payload in payloads for template_id in referenced(payload["conversation"])}
+        missing -= self._synced_templates
+        if missing:
+            res = self.session.post(f"{self.backend_url}/api/prompt-templates",
+                                    json={"templates": export(missing)}, timeout=self.timeout)
+            if res.status_code == 404:
+                logger.warning("Backend has no prompt template registry; uploading expanded prompts")
+                self._templates_supported = False
+                return False
+            res.raise_for_status()
+            self._synced_templates |= missing
+        return True
+
+    def _post(self, payloads):
+        if not self._sync_templates(payloads):
+            payloads = [dict(payload, conversation=expand(payload["conversation"])) for payload in payloads]
+        if self._bulk_supported:
+            res = self.session.post(f"{self.backend_url}/api/save-conversations",
+                                    json={"conversations": payloads}, timeout=self.timeout)
+            if res.status_code != 404:
+                res.raise_for_status()
+                return
+            logger.warning("Backend has no bulk endpoint; uploading conversations one by one")
+            self._bulk_supported = False
+        for payload in payloads:
+            self.session.post(f"{self.backend_url}/api/save-conversation",
+                              json=payload, timeout=self.timeout).raise_for_status()
+
+    def _upload_batch(self):
+        rows = self._claim()
+        if not rows:
+            return 0
+        batch, poisoned = [], []
+        for row in rows:
+            try:
+                batch.append((row, json.loads(row[2])))
+            except ValueError as e:
+                poisoned.append(row)
+                error = e
+        if poisoned:
+            self._failed(poisoned, error)
+        if not batch:
+            return 0
+
+        try:
+            self._post([payload for _, payload in batch])
+        except Exception as e:
+            if is_retryable(e) or len(batch) == 1:
+                self._failed([row for row, _ in batch], e)
+                return 0
+            # One rejected conversation fails the whole request: find it by posting them one at a time
+            logger.warning(f"Backend rejected a batch of {len(batch)} conversations ({e}); uploading one by one")
+            uploaded = 0
+            for row, payload in batch:
+                try:
+                    self._post([payload])
+                except Exception as single_error:
+                    self._failed([row], single_error)
+                else:
+                    self._delete([row])
+                    uploaded += 1
+            return uploaded
+
+        self._delete([row for row, _ in batch])
+        return len(batch)
+
+    def _delete(self, rows):
+        self._connection().executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in rows])
+        self._count("uploaded", len(rows))
+        self._count("batches")
+        logger.info(f"✅ Uploaded {len(rows)} conversations to backend")
+
+    def _failed(self, rows, error):
+        """Schedule a retry with backoff, or dead-letter rows that cannot succeed or are out of attempts."""
+        self._count("failed_attempts")
+        with self._stats_lock:
+            self._stats["last_error"] = str(error)
+        retryable = is_retryable(error)
+        retries, dead = [], []
+        for row_id, call_sid, payload, attempts in rows:
+            if retryable and attempts + 1 < self.max_attempts:
+                backoff = min(self.max_backoff, 2 ** attempts) * random.uniform(0.5, 1.0)
+                retries.append((attempts + 1, time.time() + backoff, row_id))
+            else:
+                dead.append((row_id, call_sid, payload, attempts + 1))
+        conn = self._connection()
+        if retries:
+            conn.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, claimed_until = 0 WHERE id = ?", retries
+            )
+            logger.error(f"❌ Error uploading {len(retries)} conversations (will retry): {error}")
+        if dead:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO outbox_dead (id, call_sid, payload, attempts, error, created, failed) "
+                    "SELECT id, call_sid, payload, ?, ?, created, ? FROM outbox WHERE id = ?",
+                    [(attempts, str(error), now, row_id) for row_id, _, _, attempts in dead],
+                )
+                conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id, _, _, _ in dead])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._count("dead_lettered", len(dead))
+            reason = f"after {self.max_attempts} attempts" if retryable else "not retryable"
+            logger.error(f"❌ Gave up uploading calls {', '.join(row[1] or '?' for row in dead)} ({reason}): {error}")
+
+    def _next_due_in(self):
+        row = self._connection().execute("SELECT MIN(MAX(next_attempt, claimed_until)) FROM outbox").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                uploaded = self._upload_batch()
+                self._export_depth()
+                if uploaded:
+                    continue
+                wait = self._next_due_in()
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+                wait = 1.0
+            self._wake.wait(60.0 if wait is None else min(wait, 60.0))
+            self._wake.clear()
+            # Let a few more finished calls arrive so they share one request
+            if not self._stop.is_set() and self.batch_wait:
+                self._stop.wait(self.batch_wait)
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """Return the process-wide outbox, starting its upload worker on first use."""
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = Outbox().start()
+    return _outbox
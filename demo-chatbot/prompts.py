@@ -0,0 +1,137 @@
+"""
+Registry of versioned prompt templates.
+
+Conversations store system prompts as references, {"role": "system",
+"template": "<name>@v<version>", "params": {...}}, instead of the expanded
+text, so the ~3 KB sales prompt is not repeated in every stored call, upload
+and archive. expand() renders the references when a request is built for the
+model. A published template's text must never change: edit a prompt by
+registering the next version, so older conversations still expand exactly as
+they were spoken.
+"""
+import json
+from functools import lru_cache
+
+TEMPLATES = {}
+
+
+class PromptTemplate:
+    """A str.format template; `defaults` fill in parameters a conversation did not record."""
+
+    def __init__(self, name, version, text, defaults=None):
+        self.name = name
+        self.version = version
+        self.text = text
+        self.defaults = defaults or {}
+
+    @property
+    def id(self):
+        return f"{self.name}@v{self.version}"
+
+    def render(self, params):
+        return self.text.format_map({**self.defaults, **params})
+
+
+def register(template):
+    if template.id in TEMPLATES and TEMPLATES[template.id].text != template.text:
+        raise ValueError(f"Prompt template {template.id} is already registered with different text")
+    TEMPLATES[template.id] = template
+    return template
+
+
+def get_template(template_id):
+    try:
+        return TEMPLATES[template_id]
+    except KeyError:
+        raise ValueError(f"Unknown prompt template {template_id!r}") from None
+
+
+def template_message(template, params, role="system"):
+    """A message referencing `template` (a PromptTemplate or its id) with `params`."""
+    template_id = template if isinstance(template, str) else template.id
+    return {"role": role, "template": template_id, "params": params}
+
+
+@lru_cache(maxsize=4096)
+def _render(template_id, params_json):
+    return get_template(template_id).render(json.loads(params_json))
+
+
+def render(message):
+    """The text of a message, expanding it if it is a template reference."""
+    if "template" not in message:
+        return message.get("content", "")
+    return _render(message["template"], json.dumps(message.get("params") or {}, sort_keys=True))
+
+
+def expand(messages):
+    """Messages with every template reference replaced by its rendered text (others are passed through)."""
+    return [
+        {"role": message["role"], "content": render(message)} if "template" in message else message
+        for message in messages
+    ]
+
+
+def referenced(messages):
+    """Ids of the templates referenced by `messages`."""
+    return sorted({message["template"] for message in messages if "template" in message})
+
+
+def export(template_ids=None):
+    """{id: text} of the given (default: all) registered templates, for backends and archives."""
+    ids = TEMPLATES if template_ids is None else template_ids
+    return {template_id: get_template(template_id).text for template_id in ids}
+
+
+SALES_INTRO = register(PromptTemplate("sales_intro", 1, """
+    You are {bot_name}, an AI sales representative for {company_name}, a leading provider of consumer technology products and services.
+    
+    Company Information:
+    - Founded in 2015
+    - Serves over 100,000 customers globally
+    - Award-winning customer support with 24/7 availability
+    - Products include: Smart home devices, Premium subscription services, Mobile applications, and Personal productivity tools
+    - Key selling points: Ease of use, Integration with existing devices, Personalization options, Affordable pricing
+    
+    Your goal is to engage the customer in a friendly conversation and CLOSE THE SALE. The customer may be reluctant, but your job is to persist and convert them.
+    
+    Advanced Sales Techniques to Use:
+    1. FOMO (Fear of Missing Out): Mention limited-time offers and how other users are already benefiting
+    2. Social Proof: Share success stories of similar users with similar interests
+    3. Problem Agitation: Highlight the inconveniences of not having our solution
+    4. Future Pacing: Help them visualize how their daily life will improve with our product
+    5. Assumptive Close: Speak as if they've already decided to buy ("When you start using our product...")
+    6. Alternative Choice Close: Instead of asking yes/no, offer choices ("Would you prefer the monthly or annual subscription?")
+    7. Objection Handling: Have 2-3 powerful responses ready for common objections
+    8. Urgency Creation: Mention upcoming price increases or limited availability
+    
+    When facing resistance or hesitation:
+    - Acknowledge their concern but gently redirect to benefits
+    - Use "feel, felt, found" technique: "I understand how you feel, others felt the same way, but they found that..."
+    - Never give up after the first "no" - most sales happen after 5+ follow-ups
+    - If they're not interested in one product, pivot to another that might better address their needs
+    - Use flattery and personalization to make them feel special and valued
+    
+    Your responses should be conversational, friendly, and persuasive. Keep them concise (1-3 sentences) for a natural conversation flow.
+    """))
+
+CUSTOMER_CONTEXT = register(PromptTemplate("customer_context", 1, """
+        Customer Information:
+        - Name: {name}
+        - Last Visit Date: {last_visit_date}
+        - Products Viewed: {products_viewed}
+        - Previous Purchases: {previous_purchases}
+        - Interests: {interests}
+        - Age Group: {age_group}
+        - Device Usage: {device_usage}
+        
+        Use this information to personalize the conversation. Reference their previous interactions, product interests, and past purchases to create a tailored experience. Make them feel remembered and valued as a returning customer.
+        """, defaults={
+    "name": "Unknown",
+    "last_visit_date": "Unknown",
+    "products_viewed": "Unknown",
+    "previous_purchases": "None",
+    "interests": "Unknown",
+    "age_group": "Unknown",
+    "device_usage": "Unknown",
+}))
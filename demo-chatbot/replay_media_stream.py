@@ -0,0 +1,88 @@
+"""
+Replay recorded audio through /media-stream as if it came from a Twilio call.
+
+Each WAV file (any sample rate, 16-bit PCM) is one caller utterance: it is
+resampled to 8 kHz, μ-law encoded and sent in 20 ms media messages, followed by
+a second of silence so the endpointer closes the utterance. The stream is
+started with replay=true, so the server sends its replies back over the
+websocket instead of updating a live call.
+
+    python app.py --mode server --server asgi &
+    python replay_media_stream.py hello.wav price_question.wav goodbye.wav --realtime
+"""
+import json
+import time
+import wave
+import base64
+import asyncio
+import argparse
+import numpy as np
+import websockets
+from audio import STREAM_RATE, FRAME_SAMPLES, resample, ulaw_encode
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit PCM")
+        frames = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+        if f.getnchannels() > 1:
+            frames = frames.reshape(-1, f.getnchannels()).mean(axis=1)
+        return resample(frames, f.getframerate(), STREAM_RATE)
+
+
+def media_messages(samples, stream_sid):
+    payload = ulaw_encode(samples)
+    for offset in range(0, len(payload), FRAME_SAMPLES):
+        chunk = payload[offset:offset + FRAME_SAMPLES]
+        yield json.dumps({
+            "event": "media",
+            "streamSid": stream_sid,
+            "media": {"track": "inbound", "payload": base64.b64encode(chunk).decode("ascii")},
+        })
+
+
+async def replay(url, paths, call_sid, realtime, reply_timeout):
+    stream_sid = f"MZ{call_sid[2:]}"
+    silence = np.zeros(STREAM_RATE, dtype=np.float32)
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+        await ws.send(json.dumps({"event": "start", "streamSid": stream_sid, "start": {
+            "callSid": call_sid, "streamSid": stream_sid, "tracks": ["inbound"],
+            "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": STREAM_RATE, "channels": 1},
+            "customParameters": {"replay": "true"},
+        }}))
+
+        for path in paths:
+            speech = read_wav(path)
+            for message in media_messages(np.concatenate((speech, silence)), stream_sid):
+                await ws.send(message)
+                if realtime:
+                    await asyncio.sleep(FRAME_SAMPLES / STREAM_RATE)
+            sent = time.perf_counter()
+            try:
+                reply = json.loads(await asyncio.wait_for(ws.recv(), reply_timeout))
+            except asyncio.TimeoutError:
+                print(f"{path}: no reply within {reply_timeout}s")
+                continue
+            print(f"{path}: heard {reply['transcript']!r}")
+            print(f"  reply after {(time.perf_counter() - sent) * 1000:.0f}ms: {reply['reply']}")
+            if reply.get("hangup"):
+                break
+
+        await ws.send(json.dumps({"event": "stop", "streamSid": stream_sid, "stop": {"callSid": call_sid}}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay WAV files through the media stream endpoint")
+    parser.add_argument("wavs", nargs="+", help="One WAV file per caller utterance")
+    parser.add_argument("--url", default="ws://127.0.0.1:5000/media-stream")
+    parser.add_argument("--call-sid", default="CA" + "0" * 31 + "1")
+    parser.add_argument("--realtime", action="store_true", help="Pace frames at 20 ms, like a live call")
+    parser.add_argument("--reply-timeout", type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(replay(args.url, args.wavs, args.call_sid, args.realtime, args.reply_timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Opt-in cache of bot replies to common short utterances.
+
+Replies are keyed by the normalized utterance, the conversation stage and
+hesitation flag, and a fingerprint of everything the reply is personalized
+from: the whole customer profile and the call's system messages (prompt,
+visit history, commitments). A reply is therefore only replayed to callers it
+was written for, e.g. "who is this?" early in calls with the same profile, or
+from a caller who calls back. Closings summarize a single call and are never
+cached. Hits, misses, the hit rate and the number of entries are exported on
+/metrics.
+"""
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+import config
+from metrics import RESPONSE_CACHE_LOOKUPS, RESPONSE_CACHE_HIT_RATE, RESPONSE_CACHE_ENTRIES
+
+_NON_WORD = re.compile(r"[^\w\s']+")
+
+
+def normalize_utterance(text):
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+def conversation_stage(conversation):
+    user_turns = sum(1 for msg in conversation if msg["role"] == "user")
+    if user_turns <= 1:
+        return "opening"
+    if user_turns <= 4:
+        return "discovery"
+    return "late"
+
+
+def personalization_fingerprint(conversation, user_info):
+    """Short hash of the customer profile and the call's system messages."""
+    system = [msg for msg in conversation if msg["role"] == "system"]
+    payload = json.dumps([user_info or {}, system], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ResponseCache:
+    """LRU cache of replies with a TTL and per-key hit counts."""
+
+    def __init__(self, max_entries=None, ttl=None, max_words=None):
+        self.max_entries = max_entries or config.RESPONSE_CACHE_SIZE
+        self.ttl = config.RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.max_words = config.RESPONSE_CACHE_MAX_WORDS if max_words is None else max_words
+        self._entries = OrderedDict()
+        self._key_hits = Counter()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def key(self, kind, utterance, conversation, user_info, hesitation=False):
+        """Cache key for a turn, or None if the utterance is too long to be worth caching."""
+        normalized = normalize_utterance(utterance)
+        if len(normalized.split()) > self.max_words:
+            return None
+        return (kind, normalized, conversation_stage(conversation), hesitation,
+                personalization_fingerprint(conversation, user_info))
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self._misses += 1
+                entry = None
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                self._key_hits[key] += 1
+            hits, lookups, entries = self._hits, self._hits + self._misses, len(self._entries)
+        if config.METRICS_ENABLED:
+            RESPONSE_CACHE_LOOKUPS.inc(outcome="hit" if entry else "miss")
+            RESPONSE_CACHE_HIT_RATE.set(hits / lookups)
+            RESPONSE_CACHE_ENTRIES.set(entries)
+        return entry[1] if entry else None
+
+    def put(self, key, text):
+        if key is None or not text:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._key_hits.pop(evicted, None)
+
+    def stats(self, top=10):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "top_keys": [("/".join(map(str, key)), hits) for key, hits in self._key_hits.most_common(top)],
+            }
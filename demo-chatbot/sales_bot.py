@@ -1,150 +1,500 @@
+import time
+import asyncio
 import logging
-from openai import OpenAI
 import config
 from conversation import load_conversation_history, save_conversation_history, detect_hesitation
+from streaming import split_sentences, end_reply_stream
+from prompts import expand
+from call_lock import call_lock, acall_lock
+from llm_router import ModelRouter, endpoints_from_config
+from context_window import ContextWindow
+from crm import get_crm
+from intro_cache import IntroCache
+from speculation import Speculator
+from turn_router import TurnRouter
+from response_cache import ResponseCache
+from metrics import span, completion_span, enabled as metrics_enabled
 
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client once
-client = OpenAI(
-    base_url=config.API_BASE_URL,
-    api_key=config.API_KEY,
+# Model requests go through the router (one or more endpoints, per-turn deadline, hedging);
+# the async methods serve the ASGI webhook server
+router = ModelRouter()
+# Cheaper model for simple turns when tiered routing is on (None: simple turns use the main endpoints)
+small_router = (ModelRouter(endpoints_from_config(config.TURN_SMALL_ENDPOINTS or None, config.TURN_SMALL_MODEL or None))
+                if config.TURN_SMALL_MODEL or config.TURN_SMALL_ENDPOINTS else None)
+
+HESITATION_PROMPT_MARKER = "The customer is showing hesitation"
+
+FALLBACK_RESPONSE = "I'm sorry, I couldn't generate a response at this time. Please try again."
+FALLBACK_CLOSING = (
+    "Thank you for your time today. If you'd like to try our products, we're offering a special 15% discount for new customers. "
+    "Just visit our website or call us back when you're ready. Have a wonderful day!"
 )
 
 def get_user_info_from_call(call_sid=None, phone_number=None):
-    """Simulate fetching user info from CRM based on phone number or SID."""
-    return {
-        "name": "Michael",
-        "last_visit_date": "April 10, 2025",
-        "products_viewed": "Smart Home Hub, Voice Assistant Speaker",
-        "previous_purchases": "Annual Premium Subscription (expired last month)",
-        "interests": "Home automation, Music streaming, Productivity apps",
-        "age_group": "30-45",
-        "device_usage": "Smartphone, Laptop, Smart TV"
-    }
+    """Fetch user info from the CRM based on phone number or SID (cached per call)."""
+    try:
+        with span("crm_lookup"):
+            return get_crm().get(call_sid, phone_number)
+    except Exception as e:
+        logger.error(f"Error fetching user info for call {call_sid}: {e}")
+        return {}
 
-def generate_response(input_text, call_sid=None, user_info=None):
+def end_call(call_sid):
+    """Release per-call state once a call has completed."""
+    context.forget(call_sid)
+    get_crm().forget(call_sid)
+    introductions.forget(call_sid)
+    speculations.discard(call_sid)
+    end_reply_stream(call_sid)
+
+def _summarize(previous_summary, messages):
+    """Fold older turns (and the previous summary) into a short running summary."""
+    transcript = "\n".join(f"{m['role']}: {m.get('content', '')}" for m in messages)
+    if previous_summary:
+        transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+    with completion_span("summary") as timing:
+        response = router.chat(
+            kind="summary",
+            deadline=config.LLM_SUMMARY_DEADLINE,
+            messages=[
+                {"role": "system", "content": (
+                    "Summarize this part of a sales call in at most 5 short bullet points. Keep the customer's needs, "
+                    "objections, products discussed, offers made and any commitments."
+                )},
+                {"role": "user", "content": transcript},
+            ],
+            temperature=0.2,
+            max_tokens=config.CONTEXT_SUMMARY_MAX_TOKENS
+        )
+        timing.usage = response.usage
+    return response.choices[0].message.content
+
+context = ContextWindow(summarize=_summarize)
+
+def _completion_kwargs(conversation, call_sid, route=None):
+    with span("context_build"):
+        messages = context.build(call_sid, expand(conversation))
+    return dict(
+        messages=messages,
+        temperature=0.7,
+        max_tokens=route.max_tokens if route else 150,
+        top_p=0.9
+    )
+
+def _router_for(route):
+    return small_router if route and route.tier == "small" and small_router else router
+
+def _chat_completion(conversation, call_sid, route=None):
+    kwargs = _completion_kwargs(conversation, call_sid, route)
+    with completion_span("chat") as timing:
+        response = _router_for(route).chat(**kwargs)
+        timing.usage = response.usage
+    return response.choices[0].message.content
+
+async def _achat_completion(conversation, call_sid, route=None):
+    kwargs = _completion_kwargs(conversation, call_sid, route)
+    with completion_span("chat") as timing:
+        response = await _router_for(route).achat(**kwargs)
+        timing.usage = response.usage
+    return response.choices[0].message.content
+
+def _stream_chat_completion(conversation, call_sid, route=None):
+    """Yield the completion text delta by delta as the model produces it."""
+    kwargs = _completion_kwargs(conversation, call_sid, route)
+    if metrics_enabled():
+        # Ask for a final usage chunk so streamed replies are counted too
+        kwargs["stream_options"] = {"include_usage": True}
+    with completion_span("stream") as timing:
+        stream = _router_for(route).stream(**kwargs)
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                timing.usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                timing.first_token()
+                yield chunk.choices[0].delta.content
+
+def _stream_sentences(conversation, call_sid, fallback, deltas=None, route=None):
+    """Yield the reply sentence by sentence; `spoken` collects what was yielded."""
+    spoken = []
     try:
-        logger.info("Generating response...")
+        if deltas is None:
+            deltas = _stream_chat_completion(conversation, call_sid, route)
+        for sentence in split_sentences(deltas):
+            spoken.append(sentence)
+            yield sentence, spoken
+    except Exception as e:
+        logger.error(f"Error in streamed generation: {e}")
+    if not spoken:
+        spoken.append(fallback)
+        yield fallback, spoken
 
+def _response_conversation(input_text, call_sid, user_info):
+    with span("history_load"):
         conversation = load_conversation_history(call_sid, user_info)
 
-        if detect_hesitation(input_text):
-            conversation.append({
-                "role": "system",
-                "content": (
-                    "The customer is showing hesitation. Use flattery and personalization to make them feel special. "
-                    "Compliment their taste, insight, or decision-making process. Focus on how they specifically will benefit "
-                    "from our product in ways that align with their interests and lifestyle. Use phrases like "
-                    "'Someone with your taste would appreciate...' or 'Given your interest in "
-                    f"{user_info.get('interests', 'technology')}, you'd especially enjoy...'."
-                )
-            })
-
+    with span("hesitation_detection"):
+        hesitating = detect_hesitation(input_text)
+    if hesitating:
         conversation.append({
-            "role": "user",
-            "content": input_text
+            "role": "system",
+            "content": (
+                f"{HESITATION_PROMPT_MARKER}. Use flattery and personalization to make them feel special. "
+                "Compliment their taste, insight, or decision-making process. Focus on how they specifically will benefit "
+                "from our product in ways that align with their interests and lifestyle. Use phrases like "
+                "'Someone with your taste would appreciate...' or 'Given your interest in "
+                f"{(user_info or {}).get('interests', 'technology')}, you'd especially enjoy...'."
+            )
         })
 
-        response = client.chat.completions.create(
-            messages=conversation,
-            model=config.MODEL_NAME,
-            temperature=0.7,
-            max_tokens=150,
-            top_p=0.9
-        )
+    conversation.append({
+        "role": "user",
+        "content": input_text
+    })
+    return conversation
 
-        result = response.choices[0].message.content
+responses = ResponseCache()
 
-        conversation.append({
-            "role": "assistant",
-            "content": result
-        })
+def _response_cache_key(kind, input_text, conversation, user_info):
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+    hesitation = any(
+        msg["role"] == "system" and HESITATION_PROMPT_MARKER in msg.get("content", "") for msg in conversation
+    )
+    return responses.key(kind, input_text, conversation, user_info, hesitation)
 
-        # Clean up hesitation system message
-        conversation = [
-            msg for msg in conversation
-            if not (msg["role"] == "system" and "The customer is showing hesitation" in msg.get("content", ""))
-        ]
+def _cached_completion(cache_key, conversation, call_sid, route=None):
+    result = responses.get(cache_key)
+    if result is None:
+        result = _chat_completion(conversation, call_sid, route)
+        responses.put(cache_key, result)
+    return result
+
+async def _acached_completion(cache_key, conversation, call_sid, route=None):
+    result = responses.get(cache_key)
+    if result is None:
+        result = await _achat_completion(conversation, call_sid, route)
+        responses.put(cache_key, result)
+    return result
+
+def _stream_cached_sentences(cache_key, conversation, call_sid, fallback, route=None):
+    """Yield (sentence, spoken) from the response cache, or stream and cache the reply."""
+    cached = responses.get(cache_key)
+    if cached is not None:
+        spoken = []
+        for sentence in split_sentences([cached]):
+            spoken.append(sentence)
+            yield sentence, spoken
+        return
+
+    failed = []
+
+    def deltas():
+        # _stream_sentences swallows errors; note them so a reply cut off mid-stream is not cached
+        try:
+            yield from _stream_chat_completion(conversation, call_sid, route)
+        except Exception:
+            failed.append(True)
+            raise
+
+    spoken = []
+    for sentence, spoken in _stream_sentences(conversation, call_sid, fallback, deltas()):
+        yield sentence, spoken
+    if not failed and spoken != [fallback]:
+        responses.put(cache_key, " ".join(spoken))
+
+turns = TurnRouter()
+
+def _route_turn(input_text, conversation):
+    """The model tier for a customer turn (None with tiered routing off: the main model, as always)."""
+    return turns.route(input_text, conversation) if config.TURN_ROUTING else None
+
+def _record_turn(route, start, input_text):
+    if route:
+        turns.record(route, time.perf_counter() - start, input_text)
+
+def _speculative_conversation(input_text, call_sid):
+    return _response_conversation(input_text, call_sid, get_user_info_from_call(call_sid))
+
+def _speculative_deltas(conversation, call_sid):
+    route = _route_turn(conversation[-1]["content"], conversation)
+    if route and route.tier == "template":
+        return  # answered from the template when the final transcript arrives
+    yield from _stream_chat_completion(conversation, call_sid, route)
+
+speculations = Speculator(_speculative_conversation, _speculative_deltas)
+
+def speculate_response(partial_text, call_sid, stability=0.0, sequence=None):
+    """Start generating the reply to a partial transcript in the background, if it looks stable."""
+    if config.SPECULATIVE_REPLIES:
+        speculations.observe(call_sid, partial_text, stability, sequence)
+
+def _speculative_result(input_text, call_sid, conversation):
+    """The speculative reply to the final transcript, or None when there is no matching one."""
+    speculation = config.SPECULATIVE_REPLIES and speculations.claim(call_sid, input_text, conversation)
+    return speculation.result() if speculation else None
+
+def _save_response(conversation, result, call_sid):
+    conversation.append({
+        "role": "assistant",
+        "content": result
+    })
+
+    # Clean up hesitation system message (in place, so the loaded history keeps its version)
+    conversation[:] = [
+        msg for msg in conversation
+        if not (msg["role"] == "system" and HESITATION_PROMPT_MARKER in msg.get("content", ""))
+    ]
+
+    with span("history_save"):
+        save_conversation_history(conversation, call_sid)
+
+def generate_response(input_text, call_sid=None, user_info=None):
+    try:
+        logger.info("Generating response...")
+
+        with call_lock(call_sid):
+            conversation = _response_conversation(input_text, call_sid, user_info)
+            route = _route_turn(input_text, conversation)
+            start = time.perf_counter()
+            if route and route.tier == "template":
+                speculations.discard(call_sid)
+                result = route.reply
+            else:
+                result = _speculative_result(input_text, call_sid, conversation)
+            if result is None:
+                cache_key = _response_cache_key("response", input_text, conversation, user_info)
+                result = _cached_completion(cache_key, conversation, call_sid, route)
+            _record_turn(route, start, input_text)
+            _save_response(conversation, result, call_sid)
 
-        save_conversation_history(call_sid, conversation)
         logger.info(f"Response: {result}")
         return result
 
     except Exception as e:
         logger.error(f"Error in response generation: {e}")
-        return "I'm sorry, I couldn't generate a response at this time. Please try again."
+        return FALLBACK_RESPONSE
 
-def generate_introduction(call_sid=None, user_info=None):
+async def agenerate_response(input_text, call_sid=None, user_info=None):
+    """Async variant of generate_response; history I/O runs off the event loop."""
     try:
+        async with acall_lock(call_sid):
+            conversation = await asyncio.to_thread(_response_conversation, input_text, call_sid, user_info)
+            route = _route_turn(input_text, conversation)
+            start = time.perf_counter()
+            if route and route.tier == "template":
+                speculations.discard(call_sid)
+                result = route.reply
+            else:
+                result = await asyncio.to_thread(_speculative_result, input_text, call_sid, conversation)
+            if result is None:
+                cache_key = _response_cache_key("response", input_text, conversation, user_info)
+                result = await _acached_completion(cache_key, conversation, call_sid, route)
+            _record_turn(route, start, input_text)
+            await asyncio.to_thread(_save_response, conversation, result, call_sid)
+
+        logger.info(f"Response: {result}")
+        return result
+
+    except Exception as e:
+        logger.error(f"Error in response generation: {e}")
+        return FALLBACK_RESPONSE
+
+def stream_response(input_text, call_sid=None, user_info=None):
+    """Like generate_response, but yields the reply sentence by sentence as it is generated."""
+    # The call stays locked until the whole reply is saved, so the next turn sees it
+    with call_lock(call_sid):
+        try:
+            conversation = _response_conversation(input_text, call_sid, user_info)
+        except Exception as e:
+            logger.error(f"Error in response generation: {e}")
+            yield FALLBACK_RESPONSE
+            return
+
+        route = _route_turn(input_text, conversation)
+        start = time.perf_counter()
+        if route and route.tier == "template":
+            speculations.discard(call_sid)
+            sentences = iter([(route.reply, [route.reply])])
+        else:
+            speculation = config.SPECULATIVE_REPLIES and speculations.claim(call_sid, input_text, conversation)
+            if speculation:
+                sentences = _stream_sentences(conversation, call_sid, FALLBACK_RESPONSE, speculation.deltas())
+            else:
+                cache_key = _response_cache_key("response", input_text, conversation, user_info)
+                sentences = _stream_cached_sentences(cache_key, conversation, call_sid, FALLBACK_RESPONSE, route)
+        spoken = []
+        for sentence, spoken in sentences:
+            if start is not None:
+                # Per-tier latency of a streamed reply is the time to its first sentence
+                _record_turn(route, start, input_text)
+                start = None
+            yield sentence
+        _save_response(conversation, " ".join(spoken), call_sid)
+    logger.info(f"Streamed response: {' '.join(spoken)}")
+
+def _introduction_conversation(call_sid, user_info):
+    with span("history_load"):
         conversation = load_conversation_history(call_sid, user_info)
 
-        prompt = f"As {config.BOT_NAME}, generate a warm, personalized introduction to start the sales call."
-        if user_info:
-            prompt += f" Address {user_info.get('name', '')} by name."
-            if user_info.get('last_visit_date'):
-                prompt += f" Mention their last visit on {user_info['last_visit_date']}."
-            if user_info.get('products_viewed'):
-                prompt += f" Reference their interest in {user_info['products_viewed']}."
-            if user_info.get('previous_purchases'):
-                prompt += f" Acknowledge their previous purchase of {user_info['previous_purchases']}."
-        prompt += " Ask an open-ended question about their needs or interests. Be friendly, conversational, and enthusiastic. Keep it concise (2-3 sentences)."
+    prompt = f"As {config.BOT_NAME}, generate a warm, personalized introduction to start the sales call."
+    if user_info:
+        prompt += f" Address {user_info.get('name', '')} by name."
+        if user_info.get('last_visit_date'):
+            prompt += f" Mention their last visit on {user_info['last_visit_date']}."
+        if user_info.get('products_viewed'):
+            prompt += f" Reference their interest in {user_info['products_viewed']}."
+        if user_info.get('previous_purchases'):
+            prompt += f" Acknowledge their previous purchase of {user_info['previous_purchases']}."
+    prompt += " Ask an open-ended question about their needs or interests. Be friendly, conversational, and enthusiastic. Keep it concise (2-3 sentences)."
 
-        conversation.append({
-            "role": "user",
-            "content": prompt
-        })
+    conversation.append({
+        "role": "user",
+        "content": prompt
+    })
+    return conversation
 
-        response = client.chat.completions.create(
-            messages=conversation,
-            model=config.MODEL_NAME,
-            temperature=0.7,
-            max_tokens=150,
-            top_p=0.9
-        )
+def _save_introduction(conversation, introduction, call_sid):
+    # Remove the user-prompt from history and add assistant intro
+    conversation.pop()
+    conversation.append({
+        "role": "assistant",
+        "content": introduction
+    })
+
+    with span("history_save"):
+        save_conversation_history(conversation, call_sid)
 
-        introduction = response.choices[0].message.content
+def _pregenerate_introduction(call_sid, user_info):
+    """Generate an introduction without touching the history; /voice records it when spoken."""
+    user_info = user_info or get_user_info_from_call(call_sid)
+    return _chat_completion(_introduction_conversation(call_sid, user_info), call_sid)
 
-        # Remove the user-prompt from history and add assistant intro
-        conversation.pop()
+introductions = IntroCache(_pregenerate_introduction)
+
+def pregenerate_introduction(call_sid, user_info=None):
+    """Start generating a call's introduction in the background, before the callee answers."""
+    introductions.pregenerate(call_sid, user_info)
+
+def pregenerated_introduction(call_sid):
+    """Return the introduction prepared for this call (waiting briefly if in progress), or None."""
+    return introductions.get(call_sid)
+
+def record_introduction(call_sid, user_info, introduction):
+    """Add a pre-generated introduction to the history, unless the bot has already spoken."""
+    with call_lock(call_sid):
+        with span("history_load"):
+            conversation = load_conversation_history(call_sid, user_info)
+        if any(msg["role"] == "assistant" for msg in conversation):
+            return
         conversation.append({
             "role": "assistant",
             "content": introduction
         })
+        with span("history_save"):
+            save_conversation_history(conversation, call_sid)
 
-        save_conversation_history(call_sid, conversation)
+def _fallback_introduction():
+    return f"Hello, this is {config.BOT_NAME} from {config.COMPANY_NAME}. How can I help you today?"
+
+def generate_introduction(call_sid=None, user_info=None):
+    try:
+        with call_lock(call_sid):
+            conversation = _introduction_conversation(call_sid, user_info)
+            introduction = _chat_completion(conversation, call_sid)
+            _save_introduction(conversation, introduction, call_sid)
+        introductions.remember(call_sid, introduction)
         return introduction
 
     except Exception as e:
         logger.error(f"Error generating introduction: {e}")
-        return f"Hello, this is {config.BOT_NAME} from {config.COMPANY_NAME}. How can I help you today?"
+        return _fallback_introduction()
 
-def generate_closing(call_sid=None, user_info=None):
+async def agenerate_introduction(call_sid=None, user_info=None):
+    """Async variant of generate_introduction."""
     try:
-        conversation = load_conversation_history(call_sid, user_info)
-        conversation.append({
-            "role": "system",
-            "content": (
-                "The conversation is ending. Generate a warm, friendly closing statement that thanks the customer for their time, "
-                "summarizes any commitments or next steps, and includes a clear call to action. Mention a special offer or limited-time "
-                "discount if appropriate to encourage immediate action. Keep it concise and personalized."
-            )
-        })
+        async with acall_lock(call_sid):
+            conversation = await asyncio.to_thread(_introduction_conversation, call_sid, user_info)
+            introduction = await _achat_completion(conversation, call_sid)
+            await asyncio.to_thread(_save_introduction, conversation, introduction, call_sid)
+        introductions.remember(call_sid, introduction)
+        return introduction
+
+    except Exception as e:
+        logger.error(f"Error generating introduction: {e}")
+        return _fallback_introduction()
+
+def stream_introduction(call_sid=None, user_info=None):
+    """Like generate_introduction, but yields the introduction sentence by sentence."""
+    with call_lock(call_sid):
+        try:
+            conversation = _introduction_conversation(call_sid, user_info)
+        except Exception as e:
+            logger.error(f"Error generating introduction: {e}")
+            yield _fallback_introduction()
+            return
 
-        response = client.chat.completions.create(
-            messages=conversation,
-            model=config.MODEL_NAME,
-            temperature=0.7,
-            max_tokens=150,
-            top_p=0.9
+        spoken = []
+        for sentence, spoken in _stream_sentences(conversation, call_sid, _fallback_introduction()):
+            yield sentence
+        _save_introduction(conversation, " ".join(spoken), call_sid)
+    introductions.remember(call_sid, " ".join(spoken))
+
+def _closing_conversation(call_sid, user_info):
+    speculations.discard(call_sid)  # a reply speculated from the goodbye's partials is not needed
+    with span("history_load"):
+        conversation = load_conversation_history(call_sid, user_info)
+    conversation.append({
+        "role": "system",
+        "content": (
+            "The conversation is ending. Generate a warm, friendly closing statement that thanks the customer for their time, "
+            "summarizes any commitments or next steps, and includes a clear call to action. Mention a special offer or limited-time "
+            "discount if appropriate to encourage immediate action. Keep it concise and personalized."
         )
+    })
+    return conversation
+
+def _closing_route():
+    return turns.closing() if config.TURN_ROUTING else None
 
-        closing = response.choices[0].message.content
+def generate_closing(call_sid=None, user_info=None):
+    try:
+        conversation = _closing_conversation(call_sid, user_info)
+        route, start = _closing_route(), time.perf_counter()
+        closing = _chat_completion(conversation, call_sid, route)
+        _record_turn(route, start, "")
         return closing
 
     except Exception as e:
         logger.error(f"Error generating closing: {e}")
-        return (
-            f"Thank you for your time today. If you'd like to try our products, we're offering a special 15% discount for new customers. "
-            "Just visit our website or call us back when you're ready. Have a wonderful day!"
-        )
+        return FALLBACK_CLOSING
+
+async def agenerate_closing(call_sid=None, user_info=None):
+    """Async variant of generate_closing."""
+    try:
+        conversation = await asyncio.to_thread(_closing_conversation, call_sid, user_info)
+        route, start = _closing_route(), time.perf_counter()
+        closing = await _achat_completion(conversation, call_sid, route)
+        _record_turn(route, start, "")
+        return closing
+
+    except Exception as e:
+        logger.error(f"Error generating closing: {e}")
+        return FALLBACK_CLOSING
+
+def stream_closing(call_sid=None, user_info=None):
+    """Like generate_closing, but yields the closing sentence by sentence."""
+    try:
+        conversation = _closing_conversation(call_sid, user_info)
+    except Exception as e:
+        logger.error(f"Error generating closing: {e}")
+        yield FALLBACK_CLOSING
+        return
+
+    route, start = _closing_route(), time.perf_counter()
+    for sentence, _ in _stream_sentences(conversation, call_sid, FALLBACK_CLOSING, route=route):
+        if start is not None:
+            _record_turn(route, start, "")
+            start = None
+        yield sentence
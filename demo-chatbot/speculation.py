@@ -0,0 +1,229 @@
+"""
+Replies generated speculatively from partial speech results.
+
+<Gather> posts partial transcripts to /partial-transcript while the caller is
+still speaking. Once a partial looks stable (Twilio reports a high stability,
+or the same words arrive twice in a row) the reply to it starts generating in
+the background, without touching the history. When the final SpeechResult
+arrives, /transcribe claims the speculation if the final words match the
+partial closely enough and the history has not changed since; otherwise the
+speculation is cancelled and the reply is generated as usual.
+
+Tokens are counted as streamed deltas (about one token each). Tokens of
+speculations that were cancelled or never claimed count as wasted.
+"""
+import time
+import logging
+import threading
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
+import config
+from response_cache import normalize_utterance
+from metrics import SPECULATIONS, SPECULATION_TOKENS, SPECULATION_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def similarity(a, b):
+    """Word-level similarity of two normalized utterances, 0..1."""
+    return SequenceMatcher(None, a.split(), b.split(), autojunk=False).ratio()
+
+
+class Speculation:
+    """One reply being generated for a partial transcript; its deltas can be replayed while it runs."""
+
+    def __init__(self, call_sid, text):
+        self.call_sid = call_sid
+        self.text = normalize_utterance(text)
+        self.conversation = None
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+        self.claimed = None
+        self.outcome = None  # "hit" or why it was dropped, once decided
+        self.settled = False
+        self.prepared = threading.Event()
+        self.cancelled = threading.Event()
+        self._deltas = []
+        self._cond = threading.Condition()
+
+    @property
+    def tokens(self):
+        return len(self._deltas)
+
+    def put(self, delta):
+        with self._cond:
+            self._deltas.append(delta)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self.finished = time.monotonic()
+            self._cond.notify_all()
+
+    def deltas(self, timeout=None):
+        """Yield the reply delta by delta, from the start, waiting for the ones still being generated."""
+        timeout = config.LLM_TURN_DEADLINE if timeout is None else timeout
+        i = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: i < len(self._deltas) or self.finished, timeout):
+                    raise TimeoutError(f"speculative reply for call {self.call_sid} stalled")
+                ready = self._deltas[i:]
+                finished, error = self.finished, self.error
+            for delta in ready:
+                yield delta
+            i += len(ready)
+            if finished and i == len(self._deltas):
+                if error is not None:
+                    raise error
+                return
+
+    def result(self, timeout=None):
+        """The whole reply, or None if it failed or stalled."""
+        try:
+            return "".join(self.deltas(timeout)) or None
+        except Exception as e:
+            logger.error(f"Speculative reply for call {self.call_sid} failed: {e}")
+            return None
+
+
+class Speculator:
+    """
+    Starts speculations with `prepare(text, call_sid)` (the conversation the
+    reply would be generated from, ending with the user's words) and
+    `generate(conversation, call_sid)` (an iterator of reply deltas), one at
+    a time per call on a background pool.
+    """
+
+    def __init__(self, prepare, generate, min_stability=None, min_words=None, match_ratio=None, workers=None):
+        self.prepare = prepare
+        self.generate = generate
+        self.min_stability = config.SPECULATION_MIN_STABILITY if min_stability is None else min_stability
+        self.min_words = config.SPECULATION_MIN_WORDS if min_words is None else min_words
+        self.match_ratio = config.SPECULATION_MATCH_RATIO if match_ratio is None else match_ratio
+        self._lock = threading.Lock()
+        self._active = {}  # call_sid -> Speculation
+        self._partials = {}  # call_sid -> (sequence number, normalized text) of the last partial
+        self._executor = ThreadPoolExecutor(workers or config.SPECULATION_WORKERS, thread_name_prefix="speculate")
+        self._stats = {"started": 0, "hit": 0, "miss": 0, "superseded": 0, "discarded": 0, "none": 0,
+                       "tokens_used": 0, "tokens_wasted": 0, "saved_seconds": 0.0}
+
+    def observe(self, call_sid, text, stability=0.0, sequence=None):
+        """Handle a partial transcript; starts a speculation when it looks stable and differs from the current one."""
+        normalized = normalize_utterance(text)
+        if len(normalized.split()) < self.min_words:
+            return None
+        with self._lock:
+            previous = self._partials.get(call_sid)
+            if sequence is not None and previous and previous[0] is not None and sequence <= previous[0]:
+                return None  # partial callbacks can arrive out of order
+            self._partials[call_sid] = (sequence, normalized)
+            stable = stability >= self.min_stability or (previous is not None and previous[1] == normalized)
+            current = self._active.get(call_sid)
+            if not stable or (current and similarity(current.text, normalized) >= self.match_ratio):
+                return None
+            speculation = self._active[call_sid] = Speculation(call_sid, text)
+            self._stats["started"] += 1
+        if current:
+            self._decide(current, "superseded")
+        self._executor.submit(self._run, speculation, text)
+        return speculation
+
+    def claim(self, call_sid, text, conversation):
+        """
+        Return the speculation for the final transcript `text`, or None (and
+        cancel the speculation) unless it was generated from matching words
+        and the same history as `conversation`.
+        """
+        with self._lock:
+            speculation = self._active.pop(call_sid, None)
+            self._partials.pop(call_sid, None)
+        if speculation is None:
+            self._count("none")
+            return None
+
+        speculation.prepared.wait(config.LLM_TURN_DEADLINE)
+        context = speculation.conversation
+        matches = (
+            context is not None and speculation.error is None
+            and similarity(speculation.text, normalize_utterance(text)) >= self.match_ratio
+            and getattr(context, "version", None) == getattr(conversation, "version", None)
+            and list(context[:-1]) == list(conversation[:-1])
+        )
+        self._decide(speculation, "hit" if matches else "miss")
+        return speculation if matches else None
+
+    def discard(self, call_sid):
+        """Cancel the call's speculation (the turn ends the call, or the call is over)."""
+        with self._lock:
+            speculation = self._active.pop(call_sid, None)
+            self._partials.pop(call_sid, None)
+        if speculation:
+            self._decide(speculation, "discarded")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, active=len(self._active))
+        decided = stats["hit"] + stats["miss"]
+        tokens = stats["tokens_used"] + stats["tokens_wasted"]
+        stats["hit_rate"] = stats["hit"] / decided if decided else 0.0
+        stats["wasted_token_ratio"] = stats["tokens_wasted"] / tokens if tokens else 0.0
+        stats["saved_seconds_per_hit"] = stats["saved_seconds"] / stats["hit"] if stats["hit"] else 0.0
+        return stats
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+        if config.METRICS_ENABLED and key in ("hit", "miss", "superseded", "discarded", "none"):
+            SPECULATIONS.inc(amount, outcome=key)
+
+    def _decide(self, speculation, outcome):
+        with self._lock:
+            speculation.outcome = outcome
+            if outcome == "hit":
+                speculation.claimed = time.monotonic()
+        if outcome != "hit":
+            speculation.cancelled.set()
+        self._count(outcome)
+        self._settle(speculation)
+
+    def _settle(self, speculation):
+        """Account a speculation once it has both finished and been claimed or dropped."""
+        with self._lock:
+            if speculation.settled or speculation.outcome is None or speculation.finished is None:
+                return
+            speculation.settled = True
+        hit = speculation.outcome == "hit" and speculation.error is None
+        self._count("tokens_used" if hit else "tokens_wasted", speculation.tokens)
+        if config.METRICS_ENABLED:
+            SPECULATION_TOKENS.inc(speculation.tokens, outcome="used" if hit else "wasted")
+        if hit:
+            # Generation time the caller did not wait for: what had run by the time the final transcript came
+            saved = min(speculation.finished, speculation.claimed) - speculation.started
+            self._count("saved_seconds", saved)
+            if config.METRICS_ENABLED:
+                SPECULATION_SAVED_SECONDS.observe(saved)
+
+    def _run(self, speculation, text):
+        error = None
+        deltas = None
+        try:
+            speculation.conversation = self.prepare(text, speculation.call_sid)
+            speculation.prepared.set()
+            if not speculation.cancelled.is_set():
+                deltas = self.generate(speculation.conversation, speculation.call_sid)
+                for delta in deltas:
+                    speculation.put(delta)
+                    if speculation.cancelled.is_set():
+                        break
+        except Exception as e:
+            error = e
+            logger.error(f"Error generating a speculative reply for call {speculation.call_sid}: {e}")
+        finally:
+            if deltas is not None:
+                deltas.close()  # stops the model stream when cancelled part-way
+            speculation.prepared.set()
+            speculation.finish(error)
+            self._settle(speculation)
@@ -0,0 +1,467 @@
+import os
+import json
+import atexit
+import logging
+import time
+import sqlite3
+import importlib
+import threading
+from collections import OrderedDict
+import config
+
+logger = logging.getLogger(__name__)
+
+# Key used when no call SID is given (the legacy single "conversation.json")
+DEFAULT_KEY = "default"
+
+
+class ConflictError(Exception):
+    """A versioned save found the call saved by someone else since it was loaded."""
+
+    def __init__(self, key, current, version):
+        super().__init__(f"Conversation {key} changed concurrently (now at version {version})")
+        self.current = current
+        self.version = version
+
+
+# Every store offers load(key), load_versioned(key) -> (messages or None, version)
+# and save(key, conversation, expected_version=None) -> new version. A save with
+# expected_version raises ConflictError unless the stored version still matches
+# (optimistic concurrency); deleting a call also bumps its version.
+
+
+class FileConversationStore:
+    """
+    Legacy store: one pretty-printed JSON file per call, rewritten on every save.
+
+    The version of a call is its file's modification time; version checks are
+    only atomic within one process.
+    """
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        name = config.CONVERSATION_FILE if key == DEFAULT_KEY else f"{key}_{config.CONVERSATION_FILE}"
+        return os.path.join(self.directory, name)
+
+    def load(self, key):
+        return self.load_versioned(key)[0]
+
+    def load_versioned(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                return json.load(f), os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return None, 0
+
+    def save(self, key, conversation, expected_version=None):
+        path = self._path(key)
+        with self._lock:
+            if expected_version is not None:
+                current, version = self.load_versioned(key)
+                if version != expected_version:
+                    raise ConflictError(key, current, version)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(conversation, f, indent=2)
+            os.replace(tmp, path)
+            return os.stat(path).st_mtime_ns
+
+    def delete(self, key):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def keys(self):
+        suffix = f"_{config.CONVERSATION_FILE}"
+        names = os.listdir(self.directory)
+        keys = [name[:-len(suffix)] for name in names if name.endswith(suffix)]
+        if config.CONVERSATION_FILE in names:
+            keys.append(DEFAULT_KEY)
+        return keys
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AppendLogStore:
+    """
+    Append-only JSON-lines log of conversation updates with an LRU of hot calls.
+
+    A save only appends the messages added since the previous save. Records are
+    buffered and written by a background thread every `flush_interval` seconds
+    (write-behind; 0 writes through on every save). Once superseded records make
+    up more than `compact_ratio` of the log it is rewritten with one record per
+    live call.
+
+    The in-memory index assumes a single writing process; use the "sqlite"
+    store when several worker processes serve calls.
+    """
+
+    LOG_NAME = "conversations.log"
+    MIN_COMPACT_BYTES = 1 << 20
+
+    def __init__(self, directory, cache_size=1024, flush_interval=0.5, compact_ratio=0.5):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, self.LOG_NAME)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.compact_ratio = compact_ratio
+
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # key -> list of messages (most recent last)
+        self._index = {}  # key -> [(offset, length), ...] since the last "replace"
+        self._versions = {}  # key -> version of its latest save or delete
+        self._pending = []  # (key, op, encoded line) waiting for the next flush
+        self._pending_keys = set()
+        self._size = 0
+        self._live = 0
+
+        self._load_index()
+        self._file = open(self.path, "ab")
+        self._reader = open(self.path, "rb")
+
+        self._stop = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="conversation-flush", daemon=True)
+            self._flusher.start()
+
+    def load(self, key):
+        return self.load_versioned(key)[0]
+
+    def load_versioned(self, key):
+        with self._lock:
+            messages = self._load_locked(key)
+            return (list(messages) if messages is not None else None), self._versions.get(key, 0)
+
+    def save(self, key, conversation, expected_version=None):
+        with self._lock:
+            cached = self._load_locked(key)
+            version = self._versions.get(key, 0)
+            if expected_version is not None and expected_version != version:
+                raise ConflictError(key, list(cached) if cached is not None else None, version)
+            if cached is not None and len(conversation) >= len(cached) and conversation[:len(cached)] == cached:
+                new_messages = conversation[len(cached):]
+                if not new_messages:
+                    return version
+                op, messages = "append", new_messages
+            else:
+                op, messages = "replace", conversation
+            self._versions[key] = version + 1
+            self._enqueue(key, op, messages)
+            self._remember(key, list(conversation))
+            return version + 1
+
+    def delete(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._enqueue(key, "delete", [])
+
+    def keys(self):
+        with self._lock:
+            self._flush_locked()
+            return list(self._index)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join()
+        with self._lock:
+            self._flush_locked()
+            self._file.close()
+            self._reader.close()
+
+    def compact(self):
+        """Rewrite the log with a single "replace" record per live call."""
+        with self._lock:
+            self._flush_locked()
+            tmp_path = self.path + ".compact"
+            new_index = {}
+            with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+                for key, records in self._index.items():
+                    line = self._encode(key, "replace", self._read_records(src, records), self._versions.get(key, 0))
+                    new_index[key] = [(dst.tell(), len(line))]
+                    dst.write(line)
+                dst.flush()
+                os.fsync(dst.fileno())
+                size = dst.tell()
+
+            self._file.close()
+            self._reader.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "ab")
+            self._reader = open(self.path, "rb")
+            logger.info(f"Compacted conversation log from {self._size} to {size} bytes")
+            self._index = new_index
+            self._size = self._live = size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": len(self._index),
+                "cached_calls": len(self._cache),
+                "pending_records": len(self._pending),
+                "log_bytes": self._size,
+                "live_bytes": self._live,
+            }
+
+    def _load_locked(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        # Evicted calls may still have buffered records
+        if key in self._pending_keys:
+            self._flush_locked()
+        records = self._index.get(key)
+        if not records:
+            return None
+        messages = self._read_records(self._reader, records)
+        self._remember(key, messages)
+        return messages
+
+    def _remember(self, key, messages):
+        self._cache[key] = messages
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _enqueue(self, key, op, messages):
+        self._pending.append((key, op, self._encode(key, op, messages, self._versions[key])))
+        self._pending_keys.add(key)
+        if self.flush_interval <= 0:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        offset = self._size
+        for key, op, line in self._pending:
+            self._apply(key, op, offset, len(line))
+            offset += len(line)
+        self._file.write(b"".join(line for _, _, line in self._pending))
+        self._file.flush()
+        self._pending.clear()
+        self._pending_keys.clear()
+
+        garbage = self._size - self._live
+        if self._size > self.MIN_COMPACT_BYTES and garbage > self._size * self.compact_ratio:
+            self.compact()
+
+    def _apply(self, key, op, offset, length):
+        """Update the index for a record written at `offset`."""
+        self._size += length
+        if op == "append" and key in self._index:
+            self._index[key].append((offset, length))
+            self._live += length
+            return
+        for _, old_length in self._index.pop(key, ()):
+            self._live -= old_length
+        if op != "delete":
+            self._index[key] = [(offset, length)]
+            self._live += length
+
+    def _load_index(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        torn = False
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # A torn write at the tail of the log: the record is lost
+                    torn = True
+                    break
+                try:
+                    record = json.loads(line)
+                    self._apply(record["sid"], record["op"], offset, len(line))
+                    # Logs written before versioning have no "v": count the records
+                    self._versions[record["sid"]] = record.get("v", self._versions.get(record["sid"], 0) + 1)
+                except (ValueError, KeyError):
+                    logger.warning(f"Skipping unreadable conversation record at offset {offset}")
+                    self._size += len(line)
+                offset += len(line)
+        if torn:
+            # Cut it off, or the next record appended would continue the partial line and be lost too
+            logger.warning(f"Truncating a torn conversation record at offset {offset}")
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+        logger.info(f"Loaded conversation log index: {len(self._index)} calls, {self._size} bytes")
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing conversation log: {e}")
+
+    @staticmethod
+    def _encode(key, op, messages, version):
+        record = {"sid": key, "op": op, "v": version, "messages": messages}
+        return json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    @staticmethod
+    def _read_records(f, records):
+        messages = []
+        for offset, length in records:
+            f.seek(offset)
+            messages.extend(json.loads(f.read(length))["messages"])
+        return messages
+
+
+class SQLiteConversationStore:
+    """
+    Conversations in a SQLite database (WAL mode) that several worker processes
+    on one host can share.
+
+    Every row carries a version that saves compare-and-swap, and the call_leases
+    table holds short leases that serialize the turns of a call across
+    processes (see call_lock.py). Deleted calls keep a tombstone row so their
+    version keeps counting.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.CONVERSATION_DB
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "call_sid TEXT PRIMARY KEY, messages TEXT, version INTEGER NOT NULL, updated REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS call_leases (call_sid TEXT PRIMARY KEY, owner TEXT, expires REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def load(self, key):
+        return self.load_versioned(key)[0]
+
+    def load_versioned(self, key):
+        row = self._connection().execute(
+            "SELECT messages, version FROM conversations WHERE call_sid = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        return (json.loads(row[0]) if row[0] is not None else None), row[1]
+
+    def save(self, key, conversation, expected_version=None):
+        return self._write(key, json.dumps(conversation, separators=(",", ":")), expected_version)
+
+    def delete(self, key):
+        self._write(key, None, None)
+
+    def _write(self, key, payload, expected_version):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT messages, version FROM conversations WHERE call_sid = ?", (key,)
+            ).fetchone()
+            version = row[1] if row else 0
+            if expected_version is not None and expected_version != version:
+                conn.execute("ROLLBACK")
+                raise ConflictError(key, json.loads(row[0]) if row and row[0] is not None else None, version)
+            conn.execute(
+                "INSERT INTO conversations (call_sid, messages, version, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(call_sid) DO UPDATE SET messages = excluded.messages, "
+                "version = excluded.version, updated = excluded.updated",
+                (key, payload, version + 1, time.time()),
+            )
+            conn.execute("COMMIT")
+        except ConflictError:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version + 1
+
+    def keys(self):
+        rows = self._connection().execute("SELECT call_sid FROM conversations WHERE messages IS NOT NULL")
+        return [row[0] for row in rows]
+
+    def acquire_lease(self, key, owner, ttl):
+        """Take (or renew) the lease on a call for `ttl` seconds; False if another owner holds it."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, expires FROM call_leases WHERE call_sid = ?", (key,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO call_leases (call_sid, owner, expires) VALUES (?, ?, ?)", (key, owner, now + ttl)
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release_lease(self, key, owner):
+        self._connection().execute("DELETE FROM call_leases WHERE call_sid = ? AND owner = ?", (key, owner))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_store(kind=None, directory=None):
+    """Build a conversation store: "log", "file", "sqlite" or a "module:ClassName" path."""
+    kind = kind or config.CONVERSATION_STORE
+    if kind == "file":
+        return FileConversationStore(directory or ".")
+    if kind == "sqlite":
+        return SQLiteConversationStore(os.path.join(directory, config.CONVERSATION_DB) if directory else None)
+    if kind == "log":
+        return AppendLogStore(
+            directory or config.CONVERSATION_DIR,
+            cache_size=config.CONVERSATION_CACHE_SIZE,
+            flush_interval=config.CONVERSATION_FLUSH_INTERVAL,
+            compact_ratio=config.CONVERSATION_COMPACT_RATIO,
+        )
+    if ":" in kind:
+        # A shared store for several hosts (same interface, plus acquire_lease/release_lease)
+        module_name, _, class_name = kind.partition(":")
+        return getattr(importlib.import_module(module_name), class_name)()
+    raise ValueError(f"Unknown conversation store: {kind}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide conversation store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+                atexit.register(_store.close)
+    return _store
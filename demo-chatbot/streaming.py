@@ -0,0 +1,99 @@
+import re
+import logging
+import threading
+import contextvars
+from collections import deque
+import config
+from admission import get_generation_queue
+
+logger = logging.getLogger(__name__)
+
+# A sentence ends at . ! or ? (optionally followed by quotes/brackets) and whitespace
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+
+def split_sentences(deltas, min_chars=None):
+    """
+    Re-chunk a stream of text deltas into whole sentences.
+
+    Sentences shorter than `min_chars` are merged with the next one so very
+    short fragments ("Hi!") are not spoken on their own.
+    """
+    min_chars = config.STREAM_MIN_SENTENCE_CHARS if min_chars is None else min_chars
+    buffer = ""
+    for delta in deltas:
+        buffer += delta
+        start = 0
+        for match in SENTENCE_END.finditer(buffer):
+            if match.end() - start >= min_chars:
+                sentence = buffer[start:match.end()].strip()
+                start = match.end()
+                yield sentence
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class ReplyStream:
+    """Sentences of one bot reply, produced by a background thread and drained by webhooks."""
+
+    def __init__(self, hangup=False):
+        self.hangup = hangup
+        self.done = False
+        self._sentences = deque()
+        self._cond = threading.Condition()
+
+    def put(self, sentence):
+        with self._cond:
+            self._sentences.append(sentence)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def take(self, timeout):
+        """Wait up to `timeout` seconds for at least one sentence, then return all that are ready."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._sentences or self.done, timeout)
+            sentences = list(self._sentences)
+            self._sentences.clear()
+            return sentences, self.done and not self._sentences
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def start_reply_stream(call_sid, sentences, hangup=False):
+    """Consume a sentence iterator in the background and register it for `call_sid`."""
+    stream = ReplyStream(hangup=hangup)
+    with _streams_lock:
+        _streams[call_sid] = stream
+
+    def run():
+        try:
+            # Generation starts on the first next(); wait for a slot under the admission budget
+            with get_generation_queue().slot():
+                for sentence in sentences:
+                    stream.put(sentence)
+        except Exception as e:
+            logger.error(f"Error streaming reply for call {call_sid}: {e}")
+        finally:
+            stream.finish()
+
+    # Carry the request's context along, so stage timings keep the webhook route label
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name=f"reply-{call_sid}", daemon=True).start()
+    return stream
+
+
+def get_reply_stream(call_sid):
+    with _streams_lock:
+        return _streams.get(call_sid)
+
+
+def end_reply_stream(call_sid):
+    with _streams_lock:
+        _streams.pop(call_sid, None)
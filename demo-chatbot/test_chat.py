@@ -1,5 +1,4 @@
 from sales_bot import generate_response, get_user_info_from_call
-from conversation import load_conversation_history, save_conversation_history
 import uuid
 
 # Simulate a fake call SID
@@ -19,17 +18,7 @@ while True:
         print("🤖 Alex: Thanks for your time. Goodbye!")
         break
 
-    # Load history
-    conversation = load_conversation_history(call_sid, user_info)
-
-    # Append user message
-    conversation.append({"role": "user", "content": user_input})
-
-    # Get AI reply
+    # Get AI reply (generate_response records both turns in the history)
     bot_reply = generate_response(user_input, call_sid, user_info)
 
-    # Append bot message
-    conversation.append({"role": "assistant", "content": bot_reply})
-    save_conversation_history(call_sid, conversation)
-
     print(f"🤖 Alex: {bot_reply}")
@@ -0,0 +1,208 @@
+"""
+Pre-rendered audio for fixed and frequently repeated bot lines.
+
+Phrases are synthesized once with a local TTS backend into files named by the
+hash of the text and voice settings, kept in a size-bounded LRU directory and
+served at /tts/<hash>.wav, so TwiML can <Play> them instead of having Twilio
+synthesize the same <Say> on every turn of every call. Static phrases are
+rendered at startup; any other line is rendered in the background once it has
+been spoken TTS_RENDER_AFTER times. Lines that are not cached yet fall back
+to <Say>.
+"""
+import os
+import re
+import hashlib
+import logging
+import importlib
+import threading
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+logger = logging.getLogger(__name__)
+
+FILENAME = re.compile(r"^[0-9a-f]{64}\.wav$")
+
+
+class TTSBackend:
+    """Renders text to a WAV file; `name` and `settings` are part of the cache key."""
+
+    name = "base"
+    settings = ""
+
+    def render(self, text, path):
+        raise NotImplementedError
+
+
+class Pyttsx3Backend(TTSBackend):
+    """Offline synthesis with pyttsx3 (the engine voice_test_chat.py uses)."""
+
+    name = "pyttsx3"
+
+    def __init__(self, rate=None, voice=None):
+        import pyttsx3
+
+        self.rate = rate or config.TTS_RATE
+        self.voice = voice or config.TTS_VOICE
+        self.settings = f"rate={self.rate};voice={self.voice}"
+        self._engine = pyttsx3.init()
+        self._engine.setProperty("rate", self.rate)
+        if self.voice:
+            self._engine.setProperty("voice", self.voice)
+        # pyttsx3 engines are not thread-safe
+        self._lock = threading.Lock()
+
+    def render(self, text, path):
+        with self._lock:
+            self._engine.save_to_file(text, path)
+            self._engine.runAndWait()
+
+
+def create_backend(spec=None):
+    """Build the backend named by `spec`: "pyttsx3" or a "module:ClassName" path."""
+    spec = spec or config.TTS_BACKEND
+    if spec == "pyttsx3":
+        return Pyttsx3Backend()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class TTSCache:
+    def __init__(self, backend, directory=None, max_bytes=None, render_after=None, max_tracked=10000):
+        self.backend = backend
+        self.directory = os.path.abspath(directory or config.TTS_CACHE_DIR)
+        self.max_bytes = max_bytes or config.TTS_CACHE_MAX_BYTES
+        self.render_after = config.TTS_RENDER_AFTER if render_after is None else render_after
+        self.max_tracked = max_tracked
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._files = OrderedDict()
+        self._bytes = 0
+        self._counts = Counter()
+        self._rendering = set()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="tts")
+        self._stats = {"hits": 0, "misses": 0, "rendered": 0, "failed": 0, "evicted": 0}
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if FILENAME.match(name):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._bytes += size
+
+    def filename(self, text):
+        key = f"{self.backend.name}\0{self.backend.settings}\0{text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest() + ".wav"
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def url(self, text):
+        """The /tts URL of the rendered phrase, or None (counting the miss) if it is not cached yet."""
+        name = self.filename(text)
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+                self._stats["hits"] += 1
+                return f"/tts/{name}"
+            self._stats["misses"] += 1
+            self._counts[text] += 1
+            due = self._counts[text] >= self.render_after and name not in self._rendering
+            if len(self._counts) > self.max_tracked:
+                self._counts = Counter(dict(self._counts.most_common(self.max_tracked // 2)))
+        if due:
+            self._schedule(text, name)
+        return None
+
+    def prerender(self, phrases):
+        """Render fixed phrases in the background (skipping ones already on disk)."""
+        for text in phrases:
+            name = self.filename(text)
+            with self._lock:
+                cached = name in self._files
+            if not cached:
+                self._schedule(text, name)
+
+    def touch(self, filename):
+        """Mark a served file as recently used; False if it is not in the cache."""
+        with self._lock:
+            if filename not in self._files:
+                return False
+            self._files.move_to_end(filename)
+        try:
+            os.utime(self.path(filename))
+        except OSError:
+            pass
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, files=len(self._files), bytes=self._bytes)
+
+    def _schedule(self, text, name):
+        with self._lock:
+            if name in self._rendering:
+                return
+            self._rendering.add(name)
+        self._executor.submit(self._render, text, name)
+
+    def _render(self, text, name):
+        # Keep the .wav extension: some pyttsx3 drivers pick the output format from it
+        tmp = self.path(name[:-len(".wav")] + ".tmp.wav")
+        try:
+            self.backend.render(text, tmp)
+            os.replace(tmp, self.path(name))
+            size = os.path.getsize(self.path(name))
+            with self._lock:
+                self._files[name] = size
+                self._bytes += size
+                self._stats["rendered"] += 1
+                self._counts.pop(text, None)
+                evicted = self._evict()
+            for old in evicted:
+                try:
+                    os.remove(self.path(old))
+                except OSError:
+                    pass
+            logger.info(f"Rendered TTS for {text[:40]!r} ({size} bytes)")
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            logger.error(f"Error rendering TTS for {text[:40]!r}: {e}")
+        finally:
+            with self._lock:
+                self._rendering.discard(name)
+
+    def _evict(self):
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self._stats["evicted"] += 1
+            evicted.append(name)
+        return evicted
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """Return the process-wide TTS cache, or None when TTS_CACHE_ENABLED is off or the backend fails."""
+    global _cache
+    if not config.TTS_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = TTSCache(create_backend())
+                except Exception as e:
+                    logger.error(f"TTS cache disabled, backend failed to start: {e}")
+                    config.TTS_CACHE_ENABLED = False
+                    return None
+    return _cache
@@ -0,0 +1,187 @@
+"""
+Tiered model routing of conversation turns.
+
+Each customer utterance is classified cheaply before any model call:
+
+  template  "can you repeat that" -> the bot's last line again, no model call
+  small     short acknowledgements, closings and utterances the classifier
+            scores as simple -> a cheaper model with TURN_SMALL_MAX_TOKENS
+  main      hesitation, objections and negations (OBJECTION_INDICATORS),
+            long utterances and anything the classifier is unsure of -> the
+            main model
+
+The rules use the configured indicator lists; the classifier is a small
+naive Bayes model over words, trained at startup on built-in examples (plus
+TURN_CLASSIFIER_DATA), or any "module:ClassName" with predict(text) returning
+the probability that a turn is simple. Every decision is logged with its
+reason and confidence, and its generation time is recorded per tier, so the
+thresholds can be tuned from TURN_ROUTER_LOG or /metrics.
+"""
+import json
+import math
+import time
+import logging
+import threading
+import importlib
+from collections import Counter, namedtuple
+import config
+from conversation import hesitation_matcher, objection_matcher, acknowledgement_matcher, repeat_matcher
+from response_cache import normalize_utterance
+from metrics import TURN_ROUTES, TURN_TIER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+Route = namedtuple("Route", "tier reason confidence max_tokens reply")
+
+REPEAT_PREFIX = "Of course. "
+
+# Seed examples for the default classifier: "simple" turns a short, generic reply handles well
+SIMPLE_EXAMPLES = [
+    "okay", "yes", "sure thing", "sounds good", "got it thanks", "alright go on", "hello", "hi there",
+    "who is this", "yes speaking", "hello who's calling", "what company are you with", "what's your name",
+    "that's interesting", "tell me more", "go ahead", "okay what else", "nice", "cool", "i see",
+    "what was that", "sorry what", "uh huh", "can you hear me", "hold on a second", "one moment please",
+    "yes this is him", "yes this is her", "i'm listening", "okay continue",
+]
+COMPLEX_EXAMPLES = [
+    "how does it compare to google home", "what happens to my data if i cancel",
+    "does it work with my existing lights and thermostat", "why is it more expensive than the competitor",
+    "i had a bad experience with your support last time", "can you explain the difference between the plans",
+    "what's the total cost including installation", "is there a contract or can i cancel anytime",
+    "my wife is worried about privacy with the cameras", "how long does the setup take and do you send someone",
+    "i already have alexa why would i need this", "what discounts do you have for existing customers",
+    "what if it doesn't work with my router", "how do i return it if i don't like it",
+    "can i pay monthly instead of annually", "does the price go up after the first year",
+    "which model would you recommend for a two bedroom apartment", "what warranty comes with the hub",
+    # Short objections: few words, but the main model has to handle them
+    "not interested", "no thanks", "that's a scam", "i don't trust this", "i already have one",
+    "why should i care", "my husband decides", "my wife handles that", "too pricey", "stop calling me",
+    "sounds fishy", "i'm happy with what i have",
+]
+
+
+class NaiveBayesClassifier:
+    """
+    Multinomial naive Bayes over words; predict() is P(simple). There is no
+    length feature: short objections are as short as acknowledgements.
+    """
+
+    def __init__(self, examples=()):
+        self._counts = {"simple": Counter(), "complex": Counter()}
+        self._docs = Counter()
+        for text, label in examples:
+            self.learn(text, label)
+
+    @staticmethod
+    def features(text):
+        return normalize_utterance(text).split()
+
+    def learn(self, text, label):
+        self._counts[label].update(self.features(text))
+        self._docs[label] += 1
+
+    def predict(self, text):
+        vocabulary = len(set(self._counts["simple"]) | set(self._counts["complex"])) or 1
+        total_docs = sum(self._docs.values()) or 1
+        scores = {}
+        for label, counts in self._counts.items():
+            total = sum(counts.values())
+            score = math.log((self._docs[label] + 1) / (total_docs + 2))
+            for feature in self.features(text):
+                score += math.log((counts[feature] + 1) / (total + vocabulary))
+            scores[label] = score
+        # P(simple) from the two log scores, without overflowing
+        return 1.0 / (1.0 + math.exp(max(-50.0, min(50.0, scores["complex"] - scores["simple"]))))
+
+
+def load_examples(path):
+    """(text, label) pairs from a JSON-lines file of {"text", "label"} (decision logs with "tier" work too)."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                label = record.get("label") or ("simple" if record.get("tier") in ("small", "template") else "complex")
+                yield record["text"], label
+
+
+def create_classifier(spec=None):
+    """Build the classifier named by `spec`: "bayes" or a "module:ClassName" path."""
+    spec = spec or config.TURN_CLASSIFIER
+    if spec == "bayes":
+        examples = [(t, "simple") for t in SIMPLE_EXAMPLES] + [(t, "complex") for t in COMPLEX_EXAMPLES]
+        if config.TURN_CLASSIFIER_DATA:
+            examples += list(load_examples(config.TURN_CLASSIFIER_DATA))
+        return NaiveBayesClassifier(examples)
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class TurnRouter:
+    def __init__(self, classifier=None, max_simple_words=None, min_confidence=None, log_path=None):
+        self.classifier = classifier or create_classifier()
+        self.max_simple_words = max_simple_words or config.TURN_SIMPLE_MAX_WORDS
+        self.min_confidence = config.TURN_SIMPLE_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.log_path = config.TURN_ROUTER_LOG if log_path is None else log_path
+        self._lock = threading.Lock()
+        self._stats = {}  # tier -> {"turns", "seconds"}
+        self._reasons = Counter()
+
+    def route(self, text, conversation=()):
+        """Pick the tier for a customer utterance, given the conversation so far."""
+        words = len(normalize_utterance(text).split())
+        if hesitation_matcher().search(text):
+            return self._decide("main", "hesitation")
+        if repeat_matcher().search(text) and words <= self.max_simple_words:
+            last = next((m.get("content") for m in reversed(list(conversation))
+                         if m["role"] == "assistant" and m.get("content")), None)
+            if last:
+                # Repeating a repeat must not stack the prefix
+                while last.startswith(REPEAT_PREFIX):
+                    last = last[len(REPEAT_PREFIX):]
+                return self._decide("template", "repeat", reply=f"{REPEAT_PREFIX}{last}")
+        if objection_matcher().search(text):
+            return self._decide("main", "objection")
+        if words > self.max_simple_words:
+            return self._decide("main", "long")
+        if words <= 4 and acknowledgement_matcher().search(text):
+            return self._decide("small", "acknowledgement")
+        confidence = self.classifier.predict(text)
+        if confidence >= self.min_confidence:
+            return self._decide("small", "classifier", confidence)
+        return self._decide("main", "classifier", confidence)
+
+    def closing(self):
+        """Closings are short and formulaic: the cheaper model."""
+        return self._decide("small", "closing")
+
+    def main(self, reason="default"):
+        return Route("main", reason, None, config.TURN_MAIN_MAX_TOKENS, None)
+
+    def record(self, route, seconds, text=""):
+        """Log a routed turn and how long its reply took to generate."""
+        with self._lock:
+            tier = self._stats.setdefault(route.tier, {"turns": 0, "seconds": 0.0})
+            tier["turns"] += 1
+            tier["seconds"] += seconds
+            self._reasons[(route.tier, route.reason)] += 1
+        confidence = "" if route.confidence is None else f", p(simple)={route.confidence:.2f}"
+        logger.info(f"Turn routed to {route.tier} ({route.reason}{confidence}) in {seconds * 1000:.0f}ms")
+        if config.METRICS_ENABLED:
+            TURN_ROUTES.inc(tier=route.tier, reason=route.reason)
+            TURN_TIER_SECONDS.observe(seconds, tier=route.tier)
+        if self.log_path:
+            record = {"ts": time.time(), "text": text, "tier": route.tier, "reason": route.reason,
+                      "confidence": route.confidence, "seconds": round(seconds, 4)}
+            with self._lock, open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def stats(self):
+        with self._lock:
+            tiers = {tier: dict(values, mean_seconds=values["seconds"] / values["turns"])
+                     for tier, values in self._stats.items()}
+            reasons = {f"{tier}/{reason}": count for (tier, reason), count in self._reasons.items()}
+        return {"tiers": tiers, "reasons": reasons}
+
+    def _decide(self, tier, reason, confidence=None, reply=None):
+        max_tokens = config.TURN_SMALL_MAX_TOKENS if tier == "small" else config.TURN_MAIN_MAX_TOKENS
+        return Route(tier, reason, confidence, max_tokens, reply)
@@ -1,25 +1,52 @@
 import logging
+import threading
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 import config
+from call_profiles import bind_profile
+from crm import get_crm
+from sales_bot import pregenerate_introduction
 
 logger = logging.getLogger(__name__)
 
+_client = None
+_client_lock = threading.Lock()
+
 def initialize_twilio_client():
     """Initialize and return a Twilio client."""
-    return Client(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN)
+    http_client = TwilioHttpClient(pool_connections=True)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.DIALER_CONCURRENCY)
+    http_client.session.mount("https://", adapter)
+    http_client.session.mount("http://", adapter)
+
+    client = Client(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN, http_client=http_client)
+    if config.TWILIO_API_BASE_URL:
+        # Point the REST API at a stand-in (e.g. fake_services.FakeTwilioServer)
+        client.api.base_url = config.TWILIO_API_BASE_URL
+    return client
+
+def get_twilio_client():
+    """Return the process-wide Twilio client, sharing its connection pool between calls."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = initialize_twilio_client()
+    return _client
 
 def make_outbound_call(to_number, webhook_url, user_info=None):
     """
     Make an outbound call using Twilio.
-    
+
     Args:
         to_number: The phone number to call
         webhook_url: The base webhook URL
-        user_info: User information dictionary
+        user_info: User information dictionary, bound to the call SID for the webhooks
     """
     try:
-        client = initialize_twilio_client()
-        
+        client = get_twilio_client()
+
         # Make the call
         call = client.calls.create(
             to=to_number,
@@ -28,39 +55,39 @@ def make_outbound_call(to_number, webhook_url, user_info=None):
             status_callback=f"{webhook_url}/call-status",
             status_callback_method="POST"
         )
-        
-        logger.info(f"Call initiated with SID: {call.sid}")
-        return call.sid
-        
     except Exception as e:
         logger.error(f"Error making outbound call: {e}")
         return None
 
-def call_sales_prospects(prospects_list, webhook_url):
+    # The phone is ringing from here on: a failure below must not report the
+    # call as failed, or the dialer would call the prospect a second time
+    logger.info(f"Call initiated with SID: {call.sid}")
+    if user_info:
+        try:
+            bind_profile(call.sid, to_number, user_info)
+        except Exception as e:
+            logger.error(f"Error binding the profile to call {call.sid}: {e}")
+    try:
+        get_crm().prefetch(call.sid, to_number, user_info)
+    except Exception as e:
+        logger.error(f"Error prefetching the CRM record for call {call.sid}: {e}")
+    if config.PREGENERATE_INTROS:
+        try:
+            pregenerate_introduction(call.sid, user_info)
+        except Exception as e:
+            logger.error(f"Error pregenerating the introduction for call {call.sid}: {e}")
+    return call.sid
+
+def call_sales_prospects(prospects, webhook_url, checkpoint_path=None):
     """
-    Make outbound sales calls to a list of prospects.
-    
+    Make outbound sales calls to a list or stream of prospects.
+
     Args:
-        prospects_list: List of dictionaries containing prospect information
-                        Each dict should have 'phone' and optionally 'user_info'
+        prospects: Iterable of dictionaries containing prospect information
+                   Each dict should have 'phone' and optionally 'user_info'
         webhook_url: The base webhook URL
+        checkpoint_path: Optional file recording progress, to resume an interrupted campaign
     """
-    import time
-    
-    for prospect in prospects_list:
-        phone_number = prospect.get('phone')
-        user_info = prospect.get('user_info')
-        
-        if phone_number:
-            logger.info(f"Calling prospect at {phone_number}...")
-            call_sid = make_outbound_call(phone_number, webhook_url, user_info)
-            
-            if call_sid:
-                logger.info(f"Call initiated to {phone_number} with SID: {call_sid}")
-            else:
-                logger.error(f"Failed to initiate call to {phone_number}")
-            
-            # Wait a few seconds between calls to avoid rate limiting
-            time.sleep(3)
-        else:
-            logger.warning("Skipping prospect with no phone number")
+    from dialer import Dialer
+
+    return Dialer(webhook_url, checkpoint_path=checkpoint_path).run(prospects)
@@ -0,0 +1,120 @@
+"""TwiML building blocks shared by the Flask and ASGI webhook servers."""
+from twilio.twiml.voice_response import Gather, Start
+import config
+from streaming import end_reply_stream
+from metrics import span
+from tts_cache import get_tts_cache
+from idempotency import turn_url
+from ngrok_manager import public_base_url
+
+VOICE = "Polly.Joanna-Neural"
+LISTEN_PROMPT = "Please speak after the tone."
+
+
+def speak(verb, text, inline=False):
+    """
+    <Play> the pre-rendered audio for `text` when it is cached, otherwise <Say>
+    it. The audio URL is absolute when the public base URL is known. TwiML sent
+    `inline` through the REST API has no document URL for Twilio to resolve a
+    relative one against, so without a known base it falls back to <Say>.
+    """
+    cache = get_tts_cache()
+    url = cache.url(text) if cache else None
+    if url:
+        base = public_base_url()
+        if base:
+            url = base + url
+        elif inline:
+            url = None
+    if url:
+        verb.play(url)
+    else:
+        verb.say(text, voice=VOICE)
+
+
+def prerender_static_phrases():
+    """Render the fixed prompts ahead of the first call (no-op with the TTS cache off)."""
+    from sales_bot import FALLBACK_RESPONSE, FALLBACK_CLOSING
+
+    cache = get_tts_cache()
+    if cache:
+        cache.prerender([LISTEN_PROMPT, FALLBACK_RESPONSE, FALLBACK_CLOSING, config.ADMISSION_FILLER])
+
+
+def append_gather(response):
+    """Listen for the caller's next utterance, re-entering /voice if they stay silent."""
+    partials = {'partialResultCallback': '/partial-transcript'} if config.SPECULATIVE_REPLIES else {}
+    gather = Gather(
+        input='speech',
+        action=turn_url('/transcribe'),
+        speechTimeout='auto',
+        speechModel='experimental_conversations',
+        language='en-US',
+        hints=','.join(config.CLOSING_INDICATORS),
+        **partials
+    )
+    speak(gather, LISTEN_PROMPT)
+    response.append(gather)
+    response.redirect(turn_url('/voice'))
+
+
+def append_reply(response, job, filler=False):
+    """
+    Speak a turn's reply from the generation queue and listen again (or hang up
+    after a closing). While it is still queued, redirect to /pending-reply, after
+    the filler line on the turn's first response. /pending-reply already waits
+    for the reply, so the optional ADMISSION_FILLER_PAUSE is only added while
+    the job is still waiting for a slot, not once it is being generated.
+    """
+    from sales_bot import FALLBACK_RESPONSE, FALLBACK_CLOSING
+
+    if job is not None and not job.rejected and not job.done:
+        if filler:
+            speak(response, config.ADMISSION_FILLER)
+            if config.ADMISSION_FILLER_PAUSE > 0 and job.started is None:
+                response.pause(length=config.ADMISSION_FILLER_PAUSE)
+        response.redirect(turn_url('/pending-reply'))
+        return
+
+    hangup = job is not None and job.hangup
+    text = job.text() if job is not None and not job.rejected else None
+    speak(response, text or (FALLBACK_CLOSING if hangup else FALLBACK_RESPONSE))
+    if hangup:
+        response.hangup()
+    else:
+        append_gather(response)
+
+
+def start_media_stream(response):
+    """Fork the caller's audio to /media-stream; replies then arrive as call updates."""
+    start = Start()
+    start.stream(url=config.MEDIA_STREAM_URL, track="inbound_track")
+    response.append(start)
+
+
+def append_listen(response):
+    """Keep the call open while the media stream listens for the caller."""
+    response.pause(length=config.MEDIA_LISTEN_SECONDS)
+
+
+def append_reply_chunk(response, call_sid, stream, sentences, done):
+    """Say the sentences of a streamed reply taken so far and redirect back until it is complete."""
+    for sentence in sentences:
+        speak(response, sentence)
+
+    if not done:
+        if not sentences:
+            response.pause(length=1)
+        response.redirect(turn_url('/continue-reply'))
+        return
+
+    end_reply_stream(call_sid)
+    if stream and stream.hangup:
+        response.hangup()
+    else:
+        append_gather(response)
+
+
+def render_twiml(response):
+    with span("twiml_render"):
+        return str(response)
@@ -1,69 +1,208 @@
-import os
-import openai
-import speech_recognition as sr
+"""
+Talk to the sales bot through your microphone and speakers.
+
+Listening, thinking and speaking run as a pipeline instead of taking turns:
+the microphone is captured continuously into a ring buffer and cut into
+utterances by the energy endpointer; each utterance is transcribed locally with
+faster-whisper and answered through sales_bot.stream_response, and the reply is
+spoken sentence by sentence as soon as each sentence is generated. Speaking
+over the bot (barge-in) stops its playback. Per-turn stage timings are printed,
+so this doubles as a latency lab.
+
+    python voice_test_chat.py                   # say "goodbye" to end
+    python voice_test_chat.py --barge-in-db -30 # less sensitive barge-in (e.g. without headphones)
+"""
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import pyaudio
 import pyttsx3
-from dotenv import load_dotenv
-
-# Load API key
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# Initialize speech engine
-engine = pyttsx3.init()
-engine.setProperty("rate", 160)
-
-# AI system prompt
-conversation = [
-    {
-        "role": "system",
-        "content": """
-        You are Alex, an AI sales representative for TechInnovate Solutions.
-        Your job is to sell smart home devices and subscription services to customers.
-        Be friendly, persuasive, and use professional sales techniques.
-        """
-    }
-]
-
-# Initialize recognizer
-r = sr.Recognizer()
-
-print("🎙️ Speak into your mic. Say 'goodbye' to end.\n")
-
-while True:
+import config
+from audio import ASR_RATE, RingBuffer, Endpointer
+from asr import WhisperTranscriber
+from conversation import detect_conversation_end, reset_conversation
+from sales_bot import stream_response, stream_introduction, stream_closing
+
+CALL_SID = "voice-console"
+FRAME = ASR_RATE // 50  # 20 ms frames, the endpointer's frame length
+USER_INFO = {"name": "there", "interests": "smart home devices"}
+
+
+class Microphone:
+    """Captures 16 kHz mono audio continuously and queues finished utterances."""
+
+    def __init__(self, utterances, on_speech_start, barge_in_db):
+        self.utterances = utterances
+        self.on_speech_start = on_speech_start
+        self.endpointer = Endpointer()
+        self.listen_db = self.endpointer.threshold_db
+        self.barge_in_db = barge_in_db
+        self.buffer = RingBuffer(int((config.MEDIA_MAX_UTTERANCE_SECONDS + 1) * ASR_RATE))
+        self.preroll = RingBuffer(ASR_RATE // 3)
+        self.speaking = threading.Event()
+        self._pending = np.empty(0, dtype=np.float32)
+        self._audio = pyaudio.PyAudio()
+        self._stream = None
+
+    def start(self):
+        self._stream = self._audio.open(format=pyaudio.paInt16, channels=1, rate=ASR_RATE, input=True,
+                                        frames_per_buffer=FRAME, stream_callback=self._callback)
+        self._stream.start_stream()
+
+    def stop(self):
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+        self._audio.terminate()
+
+    def _callback(self, data, frame_count, time_info, status):
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+        self._pending = np.concatenate((self._pending, samples))
+        while len(self._pending) >= FRAME:
+            frame, self._pending = self._pending[:FRAME], self._pending[FRAME:]
+            self._feed(frame)
+        return None, pyaudio.paContinue
+
+    def _feed(self, frame):
+        # While the bot is talking, only louder speech counts, so its own voice does not barge in
+        self.endpointer.threshold_db = self.barge_in_db if self.speaking.is_set() else self.listen_db
+        event = self.endpointer.feed(frame)
+        if event == "start":
+            self.buffer.clear()
+            self.buffer.write(self.preroll.read())
+            self.on_speech_start()
+        if self.endpointer.in_speech or event == "end":
+            self.buffer.write(frame)
+            if event == "end":
+                self.utterances.put((time.perf_counter(), self.buffer.read()))
+                self.buffer.clear()
+        else:
+            self.preroll.write(frame)
+
+
+class Speaker:
+    """Speaks queued sentences on its own thread; interrupt() drops the rest of the current reply."""
+
+    def __init__(self, microphone):
+        self.microphone = microphone
+        self.sentences = queue.Queue()
+        self.engine = pyttsx3.init()
+        self.engine.setProperty("rate", config.TTS_RATE)
+        self.utterance_ends = {}
+        self._latest_turn = 0
+        self._cancelled_turn = -1
+        self._spoken_turns = set()
+
+    def say(self, turn, sentence):
+        self._latest_turn = turn
+        self.sentences.put((turn, sentence))
+
+    def interrupt(self):
+        self._cancelled_turn = self._latest_turn
+        if self.microphone.speaking.is_set():
+            print("\n✋ (barge-in)")
+            self.engine.stop()
+
+    def run(self):
+        while True:
+            turn, sentence = self.sentences.get()
+            if sentence is None:
+                return
+            if turn <= self._cancelled_turn:
+                continue
+            if turn not in self._spoken_turns:
+                self._spoken_turns.add(turn)
+                if turn in self.utterance_ends:
+                    waited = time.perf_counter() - self.utterance_ends.pop(turn)
+                    print(f"⏱️  end of speech -> bot speaks {waited * 1000:.0f}ms")
+            self.microphone.speaking.set()
+            try:
+                self.engine.say(sentence)
+                self.engine.runAndWait()
+            finally:
+                if self.sentences.empty():
+                    self.microphone.speaking.clear()
+
+
+def speak_reply(speaker, turn, sentences, timings):
+    """Queue each sentence for speech as it arrives; returns the whole reply."""
+    spoken = []
+    for sentence in sentences:
+        if not spoken:
+            timings["first_sentence"] = time.perf_counter()
+            print("🤖 Alex: ", end="", flush=True)
+        print(sentence, end=" ", flush=True)
+        spoken.append(sentence)
+        speaker.say(turn, sentence)
+    print()
+    return " ".join(spoken)
+
+
+def print_timings(timings):
+    stages = [
+        ("transcribe", timings["transcribed"] - timings["utterance_end"]),
+        ("first sentence", timings.get("first_sentence", timings["replied"]) - timings["transcribed"]),
+        ("full reply", timings["replied"] - timings["transcribed"]),
+    ]
+    print("⏱️  " + " | ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in stages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice console for the sales bot")
+    parser.add_argument("--barge-in-db", type=float, default=-35,
+                        help="Level (dBFS) the caller must exceed to interrupt the bot")
+    parser.add_argument("--keep-history", action="store_true", help="Continue the previous console conversation")
+    args = parser.parse_args()
+
+    if not args.keep_history:
+        reset_conversation(CALL_SID)
+
+    utterances = queue.Queue()
+    speaker = None
+    microphone = Microphone(utterances, lambda: speaker and speaker.interrupt(), args.barge_in_db)
+    speaker = Speaker(microphone)
+    speaker_thread = threading.Thread(target=speaker.run, daemon=True)
+    speaker_thread.start()
+
+    transcriber = WhisperTranscriber()
+    print("⏳ Loading speech model...")
+    transcriber.transcribe(np.zeros(ASR_RATE // 2, dtype=np.float32))
+
+    microphone.start()
+    print("🎙️ Speak into your mic. Say 'goodbye' to end.\n")
+    speak_reply(speaker, 0, stream_introduction(CALL_SID, USER_INFO), {})
+
+    turn = 0
     try:
-        with sr.Microphone() as source:
-            print("🧑 You: ", end="", flush=True)
-            audio = r.listen(source)
-            user_input = r.recognize_google(audio)
-            print(user_input)
-
-            if "goodbye" in user_input.lower():
-                response = "Thank you for your time. Have a great day!"
-                engine.say(response)
-                engine.runAndWait()
-                print("🤖 Alex:", response)
+        while True:
+            ended, audio = utterances.get()
+            turn += 1
+            timings = {"utterance_end": ended}
+            user_input = transcriber.transcribe(audio)
+            timings["transcribed"] = time.perf_counter()
+            if not user_input:
+                continue
+            speaker.utterance_ends[turn] = ended
+            print(f"🧑 You: {user_input}")
+
+            if detect_conversation_end(user_input):
+                speak_reply(speaker, turn, stream_closing(CALL_SID, USER_INFO), timings)
+                timings["replied"] = time.perf_counter()
+                print_timings(timings)
                 break
 
-            # Add user message to history
-            conversation.append({"role": "user", "content": user_input})
-
-            # Call OpenAI
-            reply = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=conversation
-            )
-
-            bot_message = reply.choices[0].message['content']
-            conversation.append({"role": "assistant", "content": bot_message})
-
-            # Speak response
-            print("🤖 Alex:", bot_message)
-            engine.say(bot_message)
-            engine.runAndWait()
-
-    except sr.UnknownValueError:
-        print("❌ Could not understand audio. Please try again.")
-    except sr.RequestError as e:
-        print("❌ API error:", e)
-    except Exception as ex:
-        print("❌ Unexpected error:", ex)
+            speak_reply(speaker, turn, stream_response(user_input, CALL_SID, USER_INFO), timings)
+            timings["replied"] = time.perf_counter()
+            print_timings(timings)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        speaker.sentences.put((None, None))
+        speaker_thread.join(30)
+        microphone.stop()
+
+
+if __name__ == "__main__":
+    main()
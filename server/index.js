@@ -3,6 +3,7 @@ import cors from "cors";
 import dotenv from "dotenv";
 import connectDB from "./db.js";
 import Conversation from "./models/Conversation.js";
+import PromptTemplate from "./models/PromptTemplate.js";
 import Product from './models/Product.js';
 import axios from 'axios';
 import fs from 'fs';
@@ -14,7 +15,7 @@ connectDB();
 
 const app = express();
 app.use(cors());
-app.use(express.json());
+app.use(express.json({ limit: "10mb" }));
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -30,6 +31,66 @@ app.post("/api/save-conversation", async (req, res) => {
   }
 });
 
+// Batched uploads from the bot's outbox. Upserts by call_sid, so a batch
+// retried after a timeout does not create duplicate conversations.
+app.post("/api/save-conversations", async (req, res) => {
+  try {
+    const { conversations } = req.body;
+    if (!Array.isArray(conversations)) {
+      return res.status(400).json({ error: "conversations must be an array" });
+    }
+    console.log(`📥 Received ${conversations.length} conversations`);
+    const result = await Conversation.bulkWrite(
+      conversations.map((convo) => ({
+        updateOne: {
+          filter: { call_sid: convo.call_sid },
+          update: { $set: convo },
+          upsert: true,
+        },
+      })),
+      { ordered: false }
+    );
+    res.json({
+      message: "Conversations saved",
+      count: result.upsertedCount + result.matchedCount,
+    });
+  } catch (err) {
+    console.error("❌ Failed to save batch:", err.message);
+    res.status(500).json({ error: err.message });
+  }
+});
+
+// Prompt templates referenced by uploaded conversations. A template id is
+// immutable (the bot registers a new version instead), so existing ids are kept.
+app.post("/api/prompt-templates", async (req, res) => {
+  try {
+    const { templates } = req.body;
+    if (!templates || typeof templates !== "object") {
+      return res.status(400).json({ error: "templates must be an object" });
+    }
+    const ids = Object.keys(templates);
+    await PromptTemplate.bulkWrite(
+      ids.map((id) => ({
+        updateOne: {
+          filter: { template_id: id },
+          update: { $setOnInsert: { template_id: id, text: templates[id] } },
+          upsert: true,
+        },
+      })),
+      { ordered: false }
+    );
+    res.json({ message: "Templates saved", count: ids.length });
+  } catch (err) {
+    console.error("❌ Failed to save templates:", err.message);
+    res.status(500).json({ error: err.message });
+  }
+});
+
+app.get("/api/prompt-templates", async (req, res) => {
+  const templates = await PromptTemplate.find();
+  res.json(templates);
+});
+
 app.post("/api/call", async (req, res) => {
   try {
     console.log("📞 Incoming call request:", req.body);
@@ -3,6 +3,9 @@ import mongoose from "mongoose";
 const messageSchema = new mongoose.Schema({
   role: String,
   content: String,
+  // System prompts are stored as a reference into the PromptTemplate registry
+  template: String,
+  params: Object,
 });
 
 const conversationSchema = new mongoose.Schema({
@@ -0,0 +1,10 @@
+import mongoose from "mongoose";
+
+// Versioned prompt templates referenced by conversation messages ({template, params})
+const promptTemplateSchema = new mongoose.Schema({
+  template_id: { type: String, required: true, unique: true },
+  text: { type: String, required: true },
+  createdAt: { type: Date, default: Date.now },
+});
+
+export default mongoose.model("PromptTemplate", promptTemplateSchema);